@@ -6,5 +6,6 @@ import sys
 
 if __name__ == '__main__':
     pub_dates, query_list, save_dir, _, _, _, _ = drt.parse_args(sys.argv[1:])
-    drt.doi_search_crossref(query_list, pub_dates, save_dir)
+    workers, _, crossref_rate = drt.parse_limits(sys.argv[1])
+    drt.doi_search_crossref(query_list, pub_dates, save_dir, workers=workers, rate=crossref_rate)
     drt.doi_unique(query_list, save_dir)
\ No newline at end of file
@@ -2,10 +2,23 @@
 Functions to retrieve DOIs using semantic scholar API
 """
 
-import requests
 import time
 import os
+import json
+import threading
 import tomllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import http_client
+
+import doi_set
+
+SEARCH_STATE_FILE = "search_state.json"
+SEARCH_WORKERS = 8          # paging chains run concurrently
+SEM_SCHOLAR_RATE = 1.0      # Semantic Scholar requests per second, shared by all chains
+CROSSREF_RATE = 10.0        # Crossref requests per second, shared by all chains
 
 
 def sem_scholar_bulk(query, pub_dates, use_token=False):
@@ -23,20 +36,8 @@ def sem_scholar_bulk(query, pub_dates, use_token=False):
     }
     if use_token is not False:
         params.update({"token": use_token})
-    response = requests.get(base_url, headers=headers, params=params)
-    count = 0
-    while response.status_code != 200:
-        print(
-            "Error: "
-            + str(response.status_code)
-            + " trying request again, attempt "
-            + str(count + 1)
-        )
-        time.sleep(30)
-        response = requests.get(base_url, headers=headers, params=params)
-        count += 1
-        if count == 10:
-            break
+    response = http_client.get(base_url, headers=headers, params=params, retries=10, backoff=2.0)
+    response.raise_for_status()
     print(
         "Request successful for pub date = {pub_dates} and query = {query}".format(
             pub_dates=pub_dates, query=query
@@ -46,21 +47,43 @@ def sem_scholar_bulk(query, pub_dates, use_token=False):
     return data
 
 
-def bulk_search_doi_pubtype(query, pub_dates):
+def sem_scholar_pages(query, pub_dates, token=False, bucket=None):
     """
-    Function that takes a query and pub dates and returns a dict of DOIs and pubtypes
+    Generator over the pages of a bulk search, starting from a resume token
+    (False for the first page). Yields (papers, next_token) for each page;
+    next_token is None on the last page. Each request waits for a token from
+    bucket when given, otherwise pages are fetched one second apart
+    """
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        data = sem_scholar_bulk(query, pub_dates, token)
+        yield data["data"], data["token"]
+        if data["token"] is None:
+            return
+        token = data["token"]
+        if bucket is None:
+            time.sleep(1)
+
+
+def page_doi_dict(papers):
+    """
+    Function that takes a page of Semantic Scholar papers and returns a dict of DOIs and pubtypes
     """
-    data = sem_scholar_bulk(query, pub_dates)
     doi_dict = {}
-    for paper in data["data"]:
+    for paper in papers:
         if "DOI" in paper["externalIds"]:
             doi_dict[paper["externalIds"]["DOI"]] = paper["publicationTypes"]
-    while data["token"] is not None:
-        data = sem_scholar_bulk(query, pub_dates, data["token"])
-        for paper in data["data"]:
-            if "DOI" in paper["externalIds"]:
-                doi_dict[paper["externalIds"]["DOI"]] = paper["publicationTypes"]
-        time.sleep(1)
+    return doi_dict
+
+
+def bulk_search_doi_pubtype(query, pub_dates):
+    """
+    Function that takes a query and pub dates and returns a dict of DOIs and pubtypes
+    """
+    doi_dict = {}
+    for papers, _ in sem_scholar_pages(query, pub_dates):
+        doi_dict.update(page_doi_dict(papers))
     return doi_dict
 
 
@@ -71,7 +94,7 @@ def doi_dict_filter(doi_dict, pub_type, pub_skip):
     """
     doi_list = []
     if pub_type is None:
-        for doi in doi_dict.items():
+        for doi in doi_dict:
             doi_list.append(doi)
         return doi_list
     for doi, pub_types in doi_dict.items():
@@ -88,50 +111,143 @@ def storeDOI(dois, save_dir):  # Function to save list of dois to file
             save_file.write(doi + "\n")
 
 
-def get_dois_sem_sch(query, pub_dates, save_dir, pub_type=None, pub_skip=None):
+def search_params(engine, query, pub_dates, pub_type=None, pub_skip=None):
+    """
+    Function to return the parameters a search checkpoint is valid for, as they
+    read back from search_state.json
+    """
+    return json.loads(json.dumps({
+        "engine": engine,
+        "query": query,
+        "pub_dates": pub_dates,
+        "pub_type": pub_type,
+        "pub_skip": pub_skip,
+    }))
+
+
+def load_search_state(save_dir, params):
+    """
+    Function to load the paging checkpoint of a query's results directory
+    A checkpoint saved for other search parameters (a changed query, date range or
+    filter) is discarded together with the DOIs found so far, so the search starts over
+    """
+    path = os.path.join(save_dir, SEARCH_STATE_FILE)
+    if not os.path.exists(path):
+        return {"params": params}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("params") == params:
+        return state
+    print("Search parameters changed for query = {query}, starting over".format(query=params["query"]))
+    for name in (SEARCH_STATE_FILE, "doi_all.txt"):
+        if os.path.exists(os.path.join(save_dir, name)):
+            os.remove(os.path.join(save_dir, name))
+    return {"params": params}
+
+
+def save_search_state(save_dir, state):
+    """
+    Function to atomically save the paging checkpoint of a query's results directory
+    """
+    path = os.path.join(save_dir, SEARCH_STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def get_dois_sem_sch(query, pub_dates, save_dir, pub_type=None, pub_skip=None, bucket=None):
     """
     Function that take a query and pub dates and saves in a file the DOIs found
+    Each page is appended to doi_all.txt as it arrives and the next page token is
+    checkpointed, so an interrupted search resumes from the last saved page
     """
-    doi_dict = bulk_search_doi_pubtype(query, pub_dates)
-    doi_list = doi_dict_filter(doi_dict, pub_type, pub_skip)
-    storeDOI(doi_list, save_dir)
+    params = search_params("semantic_scholar", query, pub_dates, pub_type, pub_skip)
+    state = load_search_state(save_dir, params)
+    if state.get("done"):
+        print("Search already complete for query = {query}".format(query=query))
+        return
+    token = state.get("token") or False
+    if token:
+        print("Resuming search for query = {query}".format(query=query))
+    for papers, next_token in sem_scholar_pages(query, pub_dates, token, bucket):
+        doi_list = doi_dict_filter(page_doi_dict(papers), pub_type, pub_skip)
+        storeDOI(doi_list, save_dir)
+        save_search_state(save_dir, {"params": params, "token": next_token, "done": next_token is None})
 
 
-def doi_search(query_list, pub_dates, save_dir, pub_type=None, pub_skip=None):
+def prepare_query_dir(query, save_dir):
+    """
+    Function that creates the results directory of a query, writes the query text
+    to it and returns the directory path
+    """
+    name, text = list(query.items())[0]
+    save_dir_results = os.path.join(save_dir, name)
+    os.makedirs(save_dir_results, exist_ok=True)
+    with open(os.path.join(save_dir_results, f"{name}.txt"), "w", encoding="utf-8") as f:
+        f.write(text)
+    return save_dir_results
+
+
+def run_chains(chains, workers):
+    """
+    Function that runs paging chains (zero-argument callables, each paging one search
+    to completion) concurrently. A failed chain does not stop the others; since every
+    chain checkpoints its pages, rerunning the search resumes the failed ones
+    """
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(chain): name for name, chain in chains}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print("Search failed for {name}: {error}".format(name=futures[future], error=e))
+    if failed:
+        raise RuntimeError(
+            "{failed} of {total} searches failed, rerun to resume them".format(failed=failed, total=len(chains))
+        )
+
+
+def doi_search(query_list, pub_dates, save_dir, pub_type=None, pub_skip=None,
+               workers=SEARCH_WORKERS, rate=SEM_SCHOLAR_RATE):
     """
     Function that takes a list of queries, a range of ublication dates and a directory to save the results
     and returns a list of DOIs in a file. Results for each query are saved in a different directory
+    Queries are searched concurrently, sharing a budget of `rate` requests per second
     """
+    bucket = http_client.TokenBucket(rate)
+    chains = []
     for query in query_list:
-        save_dir_results = os.path.join(save_dir, list(query.keys())[0])
-        os.mkdir(save_dir_results)
-        get_dois_sem_sch(list(query.values())[0], pub_dates, save_dir_results, pub_type, pub_skip)
-        with open(os.path.join(save_dir_results, f"{list(query.keys())[0]}.txt"), "w", encoding="utf-8") as f:
-            f.write(list(query.values())[0])
-        time.sleep(5)
+        save_dir_results = prepare_query_dir(query, save_dir)
+        text = list(query.values())[0]
+        chains.append((
+            text,
+            lambda text=text, d=save_dir_results: get_dois_sem_sch(
+                text, pub_dates, d, pub_type, pub_skip, bucket
+            ),
+        ))
+    run_chains(chains, workers)
 
 
-def doi_unique(query_list, save_dir):
+def doi_unique(query_list, save_dir, max_in_memory=doi_set.DEFAULT_MAX_IN_MEMORY):
     """
-    Function that goes through search results for different queries and returns a list of unique DOIs that is saved in a file
+    Function that goes through search results for different queries and saves the sorted unique DOIs in a file
+    DOIs are case-folded before deduplication. The queries each DOI was found by are
+    saved to doi_provenance.tsv. Returns the number of unique DOIs
     """
-    doi_list = []
-    for query in query_list:
-        folder = os.path.join(save_dir, list(query.keys())[0])
-        if os.path.exists(folder + "doi_all.txt") is False:
-            continue
-        else:
-            with open(os.path.join(folder, "doi_all.txt"), "r", encoding="utf-8") as file:
-                dois = file.read().splitlines()
-            doi_list.extend(dois)
-    doi_list_unique = list(
-        set(doi_list)
-    )  # removes duplicates and leaves only unique dois
-    with open(os.path.join(save_dir, "doi_unique.txt"), "a", encoding="utf-8") as save_file:
-        for (
-            doi
-        ) in doi_list_unique:  # saves dois to doi.txt file with each doi on new line
-            save_file.write(doi + "\n")
+    with doi_set.DOISet(max_in_memory=max_in_memory, tmp_dir=save_dir) as dois:
+        for query in query_list:
+            name = list(query.keys())[0]
+            path = os.path.join(save_dir, name, "doi_all.txt")
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as file:
+                dois.update(file, source=name)
+        return dois.write(
+            os.path.join(save_dir, "doi_unique.txt"),
+            provenance_path=os.path.join(save_dir, "doi_provenance.tsv"),
+        )
 
 
 def parse_query(query_file):
@@ -166,6 +282,21 @@ def parse_query(query_file):
     # return pub_dates, search_queries
 
 
+def parse_limits(query_file):
+    """
+    Function to read the optional [search_limits] table of the toml file, returning
+    the number of concurrent searches and the Semantic Scholar and Crossref request rates
+    """
+    with open(query_file, "rb") as file:
+        query_data = tomllib.load(file)
+    limits = query_data.get("search_limits", {})
+    return (
+        limits.get("workers", SEARCH_WORKERS),
+        limits.get("semantic_scholar_rate", SEM_SCHOLAR_RATE),
+        limits.get("crossref_rate", CROSSREF_RATE),
+    )
+
+
 def parse_args(args):
     """
     Function to parse command line arguments
@@ -175,20 +306,16 @@ def parse_args(args):
     return pub_dates, query_list, save_dir, pub_type, pub_skip, prefix_list, engine
 
 
-def filter_dois(file, prefixes, save_dir):
+def filter_dois(file, prefixes, save_dir, max_in_memory=doi_set.DEFAULT_MAX_IN_MEMORY):
     """
-    Function to filter DOIs from a file
+    Function to filter DOIs from a file, keeping those that start with one of prefixes
+    (all of them if prefixes is None), and save them sorted and deduplicated to dois_select.txt
+    Returns the number of DOIs selected
     """
-    with open(os.path.join(save_dir, file), "r", encoding="utf-8") as f:
-        dois = f.read().splitlines()
-    filtered_dois = []
-    for doi in dois:
-        for prefix in prefixes:
-            if doi.startswith(prefix):
-                filtered_dois.append(doi)
-    with open(os.path.join(save_dir, "dois_select.txt"), "a", encoding="utf-8") as f:
-        for doi in filtered_dois:
-            f.write(doi + "\n")
+    with doi_set.DOISet(max_in_memory=max_in_memory, tmp_dir=save_dir) as dois:
+        with open(os.path.join(save_dir, file), "r", encoding="utf-8") as f:
+            dois.update(f)
+        return dois.write(os.path.join(save_dir, "dois_select.txt"), prefixes=prefixes)
 
 
 def crossref_search(
@@ -209,9 +336,10 @@ def crossref_search(
     }
     if use_cursor != "*":
         params.update({"cursor": use_cursor})
-    response = requests.get(
+    response = http_client.get(
         base_url.format(prefix=prefix), headers=headers, params=params
     )
+    response.raise_for_status()
     data = response.json()
     if data["status"] == "ok":
         print(
@@ -222,64 +350,115 @@ def crossref_search(
     return data
 
 
+def crossref_pages(pub_date, query, prefix, pub_type="journal-article", cursor="*", bucket=None):
+    """
+    Generator over the pages of a crossref cursor search, starting from a resume
+    cursor ("*" for the first page). Yields (dois, next_cursor) for each page;
+    next_cursor is None on the last page. Each request waits for a token from
+    bucket when given
+    """
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        data = crossref_search(pub_date, query, prefix, pub_type, cursor)
+        if data["status"] != "ok":
+            return
+        items = data["message"]["items"]
+        dois = [doi for doi_dict in items for doi in doi_dict.values()]
+        if len(items) < 1000:
+            yield dois, None
+            return
+        cursor = data["message"]["next-cursor"]
+        yield dois, cursor
+
+
 def crossref_search_paging(pub_date, query, prefix, pub_type="journal-article"):
     """
     Function to search crossref for journal article DOIs from specified prefix and publication date
     """
-    data = crossref_search(pub_date, query, prefix, pub_type)
     all_dois = []
-    if data["status"] == "ok":
-        all_dois.extend(
-            [doi for doi_dict in data["message"]["items"] for doi in doi_dict.values()]
-        )
-        if len(data["message"]["items"]) < 1000:
-            return all_dois
-        else:
-            cursor = data["message"]["next-cursor"]
-            while cursor != "*":
-                data = crossref_search(pub_date, query, prefix, pub_type, cursor)
-                all_dois.extend(
-                    [
-                        doi
-                        for doi_dict in data["message"]["items"]
-                        for doi in doi_dict.values()
-                    ]
-                )
-                if len(data["message"]["items"]) < 1000:
-                    return all_dois
-                else:
-                    cursor = data["message"]["next-cursor"]
+    for dois, _ in crossref_pages(pub_date, query, prefix, pub_type):
+        all_dois.extend(dois)
+    return all_dois
+
+
+CROSSREF_PREFIXES = [
+    "10.1016",
+    "10.1021",
+    "10.1039",
+    "10.1002",
+    "10.1007",
+    "10.1080",
+    "10.1038",
+]
+
+
+def get_dois_crossref_prefix(query, pub_dates, prefix, save_dir, state, bucket=None, lock=None):
+    """
+    Function that pages through the crossref results of one prefix, appending each page
+    to doi_all.txt and checkpointing the next cursor in state[prefix]
+    lock guards the query's doi_all.txt and state when its prefixes are paged concurrently
+    A saved cursor that crossref no longer accepts restarts the prefix from the first page
+    """
+    if lock is None:
+        lock = threading.Lock()
+    with lock:
+        prefix_state = state.get(prefix, {})
+    if prefix_state.get("done"):
+        return
+    cursor = prefix_state.get("cursor") or "*"
+    resumed = cursor != "*"
+    pages = crossref_pages(pub_dates, query, prefix, cursor=cursor, bucket=bucket)
+    while True:
+        try:
+            dois, next_cursor = next(pages)
+        except StopIteration:
+            return
+        except requests.HTTPError as e:
+            if not resumed or e.response is None or not 400 <= e.response.status_code < 500:
+                raise
+            # deep paging cursors expire a few minutes after their last use; the DOIs
+            # found again are deduplicated by doi_unique
+            print("Saved cursor expired for query = {query} and prefix = {prefix}, restarting".format(
+                query=query, prefix=prefix))
+            resumed = False
+            pages = crossref_pages(pub_dates, query, prefix, cursor="*", bucket=bucket)
+            continue
+        resumed = False
+        with lock:
+            storeDOI(dois, save_dir)
+            state[prefix] = {"cursor": next_cursor, "done": next_cursor is None}
+            save_search_state(save_dir, state)
 
 
 def get_dois_crossref(query, pub_dates, save_dir):
     """
     Function that takes a query and pub dates and saves in a file the DOIs found
+    Each page is appended to doi_all.txt as it arrives and the next cursor of each
+    prefix is checkpointed, so an interrupted search resumes from the last saved page
     """
-    prefixes = [
-        "10.1016",
-        "10.1021",
-        "10.1039",
-        "10.1002",
-        "10.1007",
-        "10.1080",
-        "10.1038",
-    ]
-    doi_list_all = []
-    for prefix in prefixes:
-        doi_list = crossref_search_paging(pub_dates, query, prefix)
-        doi_list_all.extend(doi_list)
-    storeDOI(doi_list_all, save_dir)
+    state = load_search_state(save_dir, search_params("crossref", query, pub_dates))
+    for prefix in CROSSREF_PREFIXES:
+        get_dois_crossref_prefix(query, pub_dates, prefix, save_dir, state)
 
 
-def doi_search_crossref(query_list, pub_dates, save_dir):
+def doi_search_crossref(query_list, pub_dates, save_dir, workers=SEARCH_WORKERS, rate=CROSSREF_RATE):
     """
     Function that takes a list of queries, a range of ublication dates and a directory to save the results
     and returns a list of DOIs in a file. Results for each query are saved in a different directory
+    Every (query, prefix) pair is paged concurrently, sharing a budget of `rate` requests per second
     """
-    for i, query in enumerate(query_list):
-        save_dir_results = os.path.join(save_dir, f'query_{i+1}')
-        os.mkdir(save_dir_results)
-        get_dois_crossref(query, pub_dates, save_dir_results)
-        with open(os.path.join(save_dir_results, f"query_{i+1}.txt"), "w", encoding="utf-8") as f:
-            f.write(query)
-        time.sleep(5)
+    bucket = http_client.TokenBucket(rate)
+    chains = []
+    for query in query_list:
+        save_dir_results = prepare_query_dir(query, save_dir)
+        text = list(query.values())[0]
+        state = load_search_state(save_dir_results, search_params("crossref", text, pub_dates))
+        lock = threading.Lock()
+        for prefix in CROSSREF_PREFIXES:
+            chains.append((
+                "{query} ({prefix})".format(query=text, prefix=prefix),
+                lambda text=text, prefix=prefix, d=save_dir_results, state=state, lock=lock:
+                    get_dois_crossref_prefix(text, pub_dates, prefix, d, state, bucket, lock),
+            ))
+    run_chains(chains, workers)
@@ -8,6 +8,8 @@ import os
 
 if __name__ == '__main__':
     pub_dates, query_list, save_dir, pub_type, pub_skip, prefix_list, _ = drt.parse_args(sys.argv[1:])
-    drt.doi_search(query_list, pub_dates, save_dir, pub_type=pub_type, pub_skip=pub_skip)
+    workers, sem_scholar_rate, _ = drt.parse_limits(sys.argv[1])
+    drt.doi_search(query_list, pub_dates, save_dir, pub_type=pub_type, pub_skip=pub_skip,
+                   workers=workers, rate=sem_scholar_rate)
     drt.doi_unique(query_list, save_dir)
     drt.filter_dois(os.path.join(save_dir, 'doi_unique.txt'), prefix_list, save_dir)
@@ -0,0 +1,166 @@
+"""
+Disk-backed set of DOIs used to merge and filter search results
+
+DOIs are normalized (surrounding whitespace and any doi.org URL prefix removed,
+case-folded) so the same article found by several queries is counted once.
+Each DOI keeps the names of the queries it was found by. Once more than
+max_in_memory DOIs are held, they are written to a sorted run file on disk and
+the final result is a merge of the runs, so memory stays bounded however many
+DOIs are added. DOIs always come out in sorted order, so output files are the
+same from run to run.
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+DEFAULT_MAX_IN_MEMORY = 1_000_000
+DOI_URL_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:")
+
+
+def normalize_doi(doi):
+    """
+    Function that returns the normalized form of a DOI, or None for a blank line
+    """
+    doi = doi.strip().casefold()
+    for url_prefix in DOI_URL_PREFIXES:
+        if doi.startswith(url_prefix):
+            doi = doi[len(url_prefix):]
+            break
+    return doi or None
+
+
+class PrefixTrie:
+    """
+    Character trie of DOI prefixes; match() checks a DOI against all prefixes
+    in time proportional to the longest prefix rather than the number of prefixes
+    """
+
+    def __init__(self, prefixes):
+        self.root = {}
+        for prefix in prefixes:
+            node = self.root
+            for char in normalize_doi(prefix):
+                node = node.setdefault(char, {})
+            node[None] = True
+
+    def match(self, doi):
+        node = self.root
+        if None in node:
+            return True
+        for char in doi:
+            node = node.get(char)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+class DOISet:
+    """
+    Deduplicated set of normalized DOIs with the sources (query names) each was found by
+
+    Usage:
+        with DOISet() as dois:
+            dois.update(open('doi_all.txt'), source='query_1')
+            dois.write('doi_unique.txt', provenance_path='doi_provenance.tsv')
+    """
+
+    def __init__(self, max_in_memory=DEFAULT_MAX_IN_MEMORY, tmp_dir=None):
+        self.max_in_memory = max_in_memory
+        self.tmp_dir = tmp_dir
+        self.entries = {}
+        self.runs = []
+        self.run_dir = None
+
+    def add(self, doi, source=None):
+        doi = normalize_doi(doi)
+        if doi is None:
+            return
+        sources = self.entries.get(doi)
+        if sources is None:
+            sources = self.entries[doi] = set()
+        if source is not None:
+            sources.add(source)
+        if len(self.entries) >= self.max_in_memory:
+            self._spill()
+
+    def update(self, dois, source=None):
+        for doi in dois:
+            self.add(doi, source)
+
+    def _spill(self):
+        """
+        Write the in-memory DOIs to a sorted run file and clear them
+        """
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="doi_set_", dir=self.tmp_dir)
+        path = os.path.join(self.run_dir, f"run_{len(self.runs)}.tsv")
+        with open(path, "w", encoding="utf-8") as f:
+            for doi in sorted(self.entries):
+                f.write(doi + "\t" + ",".join(sorted(self.entries[doi])) + "\n")
+        self.runs.append(path)
+        self.entries = {}
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                doi, sources = line.rstrip("\n").split("\t")
+                yield doi, sources.split(",") if sources else []
+
+    def __iter__(self):
+        """
+        Yield (doi, sorted list of sources) for every DOI, in sorted DOI order
+        """
+        in_memory = ((doi, self.entries[doi]) for doi in sorted(self.entries))
+        streams = [self._read_run(path) for path in self.runs] + [in_memory]
+        merged = heapq.merge(*streams, key=lambda entry: entry[0])
+        for doi, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+            sources = set()
+            for _, group_sources in group:
+                sources.update(group_sources)
+            yield doi, sorted(sources)
+
+    def write(self, path, provenance_path=None, prefixes=None):
+        """
+        Write the DOIs to path, one per line, keeping only those matching one of
+        prefixes when given. With provenance_path, also write a tab separated file
+        of each DOI and the comma separated sources it was found by.
+        Returns the number of DOIs written
+        """
+        trie = PrefixTrie(prefixes) if prefixes is not None else None
+        count = 0
+        provenance = open(provenance_path, "w", encoding="utf-8") if provenance_path else None
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for doi, sources in self:
+                    if trie is not None and not trie.match(doi):
+                        continue
+                    f.write(doi + "\n")
+                    if provenance is not None:
+                        provenance.write(doi + "\t" + ",".join(sources) + "\n")
+                    count += 1
+        finally:
+            if provenance is not None:
+                provenance.close()
+        return count
+
+    def close(self):
+        """
+        Remove the run files spilled to disk
+        """
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.runs = []
+        self.entries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,406 @@
+'''
+Compressed, append-only archive of downloaded full text articles, shared by the
+downloaders in article_retrieve and the extraction in article_extraction.
+
+Instead of one .txt file per DOI, pages are appended to shards in the archive
+directory (archive-00000.gz, ...). Every page is compressed on its own, gzip by
+default or zstd when the zstandard package is installed, so a single article can
+be read without decompressing anything else, and a shard is still a valid
+multi-member gzip (or zstd) file that zcat can read.
+
+archive_index.tsv maps each DOI to its shard, offset and compressed length, plus
+the page's size, write time and SHA-256. The file is sorted by DOI and readers
+memory-map it and binary search it, so opening an archive does not load the
+index. New entries are first appended to a journal (archive_index.log) as each
+page is written, so an interrupted download keeps everything written so far,
+and are merged into the sorted index when the writer is closed. Only one writer
+should add to an archive at a time.
+
+Usage:
+    python article_archive.py --archive_dir /path/to/articles                  # summary
+    python article_archive.py --archive_dir /path/to/articles --pack [--remove]  # archive loose .txt files
+    python article_archive.py --archive_dir /path/to/articles --doi 10.1039/c9ee00001a
+'''
+
+import os
+import re
+import sys
+import gzip
+import mmap
+import time
+import hashlib
+import argparse
+import threading
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = 'archive_index.tsv'
+JOURNAL_NAME = 'archive_index.log'
+SHARD_PREFIX = 'archive-'
+SHARD_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_SHARD_MB = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# st_size and st_mtime match os.stat_result, so an entry can stand in for a file's stat
+ArchiveEntry = namedtuple('ArchiveEntry', 'doi shard offset length st_size st_mtime sha256')
+
+
+def archive_key(doi):
+    '''
+    Function to return the index key of a DOI, which is the same for the DOI and for
+    its article file name stem (10.1039-c9ee00001a), so either can be looked up
+    '''
+    return doi.strip().lower().replace('/', '-')
+
+
+def is_archive(path):
+    '''
+    Function to check whether a directory holds an article archive
+    '''
+    return (os.path.exists(os.path.join(path, INDEX_NAME))
+            or os.path.exists(os.path.join(path, JOURNAL_NAME)))
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package: pip install zstandard")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    raise ValueError(f"Unknown compression '{compression}', expected one of {tuple(SHARD_SUFFIX)}")
+
+
+def _decompress(shard, data):
+    if shard.endswith(SHARD_SUFFIX['zstd']):
+        if zstandard is None:
+            raise ImportError("Reading zstd shards requires the zstandard package: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _format_entry(entry):
+    return '\t'.join([archive_key(entry.doi), entry.doi, entry.shard, str(entry.offset),
+                      str(entry.length), str(entry.st_size), repr(entry.st_mtime), entry.sha256]) + '\n'
+
+
+def _parse_entry(line):
+    _, doi, shard, offset, length, size, mtime, sha256 = line.rstrip('\n').split('\t')
+    return ArchiveEntry(doi, shard, int(offset), int(length), int(size), float(mtime), sha256)
+
+
+def _read_journal(archive_dir):
+    '''
+    Function to return the journal entries by key, later entries replacing earlier ones.
+    A line cut short by an interrupted write is ignored
+    '''
+    entries = {}
+    path = os.path.join(archive_dir, JOURNAL_NAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n') and line.count('\t') == 7:
+                    entry = _parse_entry(line)
+                    entries[archive_key(entry.doi)] = entry
+    return entries
+
+
+def _shard_names(archive_dir):
+    pattern = re.compile(rf'^{SHARD_PREFIX}(\d+)\.(gz|zst)$')
+    names = [f for f in os.listdir(archive_dir) if pattern.match(f)]
+    return sorted(names, key=lambda f: int(pattern.match(f).group(1)))
+
+
+class ArchiveWriter:
+    '''
+    Appends pages to a new shard of an archive directory, rolling over to the next
+    shard at max_shard_bytes. Safe to share between threads.
+
+    Usage:
+        with ArchiveWriter('/path/to/articles') as archive:
+            archive.add('10.1039/c9ee00001a', page_bytes)
+    '''
+
+    def __init__(self, archive_dir, compression='gzip', max_shard_bytes=DEFAULT_SHARD_MB * 2**20):
+        self.compress = _compressor(compression)
+        os.makedirs(archive_dir, exist_ok=True)
+        self.archive_dir = archive_dir
+        self.suffix = SHARD_SUFFIX[compression]
+        self.max_shard_bytes = max_shard_bytes
+        self.lock = threading.Lock()
+        existing = _shard_names(archive_dir)
+        self.next_shard = int(existing[-1][len(SHARD_PREFIX):].split('.')[0]) + 1 if existing else 0
+        self.shard = None
+        self.shard_name = None
+        # entries left in the journal by an interrupted writer, possibly ending in a partial line
+        merge_journal(archive_dir)
+        self.journal = open(os.path.join(archive_dir, JOURNAL_NAME), 'a', encoding='utf-8')
+
+    def _open_shard(self):
+        self.shard_name = f'{SHARD_PREFIX}{self.next_shard:05d}{self.suffix}'
+        self.next_shard += 1
+        self.shard = open(os.path.join(self.archive_dir, self.shard_name), 'ab')
+
+    def add(self, doi, data):
+        '''
+        Append a page (bytes, or str to be encoded as UTF-8) under doi
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressed = self.compress(data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if self.shard is None or self.shard.tell() >= self.max_shard_bytes:
+                if self.shard is not None:
+                    self.shard.close()
+                self._open_shard()
+            offset = self.shard.tell()
+            self.shard.write(compressed)
+            # the page must be on disk before the journal points at it
+            self.shard.flush()
+            entry = ArchiveEntry(doi.strip(), self.shard_name, offset, len(compressed),
+                                 len(data), time.time(), sha256)
+            self.journal.write(_format_entry(entry))
+            self.journal.flush()
+        return entry
+
+    def close(self):
+        '''
+        Close the shard and merge the journal into the sorted index
+        '''
+        with self.lock:
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+            self.journal.close()
+            merge_journal(self.archive_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_journal(archive_dir):
+    '''
+    Function to merge the journal into the sorted index, written atomically, and clear the journal
+    '''
+    journal_path = os.path.join(archive_dir, JOURNAL_NAME)
+    journal = _read_journal(archive_dir)
+    if not journal:
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        return
+    index_path = os.path.join(archive_dir, INDEX_NAME)
+    pending = sorted(journal.items())
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        i = 0
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    key = line.split('\t', 1)[0]
+                    while i < len(pending) and pending[i][0] < key:
+                        out.write(_format_entry(pending[i][1]))
+                        i += 1
+                    if i < len(pending) and pending[i][0] == key:
+                        out.write(_format_entry(pending[i][1]))
+                        i += 1
+                    else:
+                        out.write(line)
+        for _, entry in pending[i:]:
+            out.write(_format_entry(entry))
+    os.replace(tmp_path, index_path)
+    os.remove(journal_path)
+
+
+class ArchiveReader:
+    '''
+    Reads pages from an archive directory by DOI. The sorted index is memory-mapped
+    and binary searched; entries still in the journal are read into memory.
+    A reader should not be shared between threads, but can be used by forked
+    processes: shards are read at absolute offsets without seeking.
+
+    Usage:
+        with ArchiveReader('/path/to/articles') as archive:
+            html = archive.read_text('10.1039/c9ee00001a')
+    '''
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.index = None
+        self.index_file = None
+        index_path = os.path.join(archive_dir, INDEX_NAME)
+        if os.path.exists(index_path) and os.path.getsize(index_path) > 0:
+            self.index_file = open(index_path, 'rb')
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.journal = _read_journal(archive_dir)
+        self.shards = {}
+
+    def _search(self, key):
+        index = self.index
+        if index is None:
+            return None
+        key = key.encode('utf-8')
+        lo, hi = 0, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = index.rfind(b'\n', 0, mid) + 1
+            end = index.find(b'\n', start)
+            if end < 0:
+                end = len(index)
+            line_key = index[start:index.find(b'\t', start)]
+            if line_key < key:
+                lo = end + 1
+            elif line_key > key:
+                hi = start
+            else:
+                return _parse_entry(index[start:end].decode('utf-8'))
+        return None
+
+    def entry(self, doi):
+        '''
+        Return the ArchiveEntry of a DOI (or article file name stem), or None if it is not in the archive
+        '''
+        key = archive_key(doi)
+        if key in self.journal:
+            return self.journal[key]
+        return self._search(key)
+
+    def __contains__(self, doi):
+        return self.entry(doi) is not None
+
+    def _index_entries(self):
+        if self.index is None:
+            return
+        start = 0
+        while start < len(self.index):
+            end = self.index.find(b'\n', start)
+            if end < 0:
+                end = len(self.index)
+            yield _parse_entry(self.index[start:end].decode('utf-8'))
+            start = end + 1
+
+    def entries(self):
+        '''
+        Yield the ArchiveEntry of every DOI in the archive, in index order
+        '''
+        for entry in self._index_entries():
+            if archive_key(entry.doi) not in self.journal:
+                yield entry
+        yield from self.journal.values()
+
+    def dois(self):
+        return [entry.doi for entry in self.entries()]
+
+    def read(self, doi):
+        '''
+        Return the page of a DOI as bytes, or None if it is not in the archive
+        '''
+        entry = self.entry(doi)
+        if entry is None:
+            return None
+        shard = self.shards.get(entry.shard)
+        if shard is None:
+            shard = self.shards[entry.shard] = open(os.path.join(self.archive_dir, entry.shard), 'rb')
+        if hasattr(os, 'pread'):
+            # pread does not move the file offset, which forked processes share with this one
+            data = os.pread(shard.fileno(), entry.length, entry.offset)
+        else:
+            shard.seek(entry.offset)
+            data = shard.read(entry.length)
+        return _decompress(entry.shard, data)
+
+    def read_text(self, doi):
+        data = self.read(doi)
+        return data.decode('utf-8') if data is not None else None
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+        self.shards = {}
+        if self.index is not None:
+            self.index.close()
+            self.index_file.close()
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Inspect an article archive, pack loose article files into it, or print an article'
+    )
+    parser.add_argument(
+        '--archive_dir', required=True,
+        help='Directory holding the archive (the download save_dir)'
+    )
+    parser.add_argument(
+        '--pack', action='store_true',
+        help='Add the loose 10.*.txt article files in archive_dir to the archive'
+    )
+    parser.add_argument(
+        '--remove', action='store_true',
+        help='With --pack, delete each loose file once it is archived'
+    )
+    parser.add_argument(
+        '--compression', choices=tuple(SHARD_SUFFIX), default='gzip',
+        help='Compression for --pack (default: gzip; zstd requires the zstandard package)'
+    )
+    parser.add_argument(
+        '--doi', default=None,
+        help='Print the archived page of this DOI'
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.archive_dir):
+        print(f"Error: directory '{args.archive_dir}' does not exist.")
+        sys.exit(1)
+
+    if args.pack:
+        pattern = re.compile(r'^10\.\d{4,9}[^\s]*\.txt$')
+        files = sorted(f for f in os.listdir(args.archive_dir) if pattern.match(f))
+        raw_bytes = 0
+        with ArchiveWriter(args.archive_dir, args.compression) as archive:
+            for filename in files:
+                path = os.path.join(args.archive_dir, filename)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                archive.add(filename[:-len('.txt')].replace('-', '/', 1), data)
+                raw_bytes += len(data)
+        if args.remove:
+            for filename in files:
+                os.remove(os.path.join(args.archive_dir, filename))
+        print(f"Archived {len(files)} files ({raw_bytes / 2**20:.1f} MB)"
+              + (", loose files removed" if args.remove else ""))
+
+    if args.doi:
+        with ArchiveReader(args.archive_dir) as archive:
+            data = archive.read(args.doi)
+        if data is None:
+            print(f"DOI {args.doi} not found in {args.archive_dir}")
+            sys.exit(1)
+        sys.stdout.buffer.write(data)
+        return
+
+    with ArchiveReader(args.archive_dir) as archive:
+        entries = list(archive.entries())
+    stored = sum(os.path.getsize(os.path.join(args.archive_dir, s)) for s in _shard_names(args.archive_dir))
+    raw = sum(entry.st_size for entry in entries)
+    print(f"{len(entries)} articles in {len(_shard_names(args.archive_dir))} shards: "
+          f"{raw / 2**20:.1f} MB stored as {stored / 2**20:.1f} MB"
+          + (f" ({raw / stored:.1f}x)" if stored else ""))
+
+
+if __name__ == '__main__':
+    main()
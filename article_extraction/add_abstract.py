@@ -1,11 +1,43 @@
-'''Script to add abstracts to the text corpus JSON files by retrieving them from the Scopus API.'''
+'''
+Script to add abstracts to the text corpus JSON files by retrieving them from the Scopus API.
+
+Abstracts are fetched as a separate batched stage: every JSON file in the directory
+without an abstract is collected, the DOIs are fetched concurrently within a
+requests-per-second budget for the Scopus key, and the results are written back.
+Retrieved abstracts are cached by DOI so they are never fetched twice across runs.
+
+Usage:
+    python add_abstract.py --data_dir /path/to/json_output [--rate 5] [--workers 8]
+
+Requires the ELSEVIER_API_KEY environment variable:
+    export ELSEVIER_API_KEY=your_key_here
+'''
+import argparse
 import json
 import os
 import re
+import sqlite3
+import sys
+import threading
 import time
 import requests
 import xml.etree.ElementTree as ET
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+
+import extractor_tools as tools
+from doi_tools import filename_to_doi
+
+ABSTRACT_CACHE_NAME = 'abstracts.sqlite'   # abstract cache, kept in the JSON directory
+DEFAULT_RATE = 5.0                         # Scopus requests per second
+DEFAULT_WORKERS = 8
+ABSTRACT_BATCH = 1000                      # records loaded at a time
+
+
+class AbstractNotFound(ValueError):
+    """Scopus has no record or no abstract for the DOI; retrying will not help."""
 
 
 def abstract_retrieve(doi, api_key):
@@ -16,9 +48,11 @@ def abstract_retrieve(doi, api_key):
             "Accept": "text/xml",
             "X-ELS-APIKey": api_key
         }
-        r = requests.get(url, stream=True, headers=headers, timeout=30)
+        r = http_client.get(url, stream=True, headers=headers, timeout=30)
         if r.status_code == 200:
             return r.text
+        elif r.status_code == 404:
+            raise AbstractNotFound(f"No Scopus record for DOI {doi}")
         else:
             raise ValueError(f"Failed to retrieve abstract for DOI {doi}: {r.status_code}")
     except requests.RequestException as e:
@@ -35,8 +69,203 @@ def extract_abstract(xml_content):
         }
         para = root.find(".//dc:description/abstract/ce:para", namespaces)
         if para is None:
-            raise ValueError("No ce:para element found within dc:description.")
+            raise AbstractNotFound("No ce:para element found within dc:description.")
         abstract_text = "".join(para.itertext()).strip()
         return abstract_text
     except ET.ParseError as e:
         raise ValueError(f"Error parsing XML content: {e}")
+
+
+class AbstractCache:
+    """
+    Persistent SQLite map from DOI to abstract text. DOIs Scopus has no abstract
+    for are stored as an empty string so they are not requested again either.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS abstracts (doi TEXT PRIMARY KEY, abstract TEXT NOT NULL)'
+        )
+        self.conn.commit()
+
+    def get(self, doi):
+        """Return the cached abstract for doi, or None if it has not been fetched."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT abstract FROM abstracts WHERE doi = ?', (doi.lower(),)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, doi, abstract):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO abstracts (doi, abstract) VALUES (?, ?)',
+                (doi.lower(), abstract),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def known_without_abstract(doi, cache):
+    """
+    Return whether cache records that Scopus has no abstract for doi, so the record
+    already holds an empty abstract and need not be read again.
+    """
+    return cache is not None and cache.get(doi) == ""
+
+
+def fetch_abstracts(dois, api_key, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS, cache=None,
+                    timings=None):
+    """
+    Fetch abstracts for dois concurrently, at most `rate` requests per second.
+    Cached DOIs are not requested. Returns a dict of DOI -> abstract text, with
+    an empty string where Scopus has no abstract; DOIs whose request failed are
+    left out so they are retried on the next run. If a timings dict is given, the
+    request time in seconds of every requested DOI is stored in it, not counting
+    the wait for the rate limit.
+    """
+    results = {}
+    to_fetch = []
+    for doi in dict.fromkeys(dois):
+        cached = cache.get(doi) if cache is not None else None
+        if cached is not None:
+            results[doi] = cached
+        else:
+            to_fetch.append(doi)
+
+    bucket = http_client.TokenBucket(rate)
+
+    def fetch(doi):
+        bucket.acquire()
+        start = time.perf_counter()
+        try:
+            abstract = extract_abstract(abstract_retrieve(doi, api_key))
+        except AbstractNotFound as e:
+            print(f"  No abstract for {doi}: {e}")
+            abstract = ""
+        except ValueError as e:
+            print(f"  Warning: abstract retrieval failed for {doi}: {e}")
+            return doi, None
+        finally:
+            if timings is not None:
+                timings[doi] = time.perf_counter() - start
+        if cache is not None:
+            cache.set(doi, abstract)
+        return doi, abstract
+
+    if to_fetch:
+        print(f"Fetching {len(to_fetch)} abstracts ({len(results)} cached) "
+              f"at up to {rate:g} requests/s")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for doi, abstract in pool.map(fetch, to_fetch):
+                if abstract is not None:
+                    results[doi] = abstract
+    return results
+
+
+def add_abstracts_to_records(records, api_key, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS, cache=None,
+                             timings=None):
+    """
+    Add abstracts in place to the records (a dict of key -> record) that do not
+    have one yet. A record whose abstract cannot be retrieved gets an empty one.
+    Returns (keys of the records that now contain an abstract, keys of the records
+    that were changed). If a timings dict is given, the Scopus request
+    time in seconds of every record whose DOI was requested is stored in it, by key.
+    """
+    pending = {}
+    done = set()
+    for key, data in records.items():
+        if data.get("Abstract"):
+            done.add(key)
+        elif data.get("DOI"):
+            pending[key] = data
+
+    doi_timings = {}
+    abstracts = fetch_abstracts(
+        [data["DOI"] for data in pending.values()], api_key,
+        rate=rate, workers=workers, cache=cache, timings=doi_timings,
+    )
+    changed = set()
+    for key, data in pending.items():
+        if timings is not None and data["DOI"] in doi_timings:
+            timings[key] = doi_timings[data["DOI"]]
+        # a failed request leaves the abstract empty, to be retried on the next run
+        abstract = abstracts.get(data["DOI"], "")
+        if data.get("Abstract") != abstract:
+            data["Abstract"] = abstract
+            changed.add(key)
+        if abstract:
+            done.add(key)
+    return done, changed
+
+
+def add_abstracts(json_paths, api_key, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS, cache=None,
+                  timings=None):
+    """
+    Add abstracts to the JSON files in json_paths that do not have one yet and
+    write them back, ABSTRACT_BATCH files at a time. Files whose DOI the cache
+    records as having no abstract are not read. Returns the set of paths that now
+    contain an abstract. If a timings dict is given, the Scopus request time in
+    seconds of every file whose DOI was requested is stored in it, keyed by path.
+    """
+    done = set()
+    for i in range(0, len(json_paths), ABSTRACT_BATCH):
+        records = {}
+        for path in json_paths[i:i + ABSTRACT_BATCH]:
+            if known_without_abstract(filename_to_doi(path), cache):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                records[path] = json.load(f)
+        batch_done, changed = add_abstracts_to_records(
+            records, api_key, rate=rate, workers=workers, cache=cache, timings=timings,
+        )
+        for path in changed:
+            tools.write_json(records[path], path)
+        done |= batch_done
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add Scopus abstracts to extracted JSON article files'
+    )
+    parser.add_argument(
+        '--data_dir', required=True,
+        help='Directory containing the JSON article files'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=DEFAULT_RATE,
+        help=f'Maximum Scopus requests per second (default: {DEFAULT_RATE:g})'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f'Number of concurrent requests (default: {DEFAULT_WORKERS})'
+    )
+    args = parser.parse_args()
+
+    api_key = os.environ.get('ELSEVIER_API_KEY')
+    if not api_key:
+        print("Error: ELSEVIER_API_KEY environment variable is not set.")
+        sys.exit(1)
+    if not os.path.exists(args.data_dir):
+        print(f"Error: Data directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+
+    json_paths = sorted(
+        os.path.join(args.data_dir, f) for f in os.listdir(args.data_dir)
+        if re.match(r'^10\.\d{4,9}[^\s]*\.json$', f)
+    )
+    cache = AbstractCache(os.path.join(args.data_dir, ABSTRACT_CACHE_NAME))
+    done = add_abstracts(json_paths, api_key, rate=args.rate, workers=args.workers, cache=cache)
+    cache.close()
+    print(f"{len(done)}/{len(json_paths)} files have an abstract")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Extraction context that reads and parses an article file once, so that the same
+tree can be shared by the section, caption, table and figure URL extractors.
+
+HTML articles can be parsed with either html.parser or lxml as the BeautifulSoup
+backend (lxml is several times faster); XML articles always use BeautifulSoup's
+lxml-based 'xml' parser. Run parser_parity.py over a set of articles to check
+that a backend gives identical output before switching to it.
+
+Articles are read from loose 10.*.txt files in the data directory or, when the
+downloads were stored in a compressed archive (article_archive.py), straight
+from the archive shards. A loose file takes precedence over an archived copy.
+'''
+
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from article_archive import ArchiveReader, is_archive
+
+
+# Publisher prefix mapping shared across routing helpers
+PUB_PREFIX = {
+    "RSC":      "10.1039",
+    "ACS":      "10.1021",
+    "Nature":   "10.1038",
+    "Science":  "10.1126",
+    "Frontiers":"10.3389",
+    "MDPI":     "10.3390",
+    "Wiley":    "10.1002",
+    "Springer": "10.1007",
+    "TandF":    "10.1080",
+    "Elsevier": "10.1016",
+}
+PREFIX_TO_PUB = {v: k for k, v in PUB_PREFIX.items()}
+
+# BeautifulSoup backends that can be selected for HTML articles
+HTML_PARSERS = ('html.parser', 'lxml')
+DEFAULT_HTML_PARSER = 'html.parser'
+
+ARTICLE_PATTERN = re.compile(r'^10\.\d{4,9}[^\s]*\.txt$')
+
+# Archive readers by (process id, data directory), opened once per process
+_archives = {}
+
+
+def get_publisher(doi_filename):
+    """Return publisher name from a DOI filename (e.g. '10.1016-j.foo.txt')."""
+    return PREFIX_TO_PUB.get(doi_filename[:7])
+
+
+def archive_reader(data_dir):
+    """Return the ArchiveReader of data_dir, or None if it holds no article archive."""
+    key = (os.getpid(), data_dir)
+    if key not in _archives:
+        _archives[key] = ArchiveReader(data_dir) if is_archive(data_dir) else None
+    return _archives[key]
+
+
+def list_articles(data_dir):
+    """Return the sorted file names (10.*.txt) of the loose and archived articles in data_dir."""
+    names = {f for f in os.listdir(data_dir) if ARTICLE_PATTERN.match(f)}
+    archive = archive_reader(data_dir)
+    if archive is not None:
+        names.update(entry.doi.replace('/', '-') + '.txt' for entry in archive.entries())
+    return sorted(names)
+
+
+def article_source(filename, data_dir):
+    """
+    Return the path of the article's loose file, or its ArchiveEntry if it is only
+    archived. Either can be passed to ExtractionManifest as the source.
+    """
+    path = os.path.join(data_dir, filename)
+    if os.path.exists(path):
+        return path
+    archive = archive_reader(data_dir)
+    entry = archive.entry(filename[:-len('.txt')]) if archive is not None else None
+    if entry is None:
+        raise FileNotFoundError(f"No article file or archived copy of {filename} in {data_dir}")
+    return entry
+
+
+def read_article(filename, data_dir):
+    """Return the text of an article from its loose file or the archive."""
+    path = os.path.join(data_dir, filename)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    archive = archive_reader(data_dir)
+    content = archive.read_text(filename[:-len('.txt')]) if archive is not None else None
+    if content is None:
+        raise FileNotFoundError(f"No article file or archived copy of {filename} in {data_dir}")
+    return content
+
+
+def parser_for(content, publisher, html_parser=DEFAULT_HTML_PARSER):
+    """Return the BeautifulSoup parser name to use for the publisher's file format."""
+    if publisher == "Elsevier":
+        return 'xml'
+    if publisher == "Wiley" and content.startswith('<component xmlns'):
+        return 'xml'
+    return html_parser
+
+
+class ArticleContext:
+    """
+    Raw content and parsed tree of a single article file.
+
+    The file is read once on construction and parsed lazily on first access to
+    ``soup``, so publishers handled entirely by LimeSoup (RSC) never build a
+    BeautifulSoup tree unless captions, tables or figure URLs are requested.
+
+    Note that the section extractors in ``to_json`` strip tags from the tree in
+    place, so anything that needs the untouched document (captions, tables,
+    figure URLs) must run before them.
+
+    ``html_parser`` selects the BeautifulSoup backend for HTML articles.
+    """
+
+    def __init__(self, filename, data_dir, html_parser=DEFAULT_HTML_PARSER):
+        self.filename = filename
+        self.data_dir = data_dir
+        self.publisher = get_publisher(filename)
+        self.content = read_article(filename, data_dir)
+        self.parser = parser_for(self.content, self.publisher, html_parser)
+        self.parse_count = 0
+        self._soup = None
+
+    @property
+    def soup(self):
+        """Parsed document tree, built on first access with the publisher's parser."""
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.content, self.parser)
+            self.parse_count += 1
+        return self._soup
@@ -3,72 +3,45 @@ Script to get text of article from html or xml file into json file.
 
 Usage:
     python article_to_json.py --data_dir /path/to/articles [--save_dir /path/to/output]
-                              [--skip_extras] [--skip_abstract]
+                              [--skip_extras] [--skip_abstract] [--workers N]
+                              [--incremental [--hash]] [--abstract_rate R] [--table_rate R]
+                              [--progress] [--trace_memory]
+                              [--output {json,jsonl,parquet} [--shard_size MB]]
 
 Requires the ELSEVIER_API_KEY environment variable for abstract retrieval:
     export ELSEVIER_API_KEY=your_key_here
 '''
 
-import json
+import io
 import os
-import re
 import sys
-import time
 import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-
 import to_json
+import extractor_tools as tools
 import add_abstract
 import captions_extractor
 import tables_extractor
 import figure_downloader
+import table_pages
+from article_context import (ArticleContext, get_publisher, list_articles, article_source,
+                             HTML_PARSERS, DEFAULT_HTML_PARSER)
+from extraction_manifest import ExtractionManifest
+from extraction_metrics import ExtractionMetrics, StageTimer, Progress, METRICS_NAME, max_rss_kb
+from corpus_store import CorpusReader, CorpusWriter, compact, is_corpus, FORMATS, DEFAULT_SHARD_MB
+from doi_tools import filename_to_doi
+
 
 
-# Publisher prefix mapping shared across routing helpers
-_PUB_PREFIX = {
-    "RSC":      "10.1039",
-    "ACS":      "10.1021",
-    "Nature":   "10.1038",
-    "Science":  "10.1126",
-    "Frontiers":"10.3389",
-    "MDPI":     "10.3390",
-    "Wiley":    "10.1002",
-    "Springer": "10.1007",
-    "TandF":    "10.1080",
-    "Elsevier": "10.1016",
-}
-_PREFIX_TO_PUB = {v: k for k, v in _PUB_PREFIX.items()}
-
-
-def _get_publisher(doi_filename):
-    """Return publisher name from a DOI filename (e.g. '10.1016-j.foo.txt')."""
-    return _PREFIX_TO_PUB.get(doi_filename[:7])
-
-
-def _get_soup(content, publisher):
-    """Parse article content with the correct BeautifulSoup parser for the publisher."""
-    if publisher == "Elsevier":
-        return BeautifulSoup(content, 'xml')
-    if publisher == "Wiley" and content.startswith('<component xmlns'):
-        return BeautifulSoup(content, 'xml')
-    return BeautifulSoup(content, 'html.parser')
-
-
-def _extract_figure_labels(figure_captions):
-    """Extract figure/scheme labels (e.g. 'Figure 1', 'Fig. 2') from caption strings."""
-    label_pattern = re.compile(r'^((?:Fig\.?|Figure|Scheme)\s+\d+)', re.IGNORECASE)
-    labels = []
-    for cap in figure_captions:
-        m = label_pattern.match(cap)
-        if m:
-            labels.append(m.group(1))
-    return labels
-
-
-def _get_captions(soup, publisher):
-    """Route to the correct publisher captions extractor. Returns structured caption list."""
+def _get_captions(soup, publisher, labels=None):
+    """
+    Route to the correct publisher captions extractor. Returns structured caption list.
+    If labels is a list, the figure/scheme labels (e.g. 'Figure 1', 'Fig. 2') of the
+    figure captions are appended to it.
+    """
     dispatch = {
         "ACS":      captions_extractor.acs_captions,
         "Frontiers":captions_extractor.acs_captions,   # same HTML pattern
@@ -82,7 +55,7 @@ def _get_captions(soup, publisher):
         "Elsevier": captions_extractor.elsevier_captions,
     }
     fn = dispatch.get(publisher)
-    return fn(soup) if fn else []
+    return fn(soup, labels) if fn else []
 
 
 def _get_tables(soup, publisher):
@@ -102,8 +75,11 @@ def _get_tables(soup, publisher):
     return fn(soup) if fn else []
 
 
-def _get_figure_urls(soup, publisher, figure_labels):
-    """Route to the correct publisher figure URL extractor. Returns list of URLs."""
+def _get_figure_urls(soup, publisher, figure_labels, found=None):
+    """
+    Route to the correct publisher figure URL extractor. Returns list of URLs.
+    If found is a list, the figure label of each URL is appended to it.
+    """
     dispatch = {
         "ACS":      figure_downloader.acs_figure,
         "RSC":      figure_downloader.rsc_figure,
@@ -117,62 +93,158 @@ def _get_figure_urls(soup, publisher, figure_labels):
     }
     fn = dispatch.get(publisher)
     if fn and figure_labels:
-        return fn(soup, figure_labels)
+        return fn(soup, figure_labels, found)
     return []
 
 
-def _augment_json(json_path, content, publisher, api_key=None,
-                  skip_extras=False, skip_abstract=False):
+def _stage(timer, name):
+    """Context manager timing a stage on timer, or doing nothing if timer is None."""
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+
+def _extract_extras(ctx, timer=None):
+    """
+    Extract captions, tables, and figure URLs from the article's shared parse tree.
+    Must run before the section extractors, which strip tags from the tree in place.
+    Each extractor is timed as a stage on timer, if given.
+    """
+    with _stage(timer, 'parse'):
+        soup = ctx.soup
+    publisher = ctx.publisher
+    extras = {}
+    figure_labels = []
+
+    try:
+        with _stage(timer, 'captions'):
+            caption_results = _get_captions(soup, publisher, figure_labels)
+        figure_captions = []
+        table_captions = []
+        for entry in caption_results:
+            if entry.get("name") == "Figures":
+                figure_captions = entry.get("content", [])
+            elif entry.get("name") == "Tables":
+                table_captions = entry.get("content", [])
+        extras["Figure_captions"] = figure_captions
+        extras["Table_captions"] = table_captions
+    except Exception as e:
+        print(f"  Warning: captions extraction failed: {e}")
+
+    try:
+        with _stage(timer, 'tables'):
+            extras["Tables"] = _get_tables(soup, publisher)
+    except Exception as e:
+        print(f"  Warning: tables extraction failed: {e}")
+
+    try:
+        with _stage(timer, 'figure_urls'):
+            url_labels = []
+            extras["Figure_urls"] = _get_figure_urls(soup, publisher, figure_labels, url_labels)
+            extras["Figure_labels"] = url_labels
+    except Exception as e:
+        print(f"  Warning: figure URL extraction failed: {e}")
+
+    return extras
+
+
+def _augment_json(data, extras=None, skip_abstract=True):
+    """
+    Add the captions, tables and figure URLs from _extract_extras to a record
+    returned by article_extractor, in place. Abstracts are added afterwards by the
+    batched add_abstract stage; unless it is skipped, the record starts with an
+    empty one.
+    """
+    if extras is not None:
+        data.update(extras)
+        for key in ("Figure_captions", "Table_captions", "Tables", "Figure_urls", "Figure_labels"):
+            data.setdefault(key, [])
+    if not skip_abstract:
+        data.setdefault("Abstract", "")
+    return data
+
+
+def _process_file(filename, data_dir, save_dir, skip_extras=False, html_parser=DEFAULT_HTML_PARSER,
+                  skip_abstract=True, timer=None, records=None):
+    """
+    Extract a single article file to JSON. Returns the enrichment stages that ran
+    ({'extras': bool, 'abstract': bool}) on success, or None on failure.
+    The time of every extraction stage is recorded on timer (a StageTimer), if given.
+    If records is a list, the record is appended to it instead of being written to
+    save_dir, for the caller to add to a corpus.
+    """
+    try:
+        print(f"Processing: {filename}")
+        if not skip_extras:
+            table_pages.use_cache(os.path.join(save_dir, table_pages.TABLE_CACHE_NAME))
+        with _stage(timer, 'read'):
+            ctx = ArticleContext(filename, data_dir, html_parser)
+        # Extras read the untouched tree, so they run before section extraction
+        extras = None if skip_extras else _extract_extras(ctx, timer)
+        with _stage(timer, 'sections'):
+            data = to_json.article_extractor(ctx)
+        if data is None:
+            return None
+        _augment_json(data, extras, skip_abstract)
+        if records is not None:
+            records.append(data)
+        else:
+            json_path = os.path.join(save_dir, filename.replace('.txt', '.json'))
+            with _stage(timer, 'write'):
+                tools.write_json(data, json_path)
+        return {'extras': extras is not None, 'abstract': bool(data.get('Abstract'))}
+    except Exception as e:
+        print(f"FAILED: {filename} - Error: {str(e)}")
+        return None
+
+
+def _process_file_captured(task):
+    """
+    Process pool entry point: run _process_file with stdout captured, so the parent
+    can write each file's messages to the log as one uninterleaved block. The last
+    two elements of task are whether the record is returned for a corpus instead of
+    written as a JSON file, and the trace_memory flag for the file's StageTimer.
     """
-    Load a JSON file produced by article_extractor, add captions, tables,
-    figure URLs, and abstract, then save back to the same path.
+    *args, to_corpus, trace_memory = task
+    rss_before = max_rss_kb()
+    timer = StageTimer(trace_memory)
+    records = [] if to_corpus else None
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        stages = _process_file(*args, timer=timer, records=records)
+    data = records[0] if records else None
+    return task[0], stages, buffer.getvalue(), timer.stages, (rss_before, max_rss_kb()), data
+
+
+def _add_abstracts_corpus(filenames, save_dir, fmt, max_shard_bytes, api_key, rate, cache, timings):
     """
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    if not skip_extras:
-        soup = _get_soup(content, publisher)
-
-        try:
-            caption_results = _get_captions(soup, publisher)
-            figure_captions = []
-            table_captions = []
-            for entry in caption_results:
-                if entry.get("name") == "Figures":
-                    figure_captions = entry.get("content", [])
-                elif entry.get("name") == "Tables":
-                    table_captions = entry.get("content", [])
-            data["Figure_captions"] = figure_captions
-            data["Table_captions"] = table_captions
-        except Exception as e:
-            print(f"  Warning: captions extraction failed: {e}")
-            data.setdefault("Figure_captions", [])
-            data.setdefault("Table_captions", [])
-
-        try:
-            data["Tables"] = _get_tables(soup, publisher)
-        except Exception as e:
-            print(f"  Warning: tables extraction failed: {e}")
-            data.setdefault("Tables", [])
-
-        try:
-            figure_labels = _extract_figure_labels(data.get("Figure_captions", []))
-            data["Figure_urls"] = _get_figure_urls(soup, publisher, figure_labels)
-        except Exception as e:
-            print(f"  Warning: figure URL extraction failed: {e}")
-            data.setdefault("Figure_urls", [])
-
-    if not skip_abstract and api_key:
-        doi_str = data.get("DOI", "")
-        try:
-            xml_content = add_abstract.abstract_retrieve(doi_str, api_key)
-            data["Abstract"] = add_abstract.extract_abstract(xml_content)
-        except Exception as e:
-            print(f"  Warning: abstract retrieval failed for {doi_str}: {e}")
-            data.setdefault("Abstract", "")
-        time.sleep(1)
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, sort_keys=True, indent=4, ensure_ascii=False)
+    Batched abstract stage for a corpus: records of filenames without an abstract are
+    read from the corpus add_abstract.ABSTRACT_BATCH at a time (except those the cache
+    records as having no abstract) and the updated records are appended
+    to it, after which the corpus is compacted so the superseded copies do not stay on
+    disk. Returns the filenames whose record now contains an abstract.
+    """
+    done = set()
+    appended = 0
+    with CorpusReader(save_dir) as reader, CorpusWriter(save_dir, fmt, max_shard_bytes) as writer:
+        for i in range(0, len(filenames), add_abstract.ABSTRACT_BATCH):
+            records = {}
+            for filename in filenames[i:i + add_abstract.ABSTRACT_BATCH]:
+                if add_abstract.known_without_abstract(filename_to_doi(filename), cache):
+                    continue
+                data = reader.get(filename_to_doi(filename))
+                if data is not None:
+                    records[filename] = data
+            batch_done, changed = add_abstract.add_abstracts_to_records(
+                records, api_key, rate=rate, workers=add_abstract.DEFAULT_WORKERS,
+                cache=cache, timings=timings,
+            )
+            for filename in sorted(changed):
+                writer.add(records[filename], doi=filename_to_doi(filename))
+            appended += len(changed)
+            done |= batch_done
+    if appended:
+        rewritten, removed = compact(save_dir, fmt, max_shard_bytes)
+        print(f"Corpus compacted: {rewritten} records rewritten, {removed} shards deleted")
+    return done
 
 
 def main():
@@ -181,7 +253,7 @@ def main():
     )
     parser.add_argument(
         '--data_dir', required=True,
-        help='Directory containing the article .txt files'
+        help='Directory containing the article .txt files and/or an article archive'
     )
     parser.add_argument(
         '--save_dir', default=None,
@@ -195,6 +267,47 @@ def main():
         '--skip_abstract', action='store_true',
         help='Skip abstract retrieval from the Scopus API'
     )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of worker processes to extract files in parallel (default: 1)'
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Only extract new, changed, or previously failed files (see extraction_manifest.json)'
+    )
+    parser.add_argument(
+        '--hash', action='store_true',
+        help='With --incremental, compare file content hashes when mtimes differ'
+    )
+    parser.add_argument(
+        '--parser', choices=HTML_PARSERS, default=DEFAULT_HTML_PARSER,
+        help=f'BeautifulSoup backend for HTML articles (default: {DEFAULT_HTML_PARSER})'
+    )
+    parser.add_argument(
+        '--abstract_rate', type=float, default=add_abstract.DEFAULT_RATE,
+        help=f'Maximum Scopus abstract requests per second (default: {add_abstract.DEFAULT_RATE:g})'
+    )
+    parser.add_argument(
+        '--table_rate', type=float, default=table_pages.DEFAULT_RATE,
+        help=f'Maximum Nature/Springer table page requests per second (default: {table_pages.DEFAULT_RATE:g})'
+    )
+    parser.add_argument(
+        '--progress', action='store_true',
+        help='Show a live progress line with throughput and ETA on stderr'
+    )
+    parser.add_argument(
+        '--trace_memory', action='store_true',
+        help=f'Record the peak memory of every stage in {METRICS_NAME} (slows extraction down)'
+    )
+    parser.add_argument(
+        '--output', choices=('json',) + FORMATS, default='json',
+        help='json: one JSON file per article (default); jsonl or parquet: a sharded '
+             'corpus indexed by DOI in the save directory (parquet requires pyarrow)'
+    )
+    parser.add_argument(
+        '--shard_size', type=int, default=DEFAULT_SHARD_MB,
+        help=f'With --output jsonl or parquet, maximum shard size in MB (default: {DEFAULT_SHARD_MB})'
+    )
     args = parser.parse_args()
 
     data_dir = args.data_dir
@@ -237,16 +350,19 @@ def main():
     sys.stdout = Tee(original_stdout, log_file)
 
     print(f"Processing files from: {data_dir}")
-    print(f"Saving JSON files to:  {save_dir}")
+    if args.output == 'json':
+        print(f"Saving JSON files to:  {save_dir}")
+    else:
+        print(f"Saving {args.output} corpus shards to: {save_dir}")
     print(f"Log file:              {log_path}")
     if not args.skip_extras:
         print("Extras:    captions, tables, and figure URLs will be extracted")
     if not args.skip_abstract:
-        print("Abstract:  will be retrieved from the Scopus API (1 s delay per article)")
+        print(f"Abstract:  will be retrieved from the Scopus API after extraction "
+              f"(up to {args.abstract_rate:g} requests/s)")
     print("-" * 80)
 
-    pattern = re.compile(r'^10\.\d{4,9}[^\s]*\.txt$')
-    matching_files = [f for f in os.listdir(data_dir) if pattern.match(f)]
+    matching_files = list_articles(data_dir)
 
     print(f"Found {len(matching_files)} matching files")
     print("-" * 80)
@@ -259,30 +375,137 @@ def main():
         print(f"Log file created: {log_path}")
         return
 
+    manifest = ExtractionManifest(save_dir, use_hash=args.hash)
+
+    def version_of(filename):
+        return to_json.EXTRACTOR_VERSION.get(get_publisher(filename))
+
+    to_corpus = args.output != 'json'
+    shard_bytes = args.shard_size * 2**20
+
+    all_files = matching_files
+    if args.incremental:
+        # In a corpus the record has no file of its own; it must be in the corpus index
+        corpus = CorpusReader(save_dir) if to_corpus and is_corpus(save_dir) else None
+        # Abstracts are a separate stage below, so they do not force re-extraction
+        up_to_date = [
+            f for f in matching_files
+            if manifest.is_up_to_date(
+                f, article_source(f, data_dir),
+                None if to_corpus else os.path.join(save_dir, f.replace('.txt', '.json')),
+                version_of(f),
+                extras=not args.skip_extras,
+                abstract=False,
+            )
+            and (not to_corpus or (corpus is not None and filename_to_doi(f) in corpus))
+        ]
+        if corpus is not None:
+            corpus.close()
+        skip = set(up_to_date)
+        matching_files = [f for f in matching_files if f not in skip]
+        print(f"Incremental: {len(up_to_date)} up-to-date files skipped, "
+              f"{len(matching_files)} to process")
+        print("-" * 80)
+
+    if not args.skip_extras:
+        # Table pages are fetched up front, so extraction itself only reads them from the cache
+        cache = table_pages.TablePageCache(os.path.join(save_dir, table_pages.TABLE_CACHE_NAME))
+        linked, fetched, errors = table_pages.prefetch_table_pages(
+            matching_files, data_dir, cache, rate=args.table_rate,
+        )
+        cache.close()
+        if linked:
+            print(f"Table pages: {linked} linked, {fetched} fetched, "
+                  f"{linked - fetched - len(errors)} already cached, {len(errors)} failed")
+            print("-" * 80)
+
     failed_files = []
     successful_count = 0
+    metrics = ExtractionMetrics()
+    progress = Progress(len(matching_files)) if args.progress else None
+    corpus_writer = CorpusWriter(save_dir, args.output, shard_bytes) if to_corpus else None
+
+    def record(filename, stages, timings, rss_kb, data=None):
+        nonlocal successful_count
+        if data is not None:
+            timer = StageTimer()
+            with timer.stage('write'):
+                corpus_writer.add(data, doi=filename_to_doi(filename))
+            timings['write'] = timer.stages['write']
+        if stages is not None:
+            successful_count += 1
+        else:
+            failed_files.append(filename)
+        metrics.add(get_publisher(filename), timings, ok=stages is not None, rss_kb=rss_kb)
+        if progress is not None:
+            progress.update()
+        manifest.record(filename, article_source(filename, data_dir),
+                        version_of(filename), stages)
+        # Save periodically so an interrupted run keeps its progress
+        if (successful_count + len(failed_files)) % 100 == 0:
+            manifest.save()
+
+    if args.workers > 1:
+        print(f"Extracting with {args.workers} worker processes")
+        tasks = [(filename, data_dir, save_dir, args.skip_extras, args.parser, args.skip_abstract,
+                  to_corpus, args.trace_memory)
+                 for filename in matching_files]
+        # Several files per task keeps inter-process overhead low; results come back in input order
+        chunksize = max(1, len(tasks) // (args.workers * 4))
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for filename, stages, output, timings, rss_kb, data in pool.map(
+                    _process_file_captured, tasks, chunksize=chunksize):
+                sys.stdout.write(output)
+                record(filename, stages, timings, rss_kb, data)
+    else:
+        for filename in matching_files:
+            rss_before = max_rss_kb()
+            timer = StageTimer(args.trace_memory)
+            records = [] if to_corpus else None
+            stages = _process_file(filename, data_dir, save_dir, skip_extras=args.skip_extras,
+                                   html_parser=args.parser, skip_abstract=args.skip_abstract,
+                                   timer=timer, records=records)
+            record(filename, stages, timer.stages, (rss_before, max_rss_kb()),
+                   records[0] if records else None)
+    if progress is not None:
+        progress.close()
+    if corpus_writer is not None:
+        # Commits the last shard to the index before the abstract stage reads it
+        corpus_writer.close()
+    manifest.save()
 
-    for filename in matching_files:
-        try:
-            print(f"Processing: {filename}")
-            success = to_json.article_extractor(filename, data_dir, save_dir)
-            if success:
-                successful_count += 1
-                json_path = os.path.join(save_dir, filename.replace('.txt', '.json'))
-                publisher = _get_publisher(filename)
-                with open(os.path.join(data_dir, filename), 'r', encoding='utf-8') as f:
-                    content = f.read()
-                _augment_json(
-                    json_path, content, publisher,
-                    api_key=elsevier_api_key,
-                    skip_extras=args.skip_extras,
-                    skip_abstract=args.skip_abstract,
+    if not args.skip_abstract:
+        # Batched abstract stage over every extracted file still missing an abstract
+        need_abstract = [
+            f for f in all_files
+            if manifest.entries.get(f, {}).get('status') == 'ok'
+            and not manifest.entries[f].get('abstract')
+        ]
+        if need_abstract:
+            print("-" * 80)
+            cache = add_abstract.AbstractCache(os.path.join(save_dir, add_abstract.ABSTRACT_CACHE_NAME))
+            abstract_timings = {}
+            if to_corpus:
+                done = _add_abstracts_corpus(
+                    need_abstract, save_dir, args.output, shard_bytes, elsevier_api_key,
+                    args.abstract_rate, cache, abstract_timings,
                 )
             else:
-                failed_files.append(filename)
-        except Exception as e:
-            print(f"FAILED: {filename} - Error: {str(e)}")
-            failed_files.append(filename)
+                json_paths = {os.path.join(save_dir, f.replace('.txt', '.json')): f
+                              for f in need_abstract}
+                done = {json_paths[path] for path in add_abstract.add_abstracts(
+                    list(json_paths), elsevier_api_key,
+                    rate=args.abstract_rate, workers=add_abstract.DEFAULT_WORKERS, cache=cache,
+                    timings=abstract_timings,
+                )}
+                abstract_timings = {json_paths[path]: t for path, t in abstract_timings.items()}
+            cache.close()
+            for filename, seconds in abstract_timings.items():
+                metrics.add_stages(get_publisher(filename), {'abstract': {'seconds': seconds}})
+            for filename in done:
+                manifest.set_stage(filename, 'abstract')
+            manifest.save()
+            print(f"Abstracts added: {len(done)}/{len(need_abstract)}")
 
     print("-" * 80)
     print(f"Processing complete!")
@@ -295,6 +518,24 @@ def main():
         for f in failed_files:
             print(f"  - {f}")
 
+    metrics_path = os.path.join(save_dir, METRICS_NAME)
+    summary = metrics.write(metrics_path, workers=args.workers, parser=args.parser,
+                            extras=not args.skip_extras, abstract=not args.skip_abstract,
+                            output=args.output)
+    print("-" * 80)
+    print(f"Throughput: {summary['articles_per_s']} files/s over {summary['elapsed_s']} s")
+    print(f"{'Publisher':<10} {'Articles':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}  Slowest stage (p95)")
+    for publisher, entry in summary['publishers'].items():
+        stages_ms = entry['stages_ms']
+        if 'total' not in stages_ms:
+            continue
+        total = stages_ms['total']
+        slowest = max((s for s in stages_ms if s != 'total'), key=lambda s: stages_ms[s]['p95'],
+                      default='')
+        print(f"{publisher:<10} {entry['ok'] + entry['failed']:>8} {total['p50']:>9.1f} "
+              f"{total['p95']:>9.1f} {total['max']:>9.1f}  {slowest}")
+    print(f"Stage metrics written to: {metrics_path}")
+
     sys.stdout = original_stdout
     log_file.close()
     print(f"Processing complete. Log file created: {log_path}")
@@ -1,47 +1,83 @@
 from bs4 import BeautifulSoup
 import re
 
-def rsc_captions(soup):
+# Each extractor walks the document once, collecting its kinds of caption into
+# separate lists that are joined in a fixed order afterwards, so the captions come
+# out in the same order as with one search per kind. If a labels list is passed,
+# the figure/scheme labels of the figure captions ('Fig. 1', 'Scheme 2', ...) are
+# appended to it, for the figure URL resolvers.
+
+FIGURE_LABEL = re.compile(r'^((?:Fig\.?|Figure|Scheme)\s+\d+)', re.IGNORECASE)
+
+def _class_contains(tag, word):
+    # same test as class_=lambda c: c and word in c.lower(), for single and multi-valued class
+    classes = tag.get('class')
+    if not classes:
+        return False
+    if isinstance(classes, str):
+        return word in classes.lower()
+    return any(word in c.lower() for c in classes)
+
+def _class_is(tag, name):
+    # same test as class_=name
+    classes = tag.get('class')
+    if not classes:
+        return False
+    if isinstance(classes, str):
+        return classes == name
+    return name in classes or " ".join(classes) == name
+
+def rsc_captions(soup, labels=None):
     '''RSC, MDPI'''
+    image_titles = []
     captions = []
-    for cap in soup.find_all(["td"], class_=lambda c: c and "image_title" in c.lower()):
-        captions.append(cap.get_text(strip=True))
-    for cap in soup.find_all(["div", "p"], class_=lambda c: c and "caption" in c.lower()):
-        captions.append(cap.get_text(strip=True))
-    captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    for tag in soup.find_all(["td", "div", "p"]):
+        if tag.name == "td":
+            if _class_contains(tag, "image_title"):
+                image_titles.append(tag.get_text(strip=True))
+        elif _class_contains(tag, "caption"):
+            captions.append(tag.get_text(strip=True))
+    captions = list(dict.fromkeys(image_titles + captions))
+    results = structure_figure_captions(captions, labels)
     return results
 
-def tandf_captions(soup):
+def tandf_captions(soup, labels=None):
     captions = []
     for cap in soup.find_all(["div", "p"], class_=lambda c: c and "caption" in c.lower()):
         captions.append(cap.get_text(strip=True))
     captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    results = structure_figure_captions(captions, labels)
     return results
 
-def acs_captions(soup):
+def acs_captions(soup, labels=None):
     '''ACS, Frontiers'''
     captions = []
-    for fig in soup.find_all('figure', id = True):
-        id = fig.get('id')
-        if id.startswith('fig'):
-            cap = fig.find('p').get_text(strip=True)
-            captions.append(cap)
-        elif id.startswith('sch'):
-            texts = fig.find('div', class_='title2').get_text(strip=True)
-            captions.append(texts)
-    for tab in soup.find_all('div', class_='NLM_caption'):
-        cap = tab.get_text(strip=True)
-        captions.append(cap)
-    captions = list(dict.fromkeys(captions)) 
+    table_captions = []
+    for tag in soup.find_all(["figure", "div"]):
+        if tag.name == "figure":
+            id = tag.get('id')
+            if id is None:
+                continue
+            if id.startswith('fig'):
+                cap = tag.find('p').get_text(strip=True)
+                captions.append(cap)
+            elif id.startswith('sch'):
+                texts = tag.find('div', class_='title2').get_text(strip=True)
+                captions.append(texts)
+        elif _class_is(tag, 'NLM_caption'):
+            table_captions.append(tag.get_text(strip=True))
+    captions = list(dict.fromkeys(captions + table_captions))
     captions = [c for c in captions if c.lstrip().lower().startswith(("figure", "table", "scheme"))]
-    results = structure_figure_captions(captions)
+    results = structure_figure_captions(captions, labels)
     return results
 
-def nature_captions(soup):
+def nature_captions(soup, labels=None):
     captions = []
-    for cap in soup.find_all("figcaption"):
+    table_captions = []
+    for cap in soup.find_all(["figcaption", "caption"]):
+        if cap.name == "caption":
+            table_captions.append(cap.get_text(strip=True))
+            continue
         figure = cap.parent
         subcap = figure.find("div", {"data-test": "bottom-caption"})
         if subcap:
@@ -51,78 +87,98 @@ def nature_captions(soup):
             captions.append(caption)
         else:
             captions.append(cap.get_text(strip=True))
-    for cap in soup.find_all("caption"):
-        captions.append(cap.get_text(strip=True))
-    captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    captions = list(dict.fromkeys(captions + table_captions))
+    results = structure_figure_captions(captions, labels)
 
     return results
 
-def science_captions(soup):
+def science_captions(soup, labels=None):
     captions = []
     for cap in soup.find_all("figcaption"):
         text = cap.get_text(strip=True)
         text = text.replace('\xa0', '')
         captions.append(text)
     captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    results = structure_figure_captions(captions, labels)
 
     return results
 
-def wiley_captions(soup):
+def wiley_captions(soup, labels=None):
+    headers = []
     captions = []
-    for cap in soup.find_all(["header"], class_=lambda c: c and "caption" in c.lower()):
-        captions.append(cap.get_text(strip=True))
-    for cap in soup.find_all("figcaption"):
-        text = cap.get_text(strip=True).replace('Open in figure viewerPowerPoint', '')
-        captions.append(text)
-    captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    for cap in soup.find_all(["header", "figcaption"]):
+        if cap.name == "header":
+            if _class_contains(cap, "caption"):
+                headers.append(cap.get_text(strip=True))
+        else:
+            text = cap.get_text(strip=True).replace('Open in figure viewerPowerPoint', '')
+            captions.append(text)
+    captions = list(dict.fromkeys(headers + captions))
+    results = structure_figure_captions(captions, labels)
     return results
 
-def springer_captions(soup):
+def springer_captions(soup, labels=None):
+    figure_divs = []
     captions = []
-    for cap in soup.find_all(["div"], class_=lambda c: c and "figure" in c.lower()):
-        captions.append(cap.get_text(strip=True))
-    for cap in soup.find_all("figcaption"):
-        captions.append(cap.get_text(strip=True))
-    captions = [c for c in captions if c.lstrip().lower().startswith(("fig.", "table"))] #remove strings that do not start with "Fig." or "Table"
+    for cap in soup.find_all(["div", "figcaption"]):
+        if cap.name == "div":
+            if _class_contains(cap, "figure"):
+                figure_divs.append(cap.get_text(strip=True))
+        else:
+            captions.append(cap.get_text(strip=True))
+    captions = [c for c in figure_divs + captions if c.lstrip().lower().startswith(("fig.", "table"))] #remove strings that do not start with "Fig." or "Table"
     captions = [c for c in captions if len(c) >= 8]
     captions = list(dict.fromkeys(captions))
-    results = structure_figure_captions(captions)
+    results = structure_figure_captions(captions, labels)
     return results
 
-def elsevier_captions(soup):
+def elsevier_captions(soup, labels=None):
     '''Elsevier, Springer'''
     valid_label = re.compile(r'^(Fig\.?|Figure|Table|Scheme)\b', re.IGNORECASE)
     captions = []
-    for label in soup.find_all("ce:label"):
-        figure_number = label.get_text(strip=True)
-        if not valid_label.match(figure_number):
-            continue
-        caption_tag = label.find_next("ce:caption")
-        if caption_tag:
-            cap = figure_number + " " + caption_tag.get_text(strip=True)
-            captions.append(cap)
-
-    results = structure_figure_captions(captions)
+    # labels seen since the last ce:caption; the next ce:caption in document order is theirs
+    pending = []
+    for tag in soup.find_all(["ce:label", "ce:caption"]):
+        if tag.name == "label":
+            figure_number = tag.get_text(strip=True)
+            if valid_label.match(figure_number):
+                pending.append(figure_number)
+        elif pending:
+            text = tag.get_text(strip=True)
+            for figure_number in pending:
+                captions.append(figure_number + " " + text)
+            pending = []
+
+    results = structure_figure_captions(captions, labels)
     return results
 
-def concat_strings(captions):
-    tables_caps = []
-    for c in captions:
-        if c.lower().startswith('table'):
-            tables_caps.append(c.strip())
-
+def split_captions(captions):
+    '''
+    Split captions into table captions (starting with 'table') and figure captions,
+    both stripped, and return (tables_caps, fig_caps, figure labels of fig_caps)
+    '''
+    tables_caps = [c.strip() for c in captions if c.lower().startswith('table')]
+    # a table caption with trailing whitespace is not in the set and counts as a figure too
+    table_set = set(tables_caps)
     fig_caps = []
+    figure_labels = []
     for c in captions:
-        if c not in tables_caps:
-            fig_caps.append(c.strip())
+        if c not in table_set:
+            c = c.strip()
+            fig_caps.append(c)
+            m = FIGURE_LABEL.match(c)
+            if m:
+                figure_labels.append(m.group(1))
+    return tables_caps, fig_caps, figure_labels
 
+def concat_strings(captions):
+    tables_caps, fig_caps, _ = split_captions(captions)
     return tables_caps, fig_caps
 
-def structure_figure_captions(captions):
-    tables_caps, figures_caps = concat_strings(captions)
+def structure_figure_captions(captions, labels=None):
+    tables_caps, figures_caps, figure_labels = split_captions(captions)
+    if labels is not None:
+        labels.extend(figure_labels)
     results = []
     if figures_caps:
         result_figure = {
@@ -140,8 +196,3 @@ def structure_figure_captions(captions):
         results.append(result_tables)
 
     return results
-
-
-
-
-
@@ -0,0 +1,619 @@
+'''
+Sharded corpus of extracted article records, an alternative to writing one JSON
+file per article.
+
+Records are appended to size-bounded shards in the corpus directory, either as
+compact JSON Lines (corpus-00000.jsonl) or, with pyarrow installed, as Parquet
+(corpus-00000.parquet) with the Sections tree stored as a nested list column.
+An SQLite index (corpus_index.sqlite) maps every DOI to its shard and position,
+so a single record is read with one seek, while reading the whole corpus is a
+sequential scan of the shards.
+
+Shards are never modified once written: writing a DOI again (a re-extraction, or
+a record updated with its abstract) appends the new record to a new shard and
+points the index at it. Readers skip the superseded copies, and compact()
+reclaims their space by rewriting the shards that hold them.
+
+Usage:
+    python corpus_store.py --corpus_dir /path/to/corpus --doi 10.1038/s41586-020-0000-0
+    python corpus_store.py --corpus_dir /path/to/corpus --from_json /path/to/json_output [--format parquet]
+    python corpus_store.py --corpus_dir /path/to/corpus --compact
+'''
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+
+from doi_tools import filename_to_doi
+
+INDEX_NAME = 'corpus_index.sqlite'
+SHARD_PREFIX = 'corpus-'
+FORMATS = ('jsonl', 'parquet')
+DEFAULT_SHARD_MB = 256
+ROW_GROUP_SIZE = 1000    # Parquet records per row group; a lookup reads one row group
+JSON_PATTERN = re.compile(r'^10\.\d{4,9}[^\s]*\.json$')   # article JSON files
+
+# Parquet columns besides Sections; any field that does not fit them is kept in Extra as JSON
+STRING_FIELDS = ('DOI', 'Title', 'Journal', 'Abstract')
+STRING_LIST_FIELDS = ('Keywords', 'Figure_captions', 'Table_captions', 'Figure_urls', 'Figure_labels')
+TABLE_KEYS = {'label', 'content'}
+SECTION_KEYS = {'name', 'type', 'content'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The parquet corpus format requires pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def normalize_doi(doi):
+    '''
+    Function to return the index key of a DOI
+    '''
+    return doi.strip().lower()
+
+
+def is_corpus(path):
+    '''
+    Function to check whether a directory holds a sharded corpus rather than JSON files
+    '''
+    return os.path.exists(os.path.join(path, INDEX_NAME))
+
+
+def _open_index(corpus_dir):
+    conn = sqlite3.connect(os.path.join(corpus_dir, INDEX_NAME))
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, doi TEXT NOT NULL, '
+        'shard TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER)'
+    )
+    conn.commit()
+    return conn
+
+
+# ── Parquet row conversion ─────────────────────────────────────────────────────
+
+def flatten_sections(sections, depth=0, rows=None):
+    '''
+    Function to flatten a Sections tree into pre-order rows of (depth, name, type, text):
+    a section heading has text None, a paragraph has name and type None
+    '''
+    if rows is None:
+        rows = []
+    for item in sections:
+        if isinstance(item, dict):
+            rows.append({'depth': depth, 'name': item['name'], 'type': item['type'], 'text': None})
+            flatten_sections(item['content'], depth + 1, rows)
+        else:
+            rows.append({'depth': depth, 'name': None, 'type': None, 'text': item})
+    return rows
+
+
+def unflatten_sections(rows):
+    '''
+    Function to rebuild the Sections tree from the rows of flatten_sections
+    '''
+    sections = []
+    stack = [sections]
+    for row in rows:
+        del stack[row['depth'] + 1:]
+        if row['text'] is None:
+            section = {'content': [], 'name': row['name'], 'type': row['type']}
+            stack[-1].append(section)
+            stack.append(section['content'])
+        else:
+            stack[-1].append(row['text'])
+    return sections
+
+
+def _is_section_tree(sections):
+    if not isinstance(sections, list):
+        return False
+    for item in sections:
+        if isinstance(item, dict):
+            if (set(item) != SECTION_KEYS or not isinstance(item['name'], str)
+                    or not isinstance(item['type'], str) or not _is_section_tree(item['content'])):
+                return False
+        elif not isinstance(item, str):
+            return False
+    return True
+
+
+def _is_string_list(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _is_table_list(value):
+    return isinstance(value, list) and all(
+        isinstance(t, dict) and set(t) == TABLE_KEYS and all(isinstance(v, str) for v in t.values())
+        for t in value
+    )
+
+
+def parquet_schema():
+    pa = _pyarrow()
+    return pa.schema(
+        [(field, pa.string()) for field in STRING_FIELDS]
+        + [(field, pa.list_(pa.string())) for field in STRING_LIST_FIELDS]
+        + [('Tables', pa.list_(pa.struct([('label', pa.string()), ('content', pa.string())]))),
+           ('Sections', pa.list_(pa.struct([('depth', pa.int16()), ('name', pa.string()),
+                                            ('type', pa.string()), ('text', pa.string())]))),
+           ('Extra', pa.string())]
+    )
+
+
+def record_to_row(record):
+    '''
+    Function to convert a record to a Parquet row; absent fields are null and fields
+    that do not match their column type are stored in Extra, so the conversion is lossless
+    '''
+    row = {}
+    extra = {}
+    checks = dict.fromkeys(STRING_FIELDS, lambda v: isinstance(v, str))
+    checks.update(dict.fromkeys(STRING_LIST_FIELDS, _is_string_list))
+    checks['Tables'] = _is_table_list
+    checks['Sections'] = _is_section_tree
+    for field, value in record.items():
+        if field in checks and checks[field](value):
+            row[field] = flatten_sections(value) if field == 'Sections' else value
+        else:
+            extra[field] = value
+    row['Extra'] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return row
+
+
+def row_to_record(row):
+    '''
+    Function to convert a Parquet row back to the record it was made from
+    '''
+    record = {}
+    for field, value in row.items():
+        if field == 'Extra' or value is None:
+            continue
+        record[field] = unflatten_sections(value) if field == 'Sections' else value
+    if row.get('Extra'):
+        record.update(json.loads(row['Extra']))
+    return dict(sorted(record.items()))
+
+
+# ── Shards ─────────────────────────────────────────────────────────────────────
+
+class _JsonlShard:
+    '''
+    JSON Lines shard; a record's position is its byte offset and length
+    '''
+
+    def __init__(self, path, row_group_size=None):
+        self.path = path
+        self.file = open(path + '.tmp', 'wb')
+        self.size = 0
+
+    def add(self, record):
+        line = (json.dumps(record, sort_keys=True, ensure_ascii=False) + '\n').encode('utf-8')
+        offset = self.size
+        self.file.write(line)
+        self.size += len(line)
+        return offset, len(line)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class _ParquetShard:
+    '''
+    Parquet shard written in row groups of row_group_size records; a record's
+    position is its row number. size is the JSON size of the records written,
+    an estimate of the uncompressed data size
+    '''
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        pa = _pyarrow()
+        self.path = path
+        self.schema = parquet_schema()
+        self.writer = pa.parquet.ParquetWriter(path + '.tmp', self.schema)
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.count = 0
+        self.size = 0
+
+    def _flush(self):
+        if self.rows:
+            pa = _pyarrow()
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema),
+                                    row_group_size=self.row_group_size)
+            self.rows = []
+
+    def add(self, record):
+        self.rows.append(record_to_row(record))
+        self.size += len(json.dumps(record, ensure_ascii=False))
+        offset = self.count
+        self.count += 1
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+        return offset, None
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+SHARD_TYPES = {'jsonl': _JsonlShard, 'parquet': _ParquetShard}
+
+
+def _shard_names(corpus_dir):
+    pattern = re.compile(rf'^{SHARD_PREFIX}(\d+)\.({"|".join(FORMATS)})$')
+    names = [f for f in os.listdir(corpus_dir) if pattern.match(f)]
+    return sorted(names, key=lambda f: int(pattern.match(f).group(1)))
+
+
+class CorpusWriter:
+    '''
+    Appends records to the shards of a corpus directory and indexes them by DOI.
+
+    Each writer starts a new shard after the existing ones and rolls over to the
+    next once the current shard reaches max_shard_bytes. A shard is renamed into
+    place and its index entries are committed only when it is closed, so the index
+    never points into a partially written shard.
+
+    Usage:
+        with CorpusWriter('/path/to/corpus', fmt='jsonl') as writer:
+            writer.add(record)
+    '''
+
+    def __init__(self, corpus_dir, fmt='jsonl', max_shard_bytes=DEFAULT_SHARD_MB * 2**20,
+                 row_group_size=ROW_GROUP_SIZE):
+        if fmt not in SHARD_TYPES:
+            raise ValueError(f"Unknown corpus format '{fmt}', expected one of {FORMATS}")
+        if fmt == 'parquet':
+            _pyarrow()
+        os.makedirs(corpus_dir, exist_ok=True)
+        self.corpus_dir = corpus_dir
+        self.fmt = fmt
+        self.max_shard_bytes = max_shard_bytes
+        self.row_group_size = row_group_size
+        self.conn = _open_index(corpus_dir)
+        existing = _shard_names(corpus_dir)
+        self.next_shard = int(existing[-1][len(SHARD_PREFIX):].split('.')[0]) + 1 if existing else 0
+        self.shard = None
+        self.shard_name = None
+        self.pending = {}
+
+    def _open_shard(self):
+        self.shard_name = f'{SHARD_PREFIX}{self.next_shard:05d}.{self.fmt}'
+        self.next_shard += 1
+        self.shard = SHARD_TYPES[self.fmt](os.path.join(self.corpus_dir, self.shard_name),
+                                           self.row_group_size)
+
+    def _close_shard(self):
+        if self.shard is None:
+            return
+        self.shard.close()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO records (key, doi, shard, offset, length) VALUES (?, ?, ?, ?, ?)',
+                [(normalize_doi(doi), doi, self.shard_name, offset, length)
+                 for doi, offset, length in self.pending.values()],
+            )
+        self.shard = None
+        self.pending = {}
+
+    def add(self, record, doi=None):
+        '''
+        Append a record, indexed under doi (default: the record's DOI field)
+        '''
+        doi = (doi or record['DOI']).strip()
+        if self.shard is None:
+            self._open_shard()
+        self.pending[normalize_doi(doi)] = (doi, *self.shard.add(record))
+        if self.shard.size >= self.max_shard_bytes:
+            self._close_shard()
+
+    def close(self):
+        self._close_shard()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusReader:
+    '''
+    Reads records from a corpus directory, by DOI or sequentially.
+
+    Usage:
+        with CorpusReader('/path/to/corpus') as corpus:
+            record = corpus.get('10.1038/s41586-020-0000-0')
+            for record in corpus:
+                ...
+    '''
+
+    def __init__(self, corpus_dir):
+        if not is_corpus(corpus_dir):
+            raise FileNotFoundError(f"No corpus index in '{corpus_dir}'")
+        self.corpus_dir = corpus_dir
+        self.conn = _open_index(corpus_dir)
+        self.files = {}
+        self.row_groups = {}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def __contains__(self, doi):
+        return self.locate(doi) is not None
+
+    def locate(self, doi):
+        '''
+        Return the (shard, offset, length) of a DOI's current record, or None
+        '''
+        return self.conn.execute(
+            'SELECT shard, offset, length FROM records WHERE key = ?', (normalize_doi(doi),)
+        ).fetchone()
+
+    def dois(self):
+        '''
+        Return the DOIs in the corpus, as given when their records were written
+        '''
+        return [row[0] for row in self.conn.execute('SELECT doi FROM records ORDER BY key')]
+
+    def _file(self, shard):
+        if shard not in self.files:
+            path = os.path.join(self.corpus_dir, shard)
+            if shard.endswith('.parquet'):
+                parquet_file = _pyarrow().parquet.ParquetFile(path)
+                starts = [0]
+                for i in range(parquet_file.num_row_groups):
+                    starts.append(starts[-1] + parquet_file.metadata.row_group(i).num_rows)
+                self.row_groups[shard] = starts
+                self.files[shard] = parquet_file
+            else:
+                self.files[shard] = open(path, 'rb')
+        return self.files[shard]
+
+    def get(self, doi):
+        '''
+        Return the current record of a DOI, or None if it is not in the corpus
+        '''
+        location = self.locate(doi)
+        if location is None:
+            return None
+        shard, offset, length = location
+        f = self._file(shard)
+        if shard.endswith('.parquet'):
+            starts = self.row_groups[shard]
+            group = next(i for i in range(len(starts) - 1) if starts[i] <= offset < starts[i + 1])
+            row = f.read_row_group(group).slice(offset - starts[group], 1).to_pylist()[0]
+            return row_to_record(row)
+        f.seek(offset)
+        return json.loads(f.read(length))
+
+    def _live_offsets(self, shard):
+        return dict(self.conn.execute(
+            'SELECT offset, doi FROM records WHERE shard = ?', (shard,)).fetchall())
+
+    def shards(self):
+        '''
+        Return {shard: DOIs of its current records} for every shard holding a current record
+        '''
+        shards = {}
+        for shard, doi in self.conn.execute('SELECT shard, doi FROM records ORDER BY shard, offset'):
+            shards.setdefault(shard, []).append(doi)
+        return shards
+
+    def items(self, shards=None):
+        '''
+        Yield (doi, record) for every current record, reading the shards sequentially.
+        With shards, only the records in those shards are read
+        '''
+        for shard in _shard_names(self.corpus_dir):
+            if shards is not None and shard not in shards:
+                continue
+            live = self._live_offsets(shard)
+            if not live:
+                continue
+            path = os.path.join(self.corpus_dir, shard)
+            if shard.endswith('.parquet'):
+                parquet_file = _pyarrow().parquet.ParquetFile(path)
+                offset = 0
+                for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE):
+                    for row in batch.to_pylist():
+                        if offset in live:
+                            yield live[offset], row_to_record(row)
+                        offset += 1
+            else:
+                with open(path, 'rb') as f:
+                    offset = 0
+                    for line in f:
+                        if offset in live:
+                            yield live[offset], json.loads(line)
+                        offset += len(line)
+
+    def __iter__(self):
+        '''
+        Yield every current record, reading the shards sequentially
+        '''
+        for _, record in self.items():
+            yield record
+
+    def close(self):
+        for f in self.files.values():
+            if hasattr(f, 'close'):
+                f.close()
+        self.files = {}
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _shard_records(path):
+    if path.endswith('.parquet'):
+        return _pyarrow().parquet.ParquetFile(path).metadata.num_rows
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def compact(corpus_dir, fmt=None, max_shard_bytes=DEFAULT_SHARD_MB * 2**20,
+            row_group_size=ROW_GROUP_SIZE):
+    '''
+    Function to reclaim the space of superseded records. The current records of
+    every shard that also holds superseded ones are appended to new shards (in fmt,
+    default the format of the newest shard), then every shard left without a current
+    record is deleted. No writer may be adding to the corpus meanwhile.
+    Returns (number of records rewritten, number of shards deleted)
+    '''
+    rewritten = 0
+    with CorpusReader(corpus_dir) as reader:
+        names = _shard_names(corpus_dir)
+        live = {shard: len(dois) for shard, dois in reader.shards().items()}
+        partial = {shard for shard in names
+                   if 0 < live.get(shard, 0) < _shard_records(os.path.join(corpus_dir, shard))}
+        if partial:
+            fmt = fmt or names[-1].rsplit('.', 1)[1]
+            # the index moves each record to its new shard as that shard is closed,
+            # so an interrupted compaction leaves every record readable
+            with CorpusWriter(corpus_dir, fmt, max_shard_bytes, row_group_size) as writer:
+                for doi, record in reader.items(shards=partial):
+                    writer.add(record, doi=doi)
+                    rewritten += 1
+        live = reader.shards()
+    dead = [shard for shard in _shard_names(corpus_dir) if shard not in live]
+    for shard in dead:
+        os.remove(os.path.join(corpus_dir, shard))
+    return rewritten, len(dead)
+
+
+def open_articles(data_dir):
+    '''
+    Function to return (number of articles, iterator of (name, load)) for data_dir,
+    either a corpus or a directory of JSON article files. name is the article's file
+    name stem (its DOI with '/' replaced by '-') and load() returns its record
+    '''
+    if is_corpus(data_dir):
+        reader = CorpusReader(data_dir)
+
+        def corpus_articles():
+            try:
+                for doi, record in reader.items():
+                    yield doi.replace('/', '-'), lambda record=record: record
+            finally:
+                reader.close()
+        return len(reader), corpus_articles()
+
+    json_files = sorted(f for f in os.listdir(data_dir) if JSON_PATTERN.match(f))
+
+    def load_json(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    articles = ((os.path.splitext(f)[0], lambda path=os.path.join(data_dir, f): load_json(path))
+                for f in json_files)
+    return len(json_files), articles
+
+
+def article_sources(data_dir):
+    '''
+    Function to return [(source, mtime, names)] for data_dir, either a corpus or a
+    directory of JSON article files: every file records are read from (a JSON file
+    or a corpus shard), its modification time and the names of the articles in it
+    (their DOIs with '/' replaced by '-'). Shards are never rewritten, so a shard's
+    mtime is when its records were written
+    '''
+    if is_corpus(data_dir):
+        with CorpusReader(data_dir) as reader:
+            shards = reader.shards()
+        return [(shard, os.path.getmtime(os.path.join(data_dir, shard)),
+                 [doi.replace('/', '-') for doi in dois])
+                for shard, dois in sorted(shards.items())]
+
+    return [(f, os.path.getmtime(os.path.join(data_dir, f)), [os.path.splitext(f)[0]])
+            for f in sorted(os.listdir(data_dir)) if JSON_PATTERN.match(f)]
+
+
+def read_source(data_dir, source):
+    '''
+    Function to yield (name, record) for the articles in source, a JSON file or a
+    corpus shard of data_dir as returned by article_sources
+    '''
+    if source.endswith('.json'):
+        with open(os.path.join(data_dir, source), 'r', encoding='utf-8') as f:
+            yield os.path.splitext(source)[0], json.load(f)
+        return
+    with CorpusReader(data_dir) as reader:
+        for doi, record in reader.items(shards={source}):
+            yield doi.replace('/', '-'), record
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Look up records in a sharded article corpus, or build one from JSON files'
+    )
+    parser.add_argument(
+        '--corpus_dir', required=True,
+        help='Directory holding the corpus shards and index'
+    )
+    parser.add_argument(
+        '--doi', default=None,
+        help='Print the record of this DOI'
+    )
+    parser.add_argument(
+        '--from_json', default=None,
+        help='Add every JSON article file in this directory to the corpus'
+    )
+    parser.add_argument(
+        '--format', choices=FORMATS, default='jsonl',
+        help='Shard format for --from_json (default: jsonl)'
+    )
+    parser.add_argument(
+        '--shard_size', type=int, default=DEFAULT_SHARD_MB,
+        help=f'Maximum shard size in MB for --from_json and --compact (default: {DEFAULT_SHARD_MB})'
+    )
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Rewrite the shards holding superseded records and delete the dead shards'
+    )
+    args = parser.parse_args()
+
+    if args.from_json:
+        if not os.path.exists(args.from_json):
+            print(f"Error: JSON directory '{args.from_json}' does not exist.")
+            sys.exit(1)
+        json_files = sorted(f for f in os.listdir(args.from_json) if JSON_PATTERN.match(f))
+        with CorpusWriter(args.corpus_dir, args.format, args.shard_size * 2**20) as writer:
+            for filename in json_files:
+                with open(os.path.join(args.from_json, filename), 'r', encoding='utf-8') as f:
+                    writer.add(json.load(f), doi=filename_to_doi(filename))
+        print(f"Added {len(json_files)} records to {args.corpus_dir}")
+
+    if args.compact:
+        before = sum(os.path.getsize(os.path.join(args.corpus_dir, f)) for f in _shard_names(args.corpus_dir))
+        rewritten, removed = compact(args.corpus_dir, max_shard_bytes=args.shard_size * 2**20)
+        after = sum(os.path.getsize(os.path.join(args.corpus_dir, f)) for f in _shard_names(args.corpus_dir))
+        print(f"Compacted {args.corpus_dir}: {rewritten} records rewritten, {removed} shards deleted, "
+              f"{before / 2**20:.1f} MB -> {after / 2**20:.1f} MB")
+
+    if args.doi:
+        with CorpusReader(args.corpus_dir) as corpus:
+            record = corpus.get(args.doi)
+        if record is None:
+            print(f"DOI {args.doi} not found in {args.corpus_dir}")
+            sys.exit(1)
+        print(json.dumps(record, indent=4, ensure_ascii=False))
+    elif not args.from_json and not args.compact:
+        with CorpusReader(args.corpus_dir) as corpus:
+            print(f"{len(corpus)} records in {len(_shard_names(args.corpus_dir))} shards")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 Package converts dois to filenames and read dois from a file
 '''
 
+import os
+
 def doi_to_filename(dois):
     '''
     Function to convert a list of dois to a list of filenames of the full text html/xml
@@ -11,6 +13,13 @@ def doi_to_filename(dois):
         filenames.append(doi.replace('/', '-')+'.txt')
     return filenames
     
+def filename_to_doi(filename):
+    '''
+    Function to convert a full text (.txt) or extracted (.json) filename back to its doi
+    '''
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return name.replace('-', '/', 1)
+
 def doi_list(filename):
     '''
     Function to read dois from a file and return a list of dois
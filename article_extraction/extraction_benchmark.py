@@ -0,0 +1,268 @@
+'''
+Per-publisher extraction benchmark over the fixture articles in benchmark_fixtures/.
+
+There is one small fixture article per publisher, with separate fixtures for the
+Wiley XML and HTML formats and for the current and legacy MDPI layouts. For each
+fixture the benchmark times the parse and every extraction stage (captions, tables,
+figure URLs, sections) as the fastest of --repeat runs, which is far less
+sensitive to machine noise than the mean on articles this small, and records the peak
+Python memory of one full extraction with tracemalloc.
+
+The benchmark runs offline: table pages that nature_table and springer_table
+would fetch are served from benchmark_fixtures/table_page.html, and any other
+outbound request made through http_client raises an error.
+
+Results can be saved as a baseline and later runs compared against it; a stage
+that is slower (or uses more memory) than the baseline by more than --threshold
+is reported as a regression and the script exits with status 1. Baselines are
+machine specific, so save one on the machine the comparisons will run on. Each
+run also times a fixed reference parse, and baseline times are scaled by how much
+faster or slower that reference ran, so a busy or throttled machine is not
+mistaken for a regression.
+
+Usage:
+    python extraction_benchmark.py --save_baseline
+    python extraction_benchmark.py [--threshold 0.2] [--repeat 20] [--parser lxml]
+'''
+
+import gc
+import io
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+import tracemalloc
+
+import http_client
+import to_json
+import extractor_tools as tools
+from article_context import ArticleContext, HTML_PARSERS, DEFAULT_HTML_PARSER
+from article_to_json import _get_captions, _get_tables, _get_figure_urls
+from bs4 import BeautifulSoup
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_fixtures')
+TABLE_PAGE = 'table_page.html'
+BASELINE_NAME = 'baseline.json'
+STAGES = ('parse', 'captions', 'tables', 'figure_urls', 'sections')
+DEFAULT_THRESHOLD = 0.2     # allowed fractional slowdown before a stage is a regression
+MIN_DELTA_MS = 1.0          # ignore differences smaller than this, they are timer noise
+CALIBRATION_KEY = '_calibration_ms'
+CALIBRATION_HTML = '<html><body>' + '<div class="c"><h2>t</h2><p>text <a href="#">link</a> <span>x</span></p></div>' * 200 + '</body></html>'
+
+
+class _CannedResponse:
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+@contextlib.contextmanager
+def offline(fixture_dir=FIXTURE_DIR):
+    '''Serve table sub-pages from the fixture directory and refuse any other request'''
+    with open(os.path.join(fixture_dir, TABLE_PAGE), 'r', encoding='utf-8') as f:
+        table_page = f.read()
+
+    def fake_request(method, url, **kwargs):
+        if '/tables/' in url:
+            return _CannedResponse(table_page)
+        raise RuntimeError(f"Network access during benchmark: {method} {url}")
+
+    original = http_client.request, http_client.get
+    http_client.request = fake_request
+    http_client.get = lambda url, **kwargs: fake_request('GET', url, **kwargs)
+    try:
+        yield
+    finally:
+        http_client.request, http_client.get = original
+
+
+def _timed(timings, errors, stage, fn, *args):
+    # like article_to_json, a failing stage is reported and does not stop the others
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        errors.append(f"{stage} failed ({type(e).__name__})")
+        result = None
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def run_stages(filename, fixture_dir, html_parser):
+    '''
+    Run a full extraction of one fixture, in the same order as article_to_json
+    (extras before sections). Returns (seconds per stage, record or None, stage errors)
+    '''
+    timings = {}
+    errors = []
+    ctx = ArticleContext(filename, fixture_dir, html_parser)
+    soup = _timed(timings, errors, 'parse', lambda: ctx.soup)
+    figure_labels = []
+    _timed(timings, errors, 'captions', _get_captions, soup, ctx.publisher, figure_labels)
+    _timed(timings, errors, 'tables', _get_tables, soup, ctx.publisher)
+    _timed(timings, errors, 'figure_urls', _get_figure_urls, soup, ctx.publisher, figure_labels)
+    data = _timed(timings, errors, 'sections', to_json.article_extractor, ctx)
+    if data is None and not any(e.startswith('sections') for e in errors):
+        errors.append("no sections")
+    return timings, data, errors
+
+
+def benchmark_fixture(filename, fixture_dir, html_parser, repeat):
+    '''Return the benchmark result of one fixture: best ms per stage, peak KB and status'''
+    runs = {stage: [] for stage in STAGES + ('total',)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            # as in timeit, keep garbage collection pauses out of the timings
+            gc.collect()
+            gc.disable()
+            try:
+                timings, data, errors = run_stages(filename, fixture_dir, html_parser)
+            except Exception as e:
+                return {'status': f'error: {e}'}
+            finally:
+                gc.enable()
+            for stage in STAGES:
+                runs[stage].append(timings[stage])
+            runs['total'].append(sum(timings.values()))
+
+        tracemalloc.start()
+        try:
+            run_stages(filename, fixture_dir, html_parser)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    result = {stage: min(runs[stage]) * 1000 for stage in STAGES + ('total',)}
+    result['peak_kb'] = peak / 1024
+    result['status'] = ', '.join(errors) or 'ok'
+    return result
+
+
+def calibrate(repeat):
+    '''Return the fastest time in ms of a fixed reference parse, a measure of current machine speed'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        BeautifulSoup(CALIBRATION_HTML, 'html.parser').find_all('p')
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def find_regressions(results, baseline, threshold, min_delta_ms=MIN_DELTA_MS):
+    '''
+    Return (fixture, metric, baseline value, current value) for every regressed metric,
+    with baseline times scaled by the ratio of the two runs' calibration times
+    '''
+    scale = 1.0
+    if baseline.get(CALIBRATION_KEY) and results.get(CALIBRATION_KEY):
+        scale = results[CALIBRATION_KEY] / baseline[CALIBRATION_KEY]
+    regressions = []
+    for fixture, result in results.items():
+        reference = baseline.get(fixture)
+        if fixture == CALIBRATION_KEY or reference is None or 'total' not in result:
+            continue
+        for metric in STAGES + ('total',):
+            if metric not in reference:
+                continue
+            expected = reference[metric] * scale
+            if (result[metric] > expected * (1 + threshold)
+                    and result[metric] - expected > min_delta_ms):
+                regressions.append((fixture, metric, expected, result[metric]))
+        if 'peak_kb' in reference and result['peak_kb'] > reference['peak_kb'] * (1 + threshold):
+            regressions.append((fixture, 'peak_kb', reference['peak_kb'], result['peak_kb']))
+    return regressions
+
+
+def print_results(results):
+    header = f"{'Fixture':<32}" + ''.join(f"{stage:>12}" for stage in STAGES + ('total',))
+    print(header + f"{'peak KB':>10}  status")
+    print("-" * (len(header) + 18))
+    for fixture, result in results.items():
+        if fixture == CALIBRATION_KEY:
+            continue
+        if 'total' not in result:
+            print(f"{fixture:<32} {result['status']}")
+            continue
+        row = ''.join(f"{result[stage]:>12.2f}" for stage in STAGES + ('total',))
+        print(f"{fixture:<32}{row}{result['peak_kb']:>10.0f}  {result['status']}")
+    print("(times in ms, fastest run per stage)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark per-publisher extraction on the fixture articles'
+    )
+    parser.add_argument(
+        '--fixture_dir', default=FIXTURE_DIR,
+        help='Directory containing the fixture articles (default: benchmark_fixtures/)'
+    )
+    parser.add_argument(
+        '--baseline', default=None,
+        help='Baseline results file (default: <fixture_dir>/baseline.json)'
+    )
+    parser.add_argument(
+        '--save_baseline', action='store_true',
+        help='Save this run as the baseline instead of comparing against it'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help=f'Fractional slowdown over the baseline reported as a regression (default: {DEFAULT_THRESHOLD:g})'
+    )
+    parser.add_argument(
+        '--min_delta_ms', type=float, default=MIN_DELTA_MS,
+        help=f'Ignore slowdowns smaller than this many ms (default: {MIN_DELTA_MS:g})'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=20,
+        help='Runs per fixture, the fastest time of each stage is reported (default: 20)'
+    )
+    parser.add_argument(
+        '--parser', choices=HTML_PARSERS, default=DEFAULT_HTML_PARSER,
+        help=f'BeautifulSoup backend for HTML articles (default: {DEFAULT_HTML_PARSER})'
+    )
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or os.path.join(args.fixture_dir, BASELINE_NAME)
+    pattern = re.compile(r'^10\.\d{4,9}[^\s]*\.txt$')
+    fixtures = sorted(f for f in os.listdir(args.fixture_dir) if pattern.match(f))
+    if not fixtures:
+        print(f"No fixture articles found in {args.fixture_dir}")
+        sys.exit(1)
+
+    results = {CALIBRATION_KEY: calibrate(args.repeat)}
+    with offline(args.fixture_dir):
+        for filename in fixtures:
+            results[filename] = benchmark_fixture(filename, args.fixture_dir, args.parser, args.repeat)
+    print_results(results)
+
+    if args.save_baseline:
+        tools.write_json(results, baseline_path)
+        print(f"\nBaseline saved to {baseline_path}")
+        return
+    if not os.path.exists(baseline_path):
+        print(f"\nNo baseline at {baseline_path}; run with --save_baseline to create one")
+        return
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.threshold, args.min_delta_ms)
+    if not regressions:
+        print(f"\nNo regressions over {baseline_path} (threshold {args.threshold:.0%})")
+        return
+    print(f"\n{len(regressions)} regressions over {baseline_path} (threshold {args.threshold:.0%}, "
+          f"baseline scaled to this machine's speed):")
+    for fixture, metric, before, after in regressions:
+        print(f"  {fixture} {metric}: {before:.2f} -> {after:.2f}")
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
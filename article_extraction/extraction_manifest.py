@@ -0,0 +1,116 @@
+'''
+Manifest of extracted articles, kept in the JSON save directory, used by
+article_to_json --incremental to skip files whose JSON output is up to date.
+
+Each entry is keyed on the source file name and records the source file size
+and mtime (plus a SHA-256 of its content when hashing is enabled; an archived
+article's size, write time and SHA-256 come from its archive entry), the
+extractor version of the publisher, which enrichment stages ran and whether
+the extraction succeeded.
+'''
+
+import hashlib
+import json
+import os
+
+import extractor_tools as tools
+
+MANIFEST_NAME = 'extraction_manifest.json'
+
+
+def _stat(source):
+    # source is a file path or an ArchiveEntry, which has the same st_size and st_mtime
+    return os.stat(source) if isinstance(source, str) else source
+
+
+def file_hash(path):
+    '''
+    Function to compute the SHA-256 hex digest of a file, or return it from an ArchiveEntry
+    '''
+    if not isinstance(path, str):
+        return path.sha256
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionManifest:
+    '''
+    Extraction state of every article file processed into save_dir.
+
+    With use_hash, a source whose mtime changed but whose size did not is only
+    treated as changed if its content hash differs, so re-downloaded but
+    identical files are not re-extracted.
+    '''
+
+    def __init__(self, save_dir, use_hash=False):
+        self.path = os.path.join(save_dir, MANIFEST_NAME)
+        self.use_hash = use_hash
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def _source_changed(self, entry, source_path):
+        stat = _stat(source_path)
+        if entry.get('size') != stat.st_size:
+            return True
+        if entry.get('mtime') == stat.st_mtime:
+            return False
+        if self.use_hash and entry.get('sha256'):
+            return entry['sha256'] != file_hash(source_path)
+        return True
+
+    def is_up_to_date(self, filename, source_path, json_path, version,
+                      extras=True, abstract=True):
+        '''
+        Return True if json_path was built from the current source_path by the
+        same extractor version with at least the requested enrichment stages.
+        Pass json_path None when the output is not a file of its own (a corpus
+        shard) and the caller checks that the record exists
+        '''
+        entry = self.entries.get(filename)
+        if entry is None or entry.get('status') != 'ok':
+            return False
+        if entry.get('version') != version:
+            return False
+        if extras and not entry.get('extras'):
+            return False
+        if abstract and not entry.get('abstract'):
+            return False
+        if json_path is not None and not os.path.exists(json_path):
+            return False
+        return not self._source_changed(entry, source_path)
+
+    def record(self, filename, source_path, version, stages=None):
+        '''
+        Record the outcome for a source file. stages is the dict of enrichment
+        stages that ran ({'extras': bool, 'abstract': bool}), or None on failure
+        '''
+        stat = _stat(source_path)
+        entry = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'version': version,
+            'status': 'ok' if stages is not None else 'failed',
+            'extras': bool(stages and stages.get('extras')),
+            'abstract': bool(stages and stages.get('abstract')),
+        }
+        if self.use_hash:
+            entry['sha256'] = file_hash(source_path)
+        self.entries[filename] = entry
+
+    def set_stage(self, filename, stage, ran=True):
+        '''
+        Mark an enrichment stage ('extras' or 'abstract') as run for a recorded file
+        '''
+        if filename in self.entries:
+            self.entries[filename][stage] = ran
+
+    def save(self):
+        '''
+        Write the manifest to save_dir atomically
+        '''
+        tools.write_json(self.entries, self.path)
@@ -0,0 +1,244 @@
+'''
+Stage timing and memory metrics for article_to_json.
+
+Every article is timed stage by stage (read, parse, captions, tables, figure URLs,
+sections, write, and the batched Scopus abstract request). For RSC and Elsevier
+the sections stage is the LimeSoup parse. With trace_memory, the peak Python
+memory allocated during each stage is also recorded with tracemalloc, which
+slows extraction down noticeably. Without it, the only memory measure is the
+peak resident set size of the process, which never goes down: for each article
+the amount by which it raised that peak is recorded (zero for most articles),
+and the run reports the highest peak of any extraction process.
+
+At the end of a run the stage times are aggregated per publisher (count, total,
+p50, p95, max) and written to extraction_metrics.json in the save directory,
+along with the run's throughput.
+'''
+
+import sys
+import time
+import contextlib
+import tracemalloc
+from array import array
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:   # not available on Windows
+    resource = None
+
+import extractor_tools as tools
+
+METRICS_NAME = 'extraction_metrics.json'
+STAGES = ('read', 'parse', 'captions', 'tables', 'figure_urls', 'sections', 'write', 'abstract')
+TOTAL = 'total'   # sum of an article's stages in article_to_json itself, without the abstract
+PROGRESS_INTERVAL = 0.5   # seconds between progress line updates
+
+
+def max_rss_kb():
+    '''
+    Function to return the maximum resident set size of this process in KB, or None if unknown
+    '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def percentile(sorted_values, q):
+    '''
+    Function to return the q-th percentile (0-100) of sorted values by the nearest-rank method
+    '''
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class StageTimer:
+    '''
+    Wall time (and, with trace_memory, peak traced memory) of each stage of one article.
+
+    Usage:
+        timer = StageTimer()
+        with timer.stage('parse'):
+            soup = ctx.soup
+        timer.stages   # {'parse': {'seconds': 0.012}}
+    '''
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {'seconds': 0.0})
+            entry['seconds'] += time.perf_counter() - start
+            if self.trace_memory:
+                peak_kb = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+                entry['peak_kb'] = max(entry.get('peak_kb', 0.0), peak_kb)
+
+    def add(self, name, seconds):
+        '''
+        Record a stage timed elsewhere, such as a batched request for this article
+        '''
+        entry = self.stages.setdefault(name, {'seconds': 0.0})
+        entry['seconds'] += seconds
+
+
+class ExtractionMetrics:
+    '''
+    Per-publisher aggregate of the stage metrics of every article in a run
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.articles = defaultdict(lambda: {'ok': 0, 'failed': 0})
+        # publisher -> stage -> seconds / peak KB of every article, kept compact for large runs
+        self.seconds = defaultdict(lambda: defaultdict(lambda: array('d')))
+        self.peak_kb = defaultdict(lambda: defaultdict(lambda: array('d')))
+        # publisher -> largest rise of a process's peak RSS during one of its articles
+        self.rss_growth_kb = defaultdict(int)
+        self.process_peak_rss_kb = None
+
+    def add(self, publisher, stages, ok=True, rss_kb=None):
+        '''
+        Add the stages of one article ({stage: {'seconds': s, 'peak_kb': kb}}), and
+        rss_kb, the peak RSS of the process that extracted it before and after, from max_rss_kb
+        '''
+        publisher = publisher or 'Unknown'
+        self.articles[publisher]['ok' if ok else 'failed'] += 1
+        self.add_stages(publisher, stages)
+        self.seconds[publisher][TOTAL].append(sum(entry['seconds'] for entry in stages.values()))
+        if rss_kb is not None and None not in rss_kb:
+            before, after = rss_kb
+            self.rss_growth_kb[publisher] = max(self.rss_growth_kb[publisher], after - before)
+            self.process_peak_rss_kb = max(self.process_peak_rss_kb or 0, after)
+
+    def add_stages(self, publisher, stages):
+        '''
+        Add stages run for an article after it was counted, such as the abstract stage
+        '''
+        publisher = publisher or 'Unknown'
+        for stage, entry in stages.items():
+            self.seconds[publisher][stage].append(entry['seconds'])
+            if 'peak_kb' in entry:
+                self.peak_kb[publisher][stage].append(entry['peak_kb'])
+
+    @staticmethod
+    def _stats(values, scale=1.0, digits=2, total=True):
+        values = sorted(values)
+        stats = {
+            'count': len(values),
+            'p50': round(percentile(values, 50) * scale, digits),
+            'p95': round(percentile(values, 95) * scale, digits),
+            'max': round(values[-1] * scale, digits),
+        }
+        if total:
+            stats['total'] = round(sum(values) * scale, digits)
+        return stats
+
+    def _publisher_summary(self, counts, seconds, peak_kb, rss_growth_kb):
+        summary = dict(counts)
+        summary['stages_ms'] = {
+            stage: self._stats(seconds[stage], scale=1000)
+            for stage in STAGES + (TOTAL,) if seconds.get(stage)
+        }
+        if peak_kb:
+            summary['stages_peak_kb'] = {
+                stage: self._stats(values, digits=0, total=False) for stage, values in peak_kb.items() if values
+            }
+        if rss_growth_kb is not None:
+            summary['max_rss_growth_kb'] = rss_growth_kb
+        return summary
+
+    def summary(self):
+        '''
+        Return the run summary: totals and throughput, and per-publisher stage statistics
+        with an 'All' entry over every publisher
+        '''
+        elapsed = time.time() - self.start
+        publishers = {}
+        all_counts = {'ok': 0, 'failed': 0}
+        all_seconds = defaultdict(list)
+        all_peak_kb = defaultdict(list)
+        for publisher in sorted(self.articles):
+            counts = self.articles[publisher]
+            publishers[publisher] = self._publisher_summary(
+                counts, self.seconds[publisher], self.peak_kb[publisher],
+                self.rss_growth_kb.get(publisher),
+            )
+            for key in all_counts:
+                all_counts[key] += counts[key]
+            for stage, values in self.seconds[publisher].items():
+                all_seconds[stage].extend(values)
+            for stage, values in self.peak_kb[publisher].items():
+                all_peak_kb[stage].extend(values)
+        publishers['All'] = self._publisher_summary(
+            all_counts, all_seconds, all_peak_kb, max(self.rss_growth_kb.values(), default=None),
+        )
+        n = all_counts['ok'] + all_counts['failed']
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+            'elapsed_s': round(elapsed, 2),
+            'articles': n,
+            'articles_per_s': round(n / elapsed, 2) if elapsed > 0 else None,
+            'process_peak_rss_kb': self.process_peak_rss_kb,
+            'publishers': publishers,
+        }
+
+    def write(self, path, **run_info):
+        '''
+        Write the summary, with any extra run settings (workers, parser, ...), to path
+        '''
+        summary = self.summary()
+        summary.update(run_info)
+        tools.write_json(summary, path)
+        return summary
+
+
+class Progress:
+    '''
+    Live progress line with throughput and ETA, redrawn in place on stream
+    at most every PROGRESS_INTERVAL seconds
+    '''
+
+    def __init__(self, total, stream=None):
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.start = time.perf_counter()
+        self.last = 0.0
+        self.done = 0
+
+    def update(self, done=None):
+        self.done = self.done + 1 if done is None else done
+        now = time.perf_counter()
+        if now - self.last < PROGRESS_INTERVAL and self.done < self.total:
+            return
+        self.last = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        self.stream.write(f"\r[{self.done}/{self.total}] {rate:.1f} files/s, "
+                          f"elapsed {_format_duration(elapsed)}, ETA {_format_duration(eta)}\033[K")
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
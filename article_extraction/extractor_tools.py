@@ -5,24 +5,124 @@ Helper functions for article extraction such as removing tags and creating json
 import json
 import os
 
+from bs4 import Tag
+
+class TagRemover:
+    '''
+    A list of find_all style removal rules (e.g. [{'name': 'div', 'class': 'figure'}]),
+    compiled once so that every tag matching any rule is removed in a single walk of
+    the tree instead of one find_all scan per rule.
+
+    Subtrees that have been cleaned are remembered, so cleaning a subtree again (or
+    any element inside one, such as the paragraphs of a cleaned section) is free.
+    Rules using keys other than name and class fall back to find_all.
+    '''
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.matchers = []
+        self.fallback = []
+        for rule in self.rules:
+            if set(rule) <= {'name', 'class', 'class_'}:
+                self.matchers.append(self._compile(rule))
+            else:
+                self.fallback.append(rule)
+        self.cleaned = {}
+
+    @staticmethod
+    def _as_set(value):
+        return {value} if isinstance(value, str) else set(value)
+
+    def _compile(self, rule):
+        names = self._as_set(rule['name']) if 'name' in rule else None
+        class_value = rule.get('class', rule.get('class_'))
+        classes = self._as_set(class_value) if class_value is not None else None
+        return names, classes
+
+    @staticmethod
+    def _name_matches(tag, names):
+        if tag.name in names:
+            return True
+        return tag.prefix is not None and f'{tag.prefix}:{tag.name}' in names
+
+    @staticmethod
+    def _class_matches(tag, classes):
+        # same semantics as find_all: any single class, or the whole class string
+        value = tag.get('class')
+        if value is None:
+            return False
+        if isinstance(value, str):
+            return value in classes
+        return any(c in classes for c in value) or (len(value) > 1 and ' '.join(value) in classes)
+
+    def matches(self, tag):
+        for names, classes in self.matchers:
+            if names is not None and not self._name_matches(tag, names):
+                continue
+            if classes is not None and not self._class_matches(tag, classes):
+                continue
+            return True
+        return False
+
+    def _is_clean(self, soup):
+        node = soup
+        while node is not None:
+            if self.cleaned.get(id(node)) is node:
+                return True
+            node = node.parent
+        return False
+
+    def remove(self, soup):
+        '''
+        Remove every descendant of soup matching one of the rules, in place
+        '''
+        if self._is_clean(soup):
+            return soup
+        stack = [soup]
+        while stack:
+            node = stack.pop()
+            for child in list(node.children):
+                if not isinstance(child, Tag):
+                    continue
+                if self.matches(child):
+                    child.extract()
+                else:
+                    stack.append(child)
+        for rule in self.fallback:
+            for tag in soup.find_all(**rule):
+                tag.extract()
+        self.cleaned[id(soup)] = soup
+        return soup
+
+def compile_rules(rules):
+    '''
+    Function to compile a list of tag removal rules into a TagRemover
+    '''
+    return rules if isinstance(rules, TagRemover) else TagRemover(rules)
+
+def iter_tags(soup, names):
+    '''
+    Yield the descendants of soup named in names, in document order, as
+    soup.find_all(names) would but without matching every tag against a filter
+    '''
+    names = set(names)
+    for node in soup.descendants:
+        if isinstance(node, Tag) and node.name in names:
+            yield node
+
 def remove_tags_soup_list(soup_list, rules):
     '''
     Function to remove tags from a list of soup objects
     '''
+    remover = compile_rules(rules)
     for element in soup_list:
-        for rule in rules:
-            for tag in element.find_all(**rule):
-                tag.extract()
+        remover.remove(element)
     return soup_list
 
 def remove_tags_soup(soup, rules):
     '''
     Function to remove tags from a soup object
     '''
-    for rule in rules:
-        for tag in soup.find_all(**rule):
-            tag.extract()
-    return soup
+    return compile_rules(rules).remove(soup)
 
 def find_paragraphs(soup, tags_list):
     '''
@@ -40,9 +140,9 @@ def find_paragraphs_list(soup, tags_list):
         paragraphs += soup.find_all(**tag)
     return paragraphs
 
-def create_json_data(doi, sections, title, save_dir, keywords = None):
+def create_json_data(doi, sections, title, keywords = None):
     '''
-    Function to create json file of html/xml article
+    Function to create the json record of html/xml article
     '''
     data = {}
     data['DOI'] = doi.replace(doi[7],'/',1).replace('.txt','')
@@ -53,6 +153,18 @@ def create_json_data(doi, sections, title, save_dir, keywords = None):
         data['Keywords'] = keywords
     data['Title'] = title
     data['Sections']= sections
-    doi = doi.replace('.txt','.json')
-    with open(os.path.join(save_dir,doi), 'w', encoding='utf-8') as f:
-        json.dump(data, f, sort_keys = True, indent=4, ensure_ascii=False)
\ No newline at end of file
+    return data
+
+def write_json(data, path):
+    '''
+    Function to write a json record atomically: the data is written to a temporary
+    file in the same directory which then replaces the target path
+    '''
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, sort_keys = True, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,26 +1,139 @@
 # download figures based on figure labels (e.g., 'Fig. 1', 'Scheme 2', 'Figure 3', etc.)
+#
+# Figure images are downloaded over the shared pooled HTTP session and streamed
+# straight to disk, concurrently under a per-host rate and concurrency limit
+# (HOST_LIMITS). Cookies exported from a logged-in browser session can be sent
+# with the requests for publishers that need them. A Selenium browser is only used
+# as a fallback for the images the direct download could not get, and returns the
+# bytes base64 encoded instead of as a list of ints.
+#
+# With a FigureStore (figure_store.py), images are kept once per content hash and
+# a URL that is already in the store is never downloaded again; figures are then
+# returned as LazyImage handles that only decode the image when it is used.
+#
+# Usage (download the Figure_urls of extracted articles into a figure store):
+#     python figure_downloader.py --data_dir /path/to/json_output --save_dir /path/to/figures
+#                                 [--cookies cookies.json] [--browser_fallback] [--phash]
 
 import io
-import json
 import os
 import re
-from urllib.parse import urljoin
+import glob
+import html
+import json
+import base64
+import hashlib
+import argparse
+import mimetypes
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 from bs4 import BeautifulSoup
 from PIL import Image
 
+import http_client
+from http_client import TokenBucket
+
+from corpus_store import open_articles
+from doi_tools import filename_to_doi
+from figure_store import FigureStore, LazyImage
+
+# Limits for figure downloads from each image host:
+# (requests per second, maximum simultaneous downloads)
+HOST_LIMITS = {
+    "media.springernature.com": (5.0, 4),
+    "ars.els-cdn.com": (5.0, 4),
+    "www.mdpi.com": (2.0, 2),
+    "pubs.acs.org": (1.0, 2),
+    "pubs.rsc.org": (1.0, 2),
+    "onlinelibrary.wiley.com": (1.0, 2),
+    "www.tandfonline.com": (1.0, 2),
+    "www.science.org": (0.5, 1),
+}
+DEFAULT_HOST_LIMIT = (1.0, 2)
+CHUNK_SIZE = 64 * 1024
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0",
+    "Accept": "image/avif,image/webp,image/png,image/jpeg,image/*;q=0.8,*/*;q=0.5",
+}
+DEFAULT_EXTENSION = '.img'
+
+# Fetches the page's own URL in the browser and hands back a data: URL
+_BROWSER_FETCH_JS = """
+const done = arguments[arguments.length - 1];
+fetch(window.location.href)
+    .then(resp => resp.ok ? resp.blob() : Promise.reject(resp.status))
+    .then(blob => {
+        const reader = new FileReader();
+        reader.onload = () => done(reader.result);
+        reader.readAsDataURL(blob);
+    })
+    .catch(err => done(null));
+"""
+
+
+# Each resolver below collects the figure anchors of a document (caption ids, figure
+# ids, image links) in a single traversal, then resolves every label with a dict
+# lookup, instead of searching the whole document once per label.
+
+_FIG_DOT_KEY = re.compile(r'(Fig\. )(\d+)')
+_FIGURE_SCHEME_KEY = re.compile(r'((?:Figure|Scheme) )(\d+)')
+_WILEY_ID_KEY = re.compile(r'(fig-)(\d+)')
+_IMG_SRC = re.compile(r'<img\b[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+
+class FigureNotFound(LookupError):
+    """A label has no matching figure anchor in the document."""
+
+
+def _substring_keys(text, pattern):
+    '''
+    every key of the form <prefix><number> that is a substring of text, e.g. 'Fig. 1'
+    and 'Fig. 12' for 'see Fig. 12', so that looking a key up matches the same
+    anchors as testing `key in text`
+    '''
+    for m in pattern.finditer(text):
+        head, digits = m.group(1), m.group(2)
+        for i in range(1, len(digits) + 1):
+            yield head + digits[:i]
 
-def nature_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
+
+def _first_by_id(tags):
+    anchors = {}
+    for tag in tags:
+        anchors.setdefault(tag.get('id'), tag)
+    return anchors
+
+
+def _found(found, label):
+    # the resolvers below skip labels they find no figure for; if the caller passes
+    # a list as found, the label of every URL returned is appended to it
+    if found is not None:
+        found.append(label)
+
+
+def nature_figure(soup: BeautifulSoup, labels: list[str], found=None) -> list[str]:
     '''for nature and springer articles'''
+    caption_ids = {}   # 'Fig. n' -> id of the first <b> caption whose text contains it
+    image_srcs = {}    # caption id -> data-src of the first image it describes
+    for tag in soup.find_all(['b', 'img']):
+        if tag.name == 'b':
+            if tag.string:
+                for key in _substring_keys(tag.string, _FIG_DOT_KEY):
+                    caption_ids.setdefault(key, tag.get('id'))
+        else:
+            image_srcs.setdefault(tag.get('aria-describedby'), tag.get('data-src'))
     urls = []
-    for l in labels:
-        number = re.search(r'\d+', l).group()
+    for label in labels:
+        number = re.search(r'\d+', label).group()
         l = f"Fig. {number}"
-        tag = soup.find('b', string=lambda text: text and l in text)
-        id = tag.get('id')
-        img = soup.find_all('img', attrs={"aria-describedby": id})
-        src = img[0].get('data-src')
+        if l not in caption_ids:
+            raise FigureNotFound(f"no caption for {l}")
+        id = caption_ids[l]
+        if id not in image_srcs:
+            raise FigureNotFound(f"no image for {l}")
+        src = image_srcs[id]
         url = urljoin('https://www.springernature.com/', src)
         full_image_url = re.sub(
             r'(?<=springernature\.com/).*?(?=/springer-static)',
@@ -28,11 +141,14 @@ def nature_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
             url
         )
         urls.append(full_image_url)
+        _found(found, label)
     return urls
 
-def science_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
-    numbers = [int(re.search(r'\d+', s).group()) for s in labels]
-    ids = [f'F{n}' for n in numbers]
+def science_figure(soup: BeautifulSoup, labels: list[str], found=None) -> list[str]:
+    ids = {}   # 'Fn' -> label
+    for s in labels:
+        n = int(re.search(r'\d+', s).group())
+        ids.setdefault(f'F{n}', s)
     tags = soup.find_all('div', class_='figure-wrap')
     urls = []
     for tag in tags:
@@ -41,11 +157,13 @@ def science_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
             src = tag.find('img').get('src')
             url = urljoin('https://www.science.org', src)
             urls.append(url)
+            _found(found, ids[figure_id])
     return urls
 
-def acs_figure(soup, figure_labels: list[str]) -> list[str | None]:
+def acs_figure(soup, figure_labels: list[str], found=None) -> list[str | None]:
     urls = []
-    
+    figures = _first_by_id(soup.find_all('figure', id=True))
+
     for label in figure_labels:
         # Extract number from label (e.g., 'Fig. 1' -> '1', 'Scheme 2' -> '2')
         match = re.search(r'\d+', label)
@@ -63,8 +181,8 @@ def acs_figure(soup, figure_labels: list[str]) -> list[str | None]:
         else:
             continue
         
-        # Find the figure element by id
-        figure = soup.find('figure', id=fig_id)
+        # Look up the figure element by id
+        figure = figures.get(fig_id)
         if figure:
             img = figure.find('img')
             if img:
@@ -72,11 +190,13 @@ def acs_figure(soup, figure_labels: list[str]) -> list[str | None]:
                 src = urljoin('https://pubs.acs.org', src)
         
         urls.append(src)
+        _found(found, label)
     
     return urls
 
-def rsc_figure(soup, labels: list[str]) -> list[str | None]:
+def rsc_figure(soup, labels: list[str], found=None) -> list[str | None]:
     urls = []
+    cells = _first_by_id(soup.find_all('td', id=True))
     
     for label in labels:
         # Extract number from label (e.g., 'Fig. 1' -> '1', 'Scheme 2' -> '2')
@@ -89,58 +209,78 @@ def rsc_figure(soup, labels: list[str]) -> list[str | None]:
         
         # Determine if it's a Scheme or Figure and set the id accordingly
         if 'scheme' in label.lower():
-            figure = soup.find('td', id=f"imgsch{num}")
+            figure = cells.get(f"imgsch{num}")
             if figure:
                 img = figure.find('a')
                 if img:
                     src = img.get('href')
                     src = urljoin('https://pubs.rsc.org', src)
                     urls.append(src)
+                    _found(found, label)
         elif 'fig' in label.lower():
-            figure = soup.find('td', id=f"imgfig{num}")
+            figure = cells.get(f"imgfig{num}")
+            if figure is None:
+                raise FigureNotFound(f"no image cell for {label}")
             img = figure.find('a')
             if img:
                 src = img.get('href')
                 src = urljoin('https://pubs.rsc.org', src)
                 urls.append(src)
+                _found(found, label)
         else:
             continue   
     return urls
 
-def wiley_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
+def wiley_figure(soup: BeautifulSoup, labels: list[str], found=None) -> list[str]:
     numbers = [int(re.search(r'\d+', s).group()) for s in labels]
     ids = [f'fig-000{n}' for n in numbers]
+    figures = {}   # 'fig-000n' -> first figure whose id contains it
+    for figure in soup.find_all('figure', id=True):
+        for key in _substring_keys(figure['id'], _WILEY_ID_KEY):
+            figures.setdefault(key, figure)
     urls = []
-    for i in ids:
-        figure = soup.find("figure", id=lambda t: t and f"{i}" in t)
-        a = figure.find('a')
+    for label, i in zip(labels, ids):
+        if i not in figures:
+            raise FigureNotFound(f"no figure with id {i}")
+        a = figures[i].find('a')
         url = a.get('href')
         url = urljoin('https://onlinelibrary.wiley.com/', url)
         urls.append(url)
+        _found(found, label)
     return urls
 
-def tandf_figure(soup: BeautifulSoup, labels: list[str]) -> list[str]:
+def tandf_figure(soup: BeautifulSoup, labels: list[str], found=None) -> list[str]:
     script = soup.find("script", string=re.compile("tandf.tfviewerdata"))
     data = json.loads(
         re.search(r"tandf\.tfviewerdata\s*=\s*(\{.*\});", script.string, re.S).group(1)
     )
+    contents = {}
+    for f in data["figures"]:
+        contents.setdefault(f["id"], f["content"])
     urls = []
     for l in labels:
         match = re.search(r'\d+', l)
         if l.lower().startswith('scheme'):
             fig_id = f'sch000{match.group()}'
-            content = next(f["content"] for f in data["figures"] if f["id"] == fig_id)
-
         elif l.lower().startswith('fig'):
             fig_id = f'f000{match.group()}'
-            content = next(f["content"] for f in data["figures"] if f["id"] == fig_id)
-        src = BeautifulSoup(content, "html.parser").img["src"]
+        if fig_id not in contents:
+            raise FigureNotFound(f"no figure with id {fig_id}")
+        # the snippet is a single <img>, so its src is read without parsing it
+        img = _IMG_SRC.search(contents[fig_id])
+        if img is None:
+            raise FigureNotFound(f"no image in figure {fig_id}")
+        src = html.unescape(next(g for g in img.groups() if g is not None))
         url = urljoin('https://www.tandfonline.com/', src)
         urls.append(url)
+        _found(found, l)
 
     return urls
 
-def elsevier_figure(soup, labels: list[str]) -> list[str]:
+def elsevier_figure(soup, labels: list[str], found=None) -> list[str]:
+    objects = {}
+    for obj in soup.find_all('object', type='IMAGE-DOWNSAMPLED'):
+        objects.setdefault(obj.get('ref'), obj)
     urls = []
     for l in labels:
         match = re.search(r'\d+', l)
@@ -149,51 +289,258 @@ def elsevier_figure(soup, labels: list[str]) -> list[str]:
             fig_id = f'sc{num}'
         elif 'fig' in l.lower():
             fig_id = f'gr{num}'
-        figure = soup.find('object', type='IMAGE-DOWNSAMPLED', ref = fig_id)
+        figure = objects.get(fig_id)
+        if figure is None:
+            raise FigureNotFound(f"no image object {fig_id}")
         src = figure.get_text()
         figure_identifier = src.split("eid/")[1].split("?")[0]
         url = 'https://ars.els-cdn.com/content/image/' + figure_identifier
         url = url.replace(".jpg", "_lrg.jpg")
         urls.append(url)
+        _found(found, l)
     return urls
 
-def mdpi_figure(soup, labels: list[str]) -> list[str]:
+def mdpi_figure(soup, labels: list[str], found=None) -> list[str]:
+    links = {}   # 'Figure n' / 'Scheme n' -> first link whose title contains it
+    for a in soup.find_all('a', title=True):
+        for key in _substring_keys(a['title'], _FIGURE_SCHEME_KEY):
+            links.setdefault(key, a)
     urls = []
     for l in labels:
         match = re.search(r'\d+', l)
         num = match.group()
         if 'scheme' in l.lower():
             id = f'Scheme {num}'
-            a = soup.find("a", string=id)
         elif 'fig' in l.lower():
             id = f'Figure {num}'
-        a = soup.find("a", title=lambda t: t and f"{id}" in t)
-        url = a.get('href')
+        if id not in links:
+            raise FigureNotFound(f"no link for {id}")
+        url = links[id].get('href')
         url = urljoin('https://www.mdpi.com/', url)
         urls.append(url)
+        _found(found, l)
     return urls
 
-def download_urls(urls, driver) -> list[Image.Image]: 
-    """driver: Selenium WebDriver. Must be run in headful mode."""
+
+class FigureDownloadError(Exception):
+    """The image could not be downloaded directly; the browser fallback may still get it."""
+
+
+def load_cookies(path) -> requests.cookies.RequestsCookieJar:
+    """
+    Load cookies saved from a browser session as a JSON list of
+    {name, value, domain, path} objects, the format of Selenium's driver.get_cookies()
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return cookies_to_jar(json.load(f))
+
+
+def cookies_to_jar(cookies) -> requests.cookies.RequestsCookieJar:
+    jar = requests.cookies.RequestsCookieJar()
+    for c in cookies:
+        jar.set(c['name'], c['value'], domain=c.get('domain', ''), path=c.get('path', '/'))
+    return jar
+
+
+def cookies_from_driver(driver) -> requests.cookies.RequestsCookieJar:
+    """Cookies of a (logged-in) Selenium session, for the direct downloads."""
+    return cookies_to_jar(driver.get_cookies())
+
+
+def _extension(content_type):
+    ext = mimetypes.guess_extension(content_type.split(';')[0].strip()) if content_type else None
+    return ext or DEFAULT_EXTENSION
+
+
+def _existing(stem):
+    # a finished download of stem, whatever its extension
+    for path in glob.glob(glob.escape(stem) + '.*'):
+        if not path.endswith('.tmp'):
+            return path
+    return None
+
+
+def _open_image_response(url, cookies=None):
+    r = http_client.get(url, stream=True, headers=HEADERS, cookies=cookies)
+    content_type = r.headers.get('Content-Type', '')
+    if r.status_code != 200 or not content_type.startswith('image/'):
+        r.close()
+        raise FigureDownloadError(f"{r.status_code} {content_type or 'no content type'}")
+    return r, content_type
+
+
+def stream_image(url, stem, cookies=None) -> str:
+    """
+    Stream the image at url to stem + extension (from its content type), through a
+    temporary file so a partial download is never left under the final name.
+    Returns the path written. Raises FigureDownloadError if the response is not an image.
+    """
+    r, content_type = _open_image_response(url, cookies)
+    path = stem + _extension(content_type)
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp, path)
+    except requests.RequestException as e:
+        raise FigureDownloadError(f"download interrupted: {e}")
+    finally:
+        r.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def fetch_image_bytes(url, cookies=None) -> bytes:
+    """Download the image at url into memory over the pooled session."""
+    r, _ = _open_image_response(url, cookies)
+    try:
+        return r.content
+    except requests.RequestException as e:
+        raise FigureDownloadError(f"download interrupted: {e}")
+    finally:
+        r.close()
+
+
+def browser_fetch(url, driver) -> tuple[bytes, str]:
+    """
+    Fetch url in the browser session of driver (a Selenium WebDriver, headful).
+    Returns (image bytes, content type).
+    """
+    driver.get(url)
+    data_url = driver.execute_async_script(_BROWSER_FETCH_JS)
+    if not data_url or not data_url.startswith('data:'):
+        raise FigureDownloadError("browser fetch failed")
+    header, encoded = data_url.split(',', 1)
+    content_type = header[len('data:'):].split(';')[0]
+    if not content_type.startswith('image/'):
+        raise FigureDownloadError(f"browser fetch returned {content_type or 'no content type'}")
+    return base64.b64decode(encoded), content_type
+
+
+def download_figures(targets, cookies=None, driver=None, limits=HOST_LIMITS) -> dict:
+    """
+    Download figure images to disk. targets maps a URL to the path stem to save it
+    under; the extension is added from the image's content type, and a stem that
+    was already downloaded is skipped.
+
+    Images are streamed over pooled HTTP connections, concurrently, each host under
+    its own (rate, concurrency) limit from limits. driver, a Selenium WebDriver or
+    a function returning one, is only used for the images the direct download failed
+    on, one at a time. Returns a dict of URL -> saved path, or None if it failed.
+    """
+    paths = {}
+    pending = {}
+    for url, stem in targets.items():
+        existing = _existing(stem)
+        if existing is not None:
+            paths[url] = existing
+        else:
+            pending[url] = stem
+
+    executors = {}
+    buckets = {}
+    futures = {}
+
+    def rate_limited(bucket, url, stem):
+        bucket.acquire()
+        return stream_image(url, stem, cookies)
+
+    failed = {}
+    try:
+        for url, stem in pending.items():
+            host = urlsplit(url).netloc
+            if host not in executors:
+                rate, max_workers = limits.get(host, DEFAULT_HOST_LIMIT)
+                executors[host] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=host)
+                buckets[host] = TokenBucket(rate)
+            futures[executors[host].submit(rate_limited, buckets[host], url, stem)] = url
+        for i, future in enumerate(as_completed(futures)):
+            url = futures[future]
+            try:
+                paths[url] = future.result()
+            except (FigureDownloadError, requests.RequestException, OSError) as e:
+                failed[url] = e
+            if (i + 1) % 100 == 0:
+                print(f'Downloaded {i+1} of {len(futures)} figures')
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+    if failed and driver is not None:
+        if callable(driver):
+            driver = driver()
+        for url in list(failed):
+            try:
+                data, content_type = browser_fetch(url, driver)
+            except Exception as e:
+                failed[url] = e
+                continue
+            path = pending[url] + _extension(content_type)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            paths[url] = path
+            del failed[url]
+
+    for url, e in failed.items():
+        print(f"Error downloading {url}: {e}")
+        paths[url] = None
+    return paths
+
+
+def download_urls(urls, driver=None, cookies=None) -> list[Image.Image]:
+    """
+    Download the images at urls into memory, directly over pooled HTTP and, for the
+    ones that fails on, through driver (Selenium WebDriver, headful) if given.
+    """
     imgs = []
     for url in urls:
         try:
-            driver.get(url)
-            img = bytes(driver.execute_script("""
-                const resp = await fetch(window.location.href);
-                const buf = await resp.arrayBuffer();
-                return Array.from(new Uint8Array(buf));
-            """))
-            img = Image.open(io.BytesIO(img))
-            imgs.append(img)
+            try:
+                data = fetch_image_bytes(url, cookies)
+            except (FigureDownloadError, requests.RequestException):
+                if driver is None:
+                    raise
+                data, _ = browser_fetch(url, driver)
+            imgs.append(Image.open(io.BytesIO(data)))
         except Exception as e:
             print(f"Error downloading {url}: {e}")
     return imgs
 
-def save_figure(soup, doi, labels, driver=None) -> list[Image.Image]:
+def download_to_store(figures, store, cookies=None, driver=None) -> list[LazyImage | None]:
+    """
+    Download figures, a list of (doi, label, url), into store (a FigureStore) and
+    link each to its DOI and label. URLs already in the store are not downloaded
+    again, and identical images are stored once. Returns a LazyImage per figure,
+    or None where the download failed.
+    """
+    targets = {}
+    for _, _, url in figures:
+        if url and url not in targets and store.url_blob(url) is None:
+            targets[url] = store.temp_path(hashlib.sha1(url.encode('utf-8')).hexdigest())
+    for url, path in download_figures(targets, cookies, driver).items():
+        if path is not None:
+            store.add_file(path, url)
+    images = []
+    for doi, label, url in figures:
+        sha256 = store.url_blob(url) if url else None
+        if sha256 is None:
+            images.append(None)
+            continue
+        store.link(doi, label, sha256, url)
+        images.append(store.open(sha256))
+    return images
+
+
+def save_figure(soup, doi, labels, driver=None, cookies=None, store=None) -> list[Image.Image | LazyImage]:
     """
     retrieve figure based on figure labels
     based on publisher inferred from DOI prefix.
+    images are downloaded directly, with cookies if given; driver is only the fallback.
+    with store (a FigureStore), the images are saved in it and returned as LazyImage
+    handles, and figures already in the store are not downloaded again.
     """
     prefix_to_pub = {
         "10.1039": "RSC",
@@ -208,15 +555,15 @@ def save_figure(soup, doi, labels, driver=None) -> list[Image.Image]:
     }
 
     handlers = {
-        "ACS":       (lambda soup, labels: acs_figure(soup, labels), (AttributeError, IndexError)),
-        "Science":   (lambda soup, labels: science_figure(soup, labels), (AttributeError, IndexError)),
-        "Springer":  (lambda soup, labels: nature_figure(soup, labels), (AttributeError, IndexError)),
-        "Nature":    (lambda soup, labels: nature_figure(soup, labels), (AttributeError, IndexError)),
-        "TandF":     (lambda soup, labels: tandf_figure(soup, labels), (AttributeError, IndexError)),
-        "MDPI":      (lambda soup, labels: mdpi_figure(soup, labels), (AttributeError, IndexError)),
-        "RSC":       (lambda soup, labels: rsc_figure(soup, labels), (AttributeError, StopIteration)),
-        "Elsevier":  (lambda soup, labels: elsevier_figure(soup, labels), (AttributeError,)),
-        "Wiley":     (lambda soup, labels: wiley_figure(soup, labels), (AttributeError,)),
+        "ACS":       (lambda soup, labels, found: acs_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "Science":   (lambda soup, labels, found: science_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "Springer":  (lambda soup, labels, found: nature_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "Nature":    (lambda soup, labels, found: nature_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "TandF":     (lambda soup, labels, found: tandf_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "MDPI":      (lambda soup, labels, found: mdpi_figure(soup, labels, found), (AttributeError, IndexError, FigureNotFound)),
+        "RSC":       (lambda soup, labels, found: rsc_figure(soup, labels, found), (AttributeError, StopIteration, FigureNotFound)),
+        "Elsevier":  (lambda soup, labels, found: elsevier_figure(soup, labels, found), (AttributeError, FigureNotFound)),
+        "Wiley":     (lambda soup, labels, found: wiley_figure(soup, labels, found), (AttributeError, FigureNotFound)),
     }
 
     prefix = doi[:7]
@@ -225,10 +572,95 @@ def save_figure(soup, doi, labels, driver=None) -> list[Image.Image]:
     handler, excs = handlers[pub]
 
     try:
-        urls = handler(soup, labels)
-        imgs = download_urls(urls, driver)
+        found = []   # label of each URL, as resolvers skip labels they find no figure for
+        urls = handler(soup, labels, found)
+        if store is not None:
+            return download_to_store([(doi, label, url) for label, url in zip(found, urls)],
+                                     store, cookies, driver)
+        imgs = download_urls(urls, driver, cookies)
         return imgs
     except excs as e:
         print(f"Error with {pub}:", e)
         return None
 
+
+def figure_labels(record):
+    """
+    Return (label, url) for each figure URL of an extracted record. Records
+    written before Figure_labels was stored fall back to the figure's position
+    in Figure_urls, which is not always its number.
+    """
+    urls = record.get('Figure_urls') or []
+    labels = record.get('Figure_labels') or []
+    if len(labels) != len(urls):
+        labels = [str(i) for i in range(1, len(urls) + 1)]
+    return list(zip(labels, urls))
+
+
+def _open_browser():
+    # imported here so the direct downloads do not need a browser installed
+    from selenium import webdriver
+    print("Opening a Firefox window for the figures that could not be downloaded directly")
+    return webdriver.Firefox()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Download the figure images listed in the Figure_urls of extracted articles'
+    )
+    parser.add_argument(
+        '--data_dir', required=True,
+        help='Directory of JSON article files or a corpus (article_to_json output)'
+    )
+    parser.add_argument(
+        '--save_dir', required=True,
+        help='Figure store directory (content-addressed images and figure_index.sqlite)'
+    )
+    parser.add_argument(
+        '--cookies', default=None,
+        help="JSON file of browser cookies to send (Selenium's driver.get_cookies() format)"
+    )
+    parser.add_argument(
+        '--browser_fallback', action='store_true',
+        help='Open a Firefox window for the images the direct download fails on'
+    )
+    parser.add_argument(
+        '--phash', action='store_true',
+        help='Also store a perceptual hash of every new image and report near-duplicates'
+    )
+    args = parser.parse_args()
+
+    store = FigureStore(args.save_dir, phash=args.phash)
+    cookies = load_cookies(args.cookies) if args.cookies else None
+    figures = []
+    n, articles = open_articles(args.data_dir)
+    for name, load in articles:
+        record = load()
+        figures.extend((filename_to_doi(name), label, url)
+                       for label, url in figure_labels(record) if url)
+    print(f"{len(figures)} figures in {n} articles, "
+          f"{sum(store.url_blob(url) is None for _, _, url in figures)} to download")
+
+    browser = []
+
+    def fallback():
+        browser.append(_open_browser())
+        return browser[0]
+
+    try:
+        images = download_to_store(figures, store, cookies, fallback if args.browser_fallback else None)
+    finally:
+        for driver in browser:
+            driver.quit()
+    failed = sum(image is None for image in images)
+    blobs, size, urls, linked = store.stats()
+    print(f"Stored {len(images) - failed}/{len(images)} figures in {args.save_dir}")
+    print(f"Store: {linked} figures from {urls} URLs in {blobs} unique images ({size / 2**20:.1f} MB)")
+    if args.phash:
+        groups = store.near_duplicates()
+        print(f"Near-duplicate groups: {len(groups)} ({sum(len(g) for g in groups)} images)")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+'''
+Content-addressed on-disk store of figure images.
+
+Every image is stored once, under the SHA-256 of its bytes
+(blobs/3f/3f2a....png), however many articles or URLs it appears under, so a
+publisher logo or a graphical abstract shared by many articles takes the space of
+one file. figure_index.sqlite maps each downloaded URL to its blob, so a URL is
+never downloaded twice, and each (DOI, label) figure to its blob.
+
+Figures are handed out as LazyImage handles: opening one reads nothing, its size
+and format come from the image header, and the pixels are only decoded when the
+image is actually used.
+
+With phash=True a 64-bit perceptual difference hash (dHash) is also stored for
+every new blob, so near-duplicates (the same image re-encoded or resized) can be
+found with near_duplicates().
+
+Usage:
+    store = FigureStore('/path/to/figures')
+    for label, image in store.figures('10.1038/s41586-020-0000-0'):
+        image.size      # from the header, no decoding
+        image.convert('L')   # decodes the image
+'''
+
+import os
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import mimetypes
+
+from PIL import Image
+
+INDEX_NAME = 'figure_index.sqlite'
+BLOB_DIR = 'blobs'
+TMP_DIR = 'tmp'
+CHUNK_SIZE = 1024 * 1024
+PHASH_SIZE = 8             # dHash of an 8x8 grid of gradients, 64 bits
+NEAR_DUPLICATE_BITS = 5    # default maximum Hamming distance for near_duplicates
+
+
+def file_sha256(path):
+    '''
+    Function to return the SHA-256 hex digest of a file, read in chunks
+    '''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def perceptual_hash(image):
+    '''
+    Function to return the 64-bit difference hash (dHash) of a PIL image: each bit
+    is whether a pixel of the grayscale image, shrunk to 9x8, is brighter than its
+    right neighbour. Re-encoded or resized copies of an image differ in few bits.
+    '''
+    small = image.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(PHASH_SIZE):
+        for col in range(PHASH_SIZE):
+            left = pixels[row * (PHASH_SIZE + 1) + col]
+            right = pixels[row * (PHASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    # stored as a signed 64-bit SQLite integer
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _hamming(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def _bands(value, n_bands):
+    # split a 64-bit hash into n_bands contiguous bit ranges, as (band number, bits) keys
+    value &= (1 << 64) - 1
+    bands = []
+    start = 0
+    for i in range(n_bands):
+        width = (64 - start) // (n_bands - i)
+        bands.append((i, (value >> start) & ((1 << width) - 1)))
+        start += width
+    return bands
+
+
+class LazyImage:
+    '''
+    Handle to a stored figure that only decodes the image when its pixels are used.
+
+    size, width, height, mode and format are read from the image header. Any other
+    PIL.Image attribute or method (load, convert, save, getdata, ...) decodes the image
+    once and is forwarded to it; image gives the decoded PIL.Image itself.
+    '''
+
+    def __init__(self, path, sha256):
+        self.path = path
+        self.sha256 = sha256
+        self._header = None
+        self._image = None
+
+    def __repr__(self):
+        return f"LazyImage({self.path!r})"
+
+    def read_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def _info(self):
+        if self._header is None:
+            # Image.open only reads the header; the pixels are decoded by load()
+            with Image.open(self.path) as im:
+                self._header = (im.size, im.mode, im.format)
+        return self._header
+
+    @property
+    def size(self):
+        return self._info()[0]
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def mode(self):
+        return self._info()[1]
+
+    @property
+    def format(self):
+        return self._info()[2]
+
+    @property
+    def image(self):
+        if self._image is None:
+            with Image.open(self.path) as im:
+                im.load()
+                self._image = im
+        return self._image
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.image, name)
+
+
+class FigureStore:
+    '''
+    Content-addressed figure store in store_dir, see the module docstring.
+    Safe to share between threads.
+    '''
+
+    def __init__(self, store_dir, phash=False):
+        self.store_dir = store_dir
+        self.phash = phash
+        os.makedirs(os.path.join(store_dir, BLOB_DIR), exist_ok=True)
+        os.makedirs(os.path.join(store_dir, TMP_DIR), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(store_dir, INDEX_NAME), check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,
+                content_type TEXT, phash INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS figures (
+                doi TEXT NOT NULL, label TEXT NOT NULL, url TEXT, sha256 TEXT NOT NULL,
+                PRIMARY KEY (doi, label)
+            );
+        ''')
+        self.conn.commit()
+
+    def temp_path(self, name):
+        '''
+        Return a path in the store's temporary directory to download a file to
+        before adding it with add_file
+        '''
+        return os.path.join(self.store_dir, TMP_DIR, name)
+
+    def _blob_path(self, sha256, ext):
+        return os.path.join(BLOB_DIR, sha256[:2], sha256 + ext)
+
+    def add_file(self, path, url=None, content_type=None):
+        '''
+        Move the image file at path into the store and return its SHA-256. If the same
+        bytes are already stored, the file is deleted instead. With url, the URL is
+        recorded as downloaded.
+        '''
+        sha256 = file_sha256(path)
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        if row is not None:
+            os.remove(path)
+        else:
+            ext = os.path.splitext(path)[1].lower()
+            if content_type is None:
+                content_type = mimetypes.guess_type(path)[0]
+            rel_path = self._blob_path(sha256, ext)
+            dest = os.path.join(self.store_dir, rel_path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(path, dest)
+            phash = None
+            if self.phash:
+                try:
+                    with Image.open(dest) as im:
+                        phash = perceptual_hash(im)
+                except OSError:
+                    pass   # not an image PIL can decode; stored without a perceptual hash
+            with self.lock:
+                self.conn.execute(
+                    'INSERT OR IGNORE INTO blobs (sha256, path, size, content_type, phash) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (sha256, rel_path, os.path.getsize(dest), content_type, phash),
+                )
+                self.conn.commit()
+        if url is not None:
+            self.add_url(url, sha256)
+        return sha256
+
+    def add_bytes(self, data, ext, url=None):
+        '''
+        Add an image held in memory (ext is its file extension, e.g. '.png') and return its SHA-256
+        '''
+        # a file of its own, as other threads may be adding the same bytes
+        fd, tmp = tempfile.mkstemp(suffix=ext, dir=os.path.join(self.store_dir, TMP_DIR))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self.add_file(tmp, url)
+
+    def add_url(self, url, sha256):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO urls (url, sha256) VALUES (?, ?)', (url, sha256))
+            self.conn.commit()
+
+    def url_blob(self, url):
+        '''
+        Return the SHA-256 of the image downloaded from url, or None if it has not been
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT sha256 FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def link(self, doi, label, sha256, url=None):
+        '''
+        Record that figure label of doi is the blob sha256
+        '''
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO figures (doi, label, url, sha256) VALUES (?, ?, ?, ?)',
+                (doi.lower(), label, url, sha256),
+            )
+            self.conn.commit()
+
+    def open(self, sha256):
+        '''
+        Return a LazyImage of the blob sha256, or None if it is not stored
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT path FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        if row is None:
+            return None
+        return LazyImage(os.path.join(self.store_dir, row[0]), sha256)
+
+    def get(self, doi, label):
+        '''
+        Return a LazyImage of figure label of doi, or None if it is not stored
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT sha256 FROM figures WHERE doi = ? AND label = ?', (doi.lower(), label)
+            ).fetchone()
+        return self.open(row[0]) if row is not None else None
+
+    def figures(self, doi):
+        '''
+        Return [(label, LazyImage)] of the stored figures of doi
+        '''
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT f.label, f.sha256, b.path FROM figures f JOIN blobs b ON f.sha256 = b.sha256 '
+                'WHERE f.doi = ? ORDER BY f.rowid', (doi.lower(),)
+            ).fetchall()
+        return [(label, LazyImage(os.path.join(self.store_dir, path), sha256))
+                for label, sha256, path in rows]
+
+    def near_duplicates(self, max_distance=NEAR_DUPLICATE_BITS):
+        '''
+        Return groups (lists of SHA-256) of distinct blobs whose perceptual hashes are
+        within max_distance bits of each other. Only blobs added with phash=True are compared.
+
+        The hashes are split into max_distance + 1 bands: two hashes within max_distance
+        bits agree on at least one whole band, so only hashes sharing a band are compared.
+        '''
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT sha256, phash FROM blobs WHERE phash IS NOT NULL ORDER BY sha256'
+            ).fetchall()
+        buckets = {}
+        for i, (_, phash) in enumerate(rows):
+            for band in _bands(phash, min(max_distance + 1, 64)):
+                buckets.setdefault(band, []).append(i)
+
+        # union-find over every pair within the distance
+        parent = list(range(len(rows)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        compared = set()
+        for members in buckets.values():
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    i, j = members[a], members[b]
+                    if (i, j) in compared:
+                        continue
+                    compared.add((i, j))
+                    if find(i) != find(j) and _hamming(rows[i][1], rows[j][1]) <= max_distance:
+                        parent[find(j)] = find(i)
+        groups = {}
+        for i, (sha256, _) in enumerate(rows):
+            groups.setdefault(find(i), []).append(sha256)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def stats(self):
+        '''
+        Return (number of blobs, their total bytes, number of URLs, number of figures)
+        '''
+        with self.lock:
+            blobs, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            urls = self.conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+            figures = self.conn.execute('SELECT COUNT(*) FROM figures').fetchone()[0]
+        return blobs, size, urls, figures
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -12,20 +12,32 @@ When a section matches it is included in full (all nested subsections).
 Non-matching top-level sections are recursed into so that a matching
 sub-section can still be found.
 
+Markdown is written straight to the output file.  Articles whose Markdown is
+newer than their JSON (or corpus shard), this script and json_to_md.py are
+skipped, as are articles already found to have no matching section
+(recorded in no_match.json in the save directory).  Pass --force after
+changing the keywords.  --workers N converts JSON files or corpus shards in
+N processes.
+
 Usage
 -----
     python article_extraction/json_section_extract.py \\
         --data_dir  /path/to/json_articles \\
         --save_dir  /path/to/output \\
-        --keywords  experimental methods methodology
+        --keywords  experimental methods methodology \\
+        [--workers N] [--force]
 
 '''
 
+import io
 import json
 import os
 import sys
+import time
 import argparse
-from pathlib import Path
+
+import json_to_md
+from json_to_md import MarkdownWriter, stale_outputs, run_conversion, write_md_file, convert_articles
 
 
 # ── Heading level helpers (mirrored from json_to_md.py) ───────────────────────
@@ -89,58 +101,60 @@ def extract_matching_sections(
     return matched
 
 
-# ── Markdown rendering ─────────────────────────────────────────────────────────
+NO_MATCH_NAME = 'no_match.json'   # articles without a matching section, kept in the save directory
 
-def _section_to_lines(section: dict, depth: int = 0) -> list[str]:
-    """Render a single section object (and all its content) as Markdown lines."""
-    lines: list[str] = []
 
+# ── Markdown rendering ─────────────────────────────────────────────────────────
+
+def _write_section(out: MarkdownWriter, section: dict, depth: int = 0) -> None:
+    """Write a single section object (and all its content) as Markdown."""
     name = section.get('name', '').strip()
     section_type = section.get('type', '')
     content = section.get('content', [])
 
     if name:
         level = _heading_level(section_type, depth)
-        lines.append(f"{'#' * level} {name}")
-        lines.append('')
+        out.line(f"{'#' * level} {name}")
+        out.line()
 
     for item in content:
         if isinstance(item, str):
             text = item.strip()
             if text:
-                lines.append(text)
-                lines.append('')
+                out.line(text)
+                out.line()
         elif isinstance(item, dict):
-            lines.extend(_section_to_lines(item, depth + 1))
+            _write_section(out, item, depth + 1)
 
-    return lines
 
+def write_md(data: dict, matched_sections: list[dict], fh) -> None:
+    """Write the Markdown for *matched_sections* of *data* straight to *fh*.
 
-def build_md(data: dict, matched_sections: list[dict]) -> str:
-    """Compose the full Markdown string for *matched_sections* of *data*.
-
-    Always includes the paper metadata header (title, DOI, journal, keywords,
-    abstract) followed by only the matched sections.
+    Only the matched sections are written; the abstract is left out for now.
     """
-    lines: list[str] = []
+    out = MarkdownWriter(fh)
 
     # might be useful later
     # ── Abstract ───────────────────────────────────────────────────────────
     # abstract = data.get('Abstract', '').strip()
     # if abstract:
-    #     lines.append('## Abstract')
-    #     lines.append('')
-    #     lines.append(abstract)
-    #     lines.append('')
+    #     out.line('## Abstract')
+    #     out.line()
+    #     out.line(abstract)
+    #     out.line()
 
     # ── Matched sections ───────────────────────────────────────────────────
     for section in matched_sections:
-        lines.extend(_section_to_lines(section, depth=0))
+        _write_section(out, section, depth=0)
+
+    out.close()
+
 
-    md = '\n'.join(lines)
-    if not md.endswith('\n'):
-        md += '\n'
-    return md
+def build_md(data: dict, matched_sections: list[dict]) -> str:
+    """Compose the full Markdown string for *matched_sections* of *data*."""
+    buffer = io.StringIO()
+    write_md(data, matched_sections, buffer)
+    return buffer.getvalue()
 
 
 # ── Public API ─────────────────────────────────────────────────────────────────
@@ -153,7 +167,13 @@ def extract_sections_to_md(json_path: str, keywords: list[str]) -> str | None:
     """
     with open(json_path, 'r', encoding='utf-8') as fh:
         data = json.load(fh)
+    return record_sections_to_md(data, keywords)
+
 
+def record_sections_to_md(data: dict, keywords: list[str]) -> str | None:
+    """Return Markdown containing only the sections of the article record
+    *data* whose name matches *keywords*, or ``None`` when no sections match.
+    """
     sections = data.get('Sections', [])
     matched = extract_matching_sections(sections, keywords)
 
@@ -163,6 +183,46 @@ def extract_sections_to_md(json_path: str, keywords: list[str]) -> str | None:
     return build_md(data, matched)
 
 
+def load_no_match(save_dir: str, keywords: list[str]) -> dict:
+    """Return {name: time checked} of the articles found to have no section
+    matching *keywords*.  Articles checked for other keywords are not returned.
+    """
+    path = os.path.join(save_dir, NO_MATCH_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as fh:
+        state = json.load(fh)
+    if state.get('keywords') != keywords:
+        return {}
+    return state.get('articles', {})
+
+
+def save_no_match(save_dir: str, keywords: list[str], articles: dict) -> None:
+    """Save the no-match record written by load_no_match."""
+    path = os.path.join(save_dir, NO_MATCH_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump({'keywords': keywords, 'articles': articles}, fh, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _convert_source(task):
+    """Write the matched sections of the named articles of one JSON file or
+    corpus shard as Markdown.
+
+    Returns [(name, error or None, whether any section matched)].
+    """
+    data_dir, save_dir, source, names, keywords = task
+
+    def convert(name, data):
+        matched = extract_matching_sections(data.get('Sections', []), keywords)
+        if matched:
+            write_md_file(os.path.join(save_dir, name + '.md'),
+                          lambda fh: write_md(data, matched, fh))
+        return bool(matched)
+
+    return convert_articles(data_dir, source, names, convert)
+
+
 # ── CLI ────────────────────────────────────────────────────────────────────────
 
 def main() -> None:
@@ -175,7 +235,10 @@ def main() -> None:
     parser.add_argument(
         '--data_dir',
         required=True,
-        help='Directory containing the JSON article files.',
+        help=(
+            'Directory containing the JSON article files, or a corpus written '
+            'by article_to_json --output jsonl/parquet.'
+        ),
     )
     parser.add_argument(
         '--save_dir',
@@ -196,6 +259,20 @@ def main() -> None:
             'E.g. --keywords experimental methods methodology'
         ),
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes to convert files in parallel (default: 1).',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help=(
+            'Convert every article, including those whose Markdown is newer than '
+            'its JSON.  Use after changing --keywords.'
+        ),
+    )
     args = parser.parse_args()
 
     data_dir = args.data_dir
@@ -217,46 +294,53 @@ def main() -> None:
         print(f"Created save directory: {save_dir}")
 
     # ── Discover JSON files ─────────────────────────────────────────────────
-    json_files = sorted(f for f in os.listdir(data_dir) if f.endswith('.json'))
-
-    if not json_files:
+    # rendered through json_to_md's MarkdownWriter, so a change to either script re-renders
+    renderers = [os.path.abspath(__file__), os.path.abspath(json_to_md.__file__)]
+    # articles without a match have no Markdown to compare against, so their
+    # check is recorded instead; a change of keywords checks them all again
+    no_match = load_no_match(save_dir, keywords)
+    started = time.time()
+    tasks, up_to_date = stale_outputs(data_dir, save_dir, renderers, args.force, checked=no_match)
+    n_articles = up_to_date + sum(len(names) for _, names in tasks)
+
+    if not n_articles:
         print(f"No JSON files found in '{data_dir}'.")
         return
 
-    print(f"Found {len(json_files)} JSON file(s) in '{data_dir}'")
+    print(f"Found {n_articles} JSON article(s) in '{data_dir}'")
     print(f"Keywords: {keywords}")
+    if up_to_date:
+        print(f"Skipping {up_to_date} up-to-date Markdown file(s)")
+    if args.workers > 1:
+        print(f"Converting with {args.workers} worker processes")
     print('-' * 80)
 
     successful = 0
     skipped = 0
     failed: list[str] = []
 
-    for filename in json_files:
-        json_path = os.path.join(data_dir, filename)
-        md_filename = Path(filename).stem + '.md'
-        md_path = os.path.join(save_dir, md_filename)
-
-        try:
-            md_content = extract_sections_to_md(json_path, keywords)
-            if md_content is None:
+    tasks = [(data_dir, save_dir, source, names, keywords) for source, names in tasks]
+    for results in run_conversion(_convert_source, tasks, args.workers):
+        for name, error, matched in results:
+            filename = name + '.json'
+            no_match.pop(name, None)
+            if error is not None:
+                print(f" FAIL  {filename}  —  {error}")
+                failed.append(filename)
+            elif not matched:
                 print(f" SKIP  {filename}  — no matching sections")
+                no_match[name] = started
                 skipped += 1
-                continue
-
-            with open(md_path, 'w', encoding='utf-8') as fh:
-                fh.write(md_content)
-            print(f"   OK  {filename}  →  {md_filename}")
-            successful += 1
-
-        except Exception as exc:
-            print(f" FAIL  {filename}  —  {exc}")
-            failed.append(filename)
+            else:
+                print(f"   OK  {filename}  →  {name}.md")
+                successful += 1
+    save_no_match(save_dir, keywords, no_match)
 
     # ── Summary ────────────────────────────────────────────────────────────
     print('-' * 80)
     print(
         f"Complete: {successful} converted, {skipped} skipped "
-        f"(no match), {len(failed)} failed  /  {len(json_files)} total."
+        f"(no match), {up_to_date} up to date, {len(failed)} failed  /  {n_articles} total."
     )
     if failed:
         print(f"\nFailed ({len(failed)}):")
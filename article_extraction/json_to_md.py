@@ -5,13 +5,26 @@ Each JSON file is converted to a Markdown file preserving the Title, DOI,
 Journal, Keywords, Abstract, and Sections hierarchy.  Heading levels are
 derived either from the explicit section type (h2 → ##, h3 → ###, …) or,
 for generic types such as ce_section, from the nesting depth.
+
+Markdown is written line by line straight to the output file.  Articles whose
+Markdown is newer than both their JSON (or corpus shard) and this script are
+skipped, so a rerun only converts new or changed articles, and editing the
+template below re-renders everything.  With --workers N, JSON files or corpus
+shards are converted in N processes.
+
+Usage:
+    python json_to_md.py --data_dir /path/to/json_output [--save_dir /path/to/markdown]
+                         [--workers N] [--force]
 '''
 
+import io
 import json
 import os
 import sys
 import argparse
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus_store import article_sources, read_source
 
 
 # Map explicit HTML-like heading types to Markdown heading levels
@@ -33,21 +46,46 @@ def _heading_level(section_type: str, depth: int) -> int:
     return min(depth + 2, 6)
 
 
-def _sections_to_lines(sections: list, depth: int = 0) -> list[str]:
-    """Recursively convert a Sections list to Markdown lines.
+class MarkdownWriter:
+    """Write Markdown line by line straight to a file handle.
+
+    The output is the same as joining the lines with newlines and ensuring a
+    single trailing newline, without holding the document in memory.
+    """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.started = False
+        self.last = ''     # last character written
+
+    def line(self, text: str = '') -> None:
+        if self.started:
+            self.fh.write('\n')
+            self.last = '\n'
+        self.started = True
+        if text:
+            self.fh.write(text)
+            self.last = text[-1]
+
+    def close(self) -> None:
+        # Ensure a single trailing newline
+        if self.last != '\n':
+            self.fh.write('\n')
+
+
+def _write_sections(out: MarkdownWriter, sections: list, depth: int = 0) -> None:
+    """Recursively write a Sections list as Markdown.
 
     Each element is either:
       • a plain string  → a paragraph
       • a dict          → a (possibly nested) section object
     """
-    lines: list[str] = []
-
     for item in sections:
         if isinstance(item, str):
             text = item.strip()
             if text:
-                lines.append(text)
-                lines.append('')
+                out.line(text)
+                out.line()
 
         elif isinstance(item, dict):
             name = item.get('name', '').strip()
@@ -56,62 +94,165 @@ def _sections_to_lines(sections: list, depth: int = 0) -> list[str]:
 
             if name:
                 level = _heading_level(section_type, depth)
-                lines.append(f"{'#' * level} {name}")
-                lines.append('')
+                out.line(f"{'#' * level} {name}")
+                out.line()
 
             if content:
-                lines.extend(_sections_to_lines(content, depth + 1))
-
-    return lines
+                _write_sections(out, content, depth + 1)
 
 
 def json_to_md(json_path: str) -> str:
     """Read a single JSON article file and return its Markdown representation."""
     with open(json_path, 'r', encoding='utf-8') as fh:
         data = json.load(fh)
+    return record_to_md(data)
+
+
+def record_to_md(data: dict) -> str:
+    """Return the Markdown representation of an article record."""
+    buffer = io.StringIO()
+    write_record_md(data, buffer)
+    return buffer.getvalue()
+
 
-    lines: list[str] = []
+def write_record_md(data: dict, fh) -> None:
+    """Write the Markdown representation of an article record to fh."""
+    out = MarkdownWriter(fh)
 
     # ── Title ──────────────────────────────────────────────────────────────
     title = data.get('Title', '').strip()
     if title:
-        lines.append(f'# {title}')
-        lines.append('')
+        out.line(f'# {title}')
+        out.line()
 
     # ── Metadata (DOI / Journal) ────────────────────────────────────────────
     doi = data.get('DOI', '').strip()
     journal = data.get('Journal', '').strip()
     if doi:
-        lines.append(f'**DOI:** {doi}')
+        out.line(f'**DOI:** {doi}')
     if journal:
-        lines.append(f'**Journal:** {journal}')
+        out.line(f'**Journal:** {journal}')
     if doi or journal:
-        lines.append('')
+        out.line()
 
     # ── Keywords ───────────────────────────────────────────────────────────
     keywords = data.get('Keywords', [])
     if keywords:
-        lines.append('**Keywords:** ' + ', '.join(str(k) for k in keywords))
-        lines.append('')
+        out.line('**Keywords:** ' + ', '.join(str(k) for k in keywords))
+        out.line()
 
     # ── Abstract ───────────────────────────────────────────────────────────
     abstract = data.get('Abstract', '').strip()
     if abstract:
-        lines.append('## Abstract')
-        lines.append('')
-        lines.append(abstract)
-        lines.append('')
+        out.line('## Abstract')
+        out.line()
+        out.line(abstract)
+        out.line()
 
     # ── Sections ───────────────────────────────────────────────────────────
     sections = data.get('Sections', [])
     if sections:
-        lines.extend(_sections_to_lines(sections, depth=0))
+        _write_sections(out, sections, depth=0)
 
-    # Ensure a single trailing newline
-    md = '\n'.join(lines)
-    if not md.endswith('\n'):
-        md += '\n'
-    return md
+    out.close()
+
+
+# ── Batch conversion (shared with json_section_extract.py) ─────────────────────
+
+def write_md_file(md_path: str, write) -> None:
+    """Call write(fh) on a temporary file and move it to md_path once complete,
+    so that an interrupted run never leaves a partial file that looks up to date.
+    """
+    tmp_path = md_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            write(fh)
+        os.replace(tmp_path, md_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def stale_outputs(data_dir: str, save_dir: str, converter_paths: list[str], force: bool = False,
+                  checked: dict | None = None):
+    """Return (tasks, number of up-to-date outputs) for converting data_dir.
+
+    Each task is (source, names): a JSON file or corpus shard and the articles
+    in it whose Markdown output is missing or older than the source or than any
+    of the scripts that render it, so that editing the template re-renders everything.
+    checked maps the names of articles that were converted to no output at all to
+    the time that was found; they count as up to date on the same terms.
+    """
+    checked = checked or {}
+    converter_mtime = max(os.path.getmtime(path) for path in converter_paths)
+    tasks = []
+    up_to_date = 0
+    for source, mtime, names in article_sources(data_dir):
+        newer_than = max(mtime, converter_mtime)
+        stale = []
+        for name in names:
+            md_path = os.path.join(save_dir, name + '.md')
+            output_time = os.path.getmtime(md_path) if os.path.exists(md_path) else checked.get(name)
+            if not force and output_time is not None and output_time >= newer_than:
+                up_to_date += 1
+            else:
+                stale.append(name)
+        if stale:
+            tasks.append((source, stale))
+    return tasks, up_to_date
+
+
+def run_conversion(convert_source, tasks: list, workers: int):
+    """Run convert_source over tasks, in a process pool if workers > 1.
+
+    Yields each task's list of results in input order.
+    """
+    if workers > 1:
+        # Several sources per task keeps inter-process overhead low
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(convert_source, tasks, chunksize=chunksize)
+    else:
+        for task in tasks:
+            yield convert_source(task)
+
+
+def convert_articles(data_dir: str, source: str, names: list[str], convert) -> list:
+    """Call convert(name, data) for the named articles of one JSON file or corpus
+    shard and return [(name, error or None, result of convert)].
+
+    An article whose conversion raises is reported with its error, and so is every
+    article not yet converted when the source itself cannot be read or decoded,
+    so one bad file never stops the run.
+    """
+    wanted = set(names)
+    results = []
+    try:
+        for name, data in read_source(data_dir, source):
+            if name not in wanted:
+                continue
+            try:
+                results.append((name, None, convert(name, data)))
+            except Exception as exc:
+                results.append((name, str(exc), None))
+    except Exception as exc:
+        done = {name for name, _, _ in results}
+        results.extend((name, str(exc), None) for name in names if name not in done)
+    return results
+
+
+def _convert_source(task):
+    """Convert the named articles of one JSON file or corpus shard to Markdown.
+
+    Returns [(name, error or None, None)].
+    """
+    data_dir, save_dir, source, names = task
+
+    def convert(name, data):
+        write_md_file(os.path.join(save_dir, name + '.md'),
+                      lambda fh: write_record_md(data, fh))
+
+    return convert_articles(data_dir, source, names, convert)
 
 
 def main():
@@ -121,13 +262,25 @@ def main():
     parser.add_argument(
         '--data_dir',
         required=True,
-        help='Directory containing the JSON article files',
+        help='Directory containing the JSON article files, or a corpus written by '
+             'article_to_json --output jsonl/parquet',
     )
     parser.add_argument(
         '--save_dir',
         default=None,
         help='Directory to save Markdown files (default: <parent of data_dir>/markdown_articles)',
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes to convert files in parallel (default: 1)',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Convert every article, including those whose Markdown is newer than its JSON',
+    )
     args = parser.parse_args()
 
     data_dir = args.data_dir
@@ -147,37 +300,39 @@ def main():
         os.makedirs(save_dir)
         print(f"Created save directory: {save_dir}")
 
-    # ── Discover JSON files ─────────────────────────────────────────────────
-    json_files = sorted(f for f in os.listdir(data_dir) if f.endswith('.json'))
+    # ── Discover articles (JSON files or corpus records) ───────────────────
+    tasks, up_to_date = stale_outputs(data_dir, save_dir, [os.path.abspath(__file__)], args.force)
+    n_articles = up_to_date + sum(len(names) for _, names in tasks)
 
-    if not json_files:
-        print(f"No JSON files found in '{data_dir}'.")
+    if not n_articles:
+        print(f"No JSON articles found in '{data_dir}'.")
         return
 
-    print(f"Found {len(json_files)} JSON file(s) in '{data_dir}'")
+    print(f"Found {n_articles} JSON article(s) in '{data_dir}'")
+    if up_to_date:
+        print(f"Skipping {up_to_date} up-to-date Markdown file(s)")
+    if args.workers > 1:
+        print(f"Converting with {args.workers} worker processes")
     print('-' * 80)
 
     successful = 0
     failed: list[str] = []
 
-    for filename in json_files:
-        json_path = os.path.join(data_dir, filename)
-        md_filename = Path(filename).stem + '.md'
-        md_path = os.path.join(save_dir, md_filename)
-
-        try:
-            md_content = json_to_md(json_path)
-            with open(md_path, 'w', encoding='utf-8') as fh:
-                fh.write(md_content)
-            print(f"  OK  {filename}  →  {md_filename}")
-            successful += 1
-        except Exception as exc:
-            print(f"FAIL  {filename}  —  {exc}")
-            failed.append(filename)
+    tasks = [(data_dir, save_dir, source, names) for source, names in tasks]
+    for results in run_conversion(_convert_source, tasks, args.workers):
+        for name, error, _ in results:
+            filename = name + '.json'
+            if error is None:
+                print(f"  OK  {filename}  →  {name}.md")
+                successful += 1
+            else:
+                print(f"FAIL  {filename}  —  {error}")
+                failed.append(filename)
 
     # ── Summary ────────────────────────────────────────────────────────────
     print('-' * 80)
-    print(f"Complete: {successful}/{len(json_files)} file(s) converted successfully.")
+    print(f"Complete: {successful}/{n_articles - up_to_date} file(s) converted successfully"
+          f"{f', {up_to_date} up to date' if up_to_date else ''}.")
     if failed:
         print(f"\nFailed ({len(failed)}):")
         for name in failed:
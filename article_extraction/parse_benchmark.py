@@ -0,0 +1,125 @@
+'''
+Benchmark comparing the BeautifulSoup parses per article made by the old
+extraction flow with those made through a shared ArticleContext.
+
+The old flow parsed every file with html.parser in to_json.article_extractor,
+re-parsed Wiley XML and Elsevier files as XML inside the publisher functions,
+then built another tree in _augment_json for captions, tables and figure URLs.
+LimeSoup's own parse (RSC, Elsevier) happens in both flows and is not counted.
+
+The shared context parses HTML with the backend given by --parser.
+
+Usage:
+    python parse_benchmark.py --data_dir /path/to/articles [--parser lxml] [--skip_extras] [--limit N]
+'''
+
+import os
+import sys
+import time
+import argparse
+import warnings
+from collections import defaultdict
+
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+
+from article_context import ArticleContext, list_articles, HTML_PARSERS, DEFAULT_HTML_PARSER
+
+
+def legacy_parsers(ctx, skip_extras=False):
+    """Return the parser names the old flow used for this article, in order."""
+    parsers = ['html.parser']                       # to_json.article_extractor
+    if ctx.publisher == "Wiley" and ctx.content.startswith('<component xmlns'):
+        parsers.append('xml')                       # Wiley_to_json re-parse
+    if ctx.publisher == "Elsevier":
+        parsers.append('xml')                       # Elsevier_to_json rawtext check
+    if not skip_extras:
+        parsers.append(ctx.parser)                  # _augment_json/_get_soup
+    return parsers
+
+
+def needs_tree(ctx, skip_extras=False):
+    """Return True if the shared-context flow touches ctx.soup for this article."""
+    return not skip_extras or ctx.publisher != "RSC"
+
+
+def time_parses(content, parsers):
+    """Parse content once per entry in parsers and return the elapsed seconds."""
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        # the old flow parsed XML files with html.parser too
+        warnings.simplefilter('ignore', XMLParsedAsHTMLWarning)
+        for parser in parsers:
+            BeautifulSoup(content, parser)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count and time BeautifulSoup parses per article, old flow vs shared context'
+    )
+    parser.add_argument(
+        '--data_dir', required=True,
+        help='Directory containing the article .txt files'
+    )
+    parser.add_argument(
+        '--skip_extras', action='store_true',
+        help='Benchmark the flow without captions, tables, and figure URL extraction'
+    )
+    parser.add_argument(
+        '--limit', type=int, default=None,
+        help='Only benchmark the first N matching files'
+    )
+    parser.add_argument(
+        '--parser', choices=HTML_PARSERS, default=DEFAULT_HTML_PARSER,
+        help=f'BeautifulSoup backend for HTML articles in the shared context (default: {DEFAULT_HTML_PARSER})'
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data_dir):
+        print(f"Error: Data directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+
+    matching_files = list_articles(args.data_dir)
+    if args.limit is not None:
+        matching_files = matching_files[:args.limit]
+    if not matching_files:
+        print("No matching files found. Please check the directory.")
+        return
+
+    # publisher -> [articles, legacy parses, context parses, legacy s, context s]
+    stats = defaultdict(lambda: [0, 0, 0, 0.0, 0.0])
+    for filename in matching_files:
+        ctx = ArticleContext(filename, args.data_dir, args.parser)
+        old = legacy_parsers(ctx, args.skip_extras)
+        old_time = time_parses(ctx.content, old)
+        start = time.perf_counter()
+        if needs_tree(ctx, args.skip_extras):
+            ctx.soup
+        new_time = time.perf_counter() - start
+        parses = ctx.parse_count
+
+        row = stats[ctx.publisher or "Unknown"]
+        row[0] += 1
+        row[1] += len(old)
+        row[2] += parses
+        row[3] += old_time
+        row[4] += new_time
+
+    print(f"{'Publisher':<10} {'Articles':>8} {'Old/art':>8} {'New/art':>8} "
+          f"{'Saved/art':>9} {'Old s':>9} {'New s':>9}")
+    print("-" * 67)
+    totals = [0, 0, 0, 0.0, 0.0]
+    for publisher in sorted(stats):
+        row = stats[publisher]
+        totals = [t + r for t, r in zip(totals, row)]
+        n = row[0]
+        print(f"{publisher:<10} {n:>8} {row[1] / n:>8.2f} {row[2] / n:>8.2f} "
+              f"{(row[1] - row[2]) / n:>9.2f} {row[3]:>9.2f} {row[4]:>9.2f}")
+    print("-" * 67)
+    n = totals[0]
+    print(f"{'Total':<10} {n:>8} {totals[1] / n:>8.2f} {totals[2] / n:>8.2f} "
+          f"{(totals[1] - totals[2]) / n:>9.2f} {totals[3]:>9.2f} {totals[4]:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
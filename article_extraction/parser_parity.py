@@ -0,0 +1,118 @@
+'''
+Parity check between two BeautifulSoup backends for HTML articles.
+
+Every article is extracted twice, once with each parser, and the sections,
+captions, tables and figure URLs of the two records are compared. Use it on a
+sample of articles from every publisher before switching article_to_json to a
+faster backend with --parser. Exits with status 1 if any article differs.
+
+Table extraction for Nature and Springer fetches table pages over the network;
+use --skip_extras to compare sections only when working offline.
+
+Usage:
+    python parser_parity.py --data_dir /path/to/articles [--parser lxml] [--skip_extras] [--limit N]
+'''
+
+import io
+import os
+import sys
+import argparse
+import contextlib
+from collections import defaultdict
+
+import to_json
+from article_context import ArticleContext, get_publisher, list_articles, HTML_PARSERS, DEFAULT_HTML_PARSER
+from article_to_json import _extract_extras
+
+COMPARED_FIELDS = ("Title", "Keywords", "Sections", "Figure_captions",
+                   "Table_captions", "Tables", "Figure_urls", "Figure_labels")
+
+
+def extract_record(filename, data_dir, html_parser, skip_extras=False):
+    """Extract one article with the given HTML parser, returning the record or None."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        ctx = ArticleContext(filename, data_dir, html_parser)
+        extras = None if skip_extras else _extract_extras(ctx)
+        try:
+            data = to_json.article_extractor(ctx)
+        except Exception:
+            data = None
+    if data is not None and extras is not None:
+        data.update(extras)
+    return data
+
+
+def differing_fields(baseline, candidate):
+    """Return the names of the compared fields whose values differ between two records."""
+    if baseline is None or candidate is None:
+        return [] if baseline is candidate else ["record"]
+    return [field for field in COMPARED_FIELDS if baseline.get(field) != candidate.get(field)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that two HTML parser backends give identical extraction output'
+    )
+    parser.add_argument(
+        '--data_dir', required=True,
+        help='Directory containing the article .txt files'
+    )
+    parser.add_argument(
+        '--baseline', choices=HTML_PARSERS, default=DEFAULT_HTML_PARSER,
+        help=f'Reference HTML parser (default: {DEFAULT_HTML_PARSER})'
+    )
+    parser.add_argument(
+        '--parser', choices=HTML_PARSERS, default='lxml',
+        help='HTML parser to check against the baseline (default: lxml)'
+    )
+    parser.add_argument(
+        '--skip_extras', action='store_true',
+        help='Compare sections only, without captions, tables, and figure URLs'
+    )
+    parser.add_argument(
+        '--limit', type=int, default=None,
+        help='Only check the first N matching files'
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data_dir):
+        print(f"Error: Data directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+
+    matching_files = list_articles(args.data_dir)
+    if args.limit is not None:
+        matching_files = matching_files[:args.limit]
+    if not matching_files:
+        print("No matching files found. Please check the directory.")
+        return
+
+    # publisher -> [articles, identical]
+    stats = defaultdict(lambda: [0, 0])
+    mismatches = []
+    for filename in matching_files:
+        baseline = extract_record(filename, args.data_dir, args.baseline, args.skip_extras)
+        candidate = extract_record(filename, args.data_dir, args.parser, args.skip_extras)
+        fields = differing_fields(baseline, candidate)
+        row = stats[get_publisher(filename) or "Unknown"]
+        row[0] += 1
+        if fields:
+            mismatches.append((filename, fields))
+        else:
+            row[1] += 1
+
+    print(f"{args.baseline} vs {args.parser}")
+    print(f"{'Publisher':<10} {'Articles':>8} {'Identical':>9}")
+    print("-" * 29)
+    for publisher in sorted(stats):
+        n, identical = stats[publisher]
+        print(f"{publisher:<10} {n:>8} {identical:>9}")
+    if mismatches:
+        print(f"\n{len(mismatches)} articles differ:")
+        for filename, fields in mismatches:
+            print(f"  {filename}: {', '.join(fields)}")
+        sys.exit(1)
+    print("\nAll articles identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+'''
+Regression benchmark for the Frontiers section walker.
+
+Builds a large synthetic review-style Frontiers article (many h2 sections, each
+with many h3 subheadings and paragraphs) and times the section extraction with
+the current single-pass walker against the previous one, which passed a copy of
+the rest of the article's element list to every heading. Both must produce the
+same Sections structure. The article mixes the layouts the walker handles: h2
+sections holding paragraphs, h2 sections holding h3 subsections, and paragraphs
+between an h2 and its first subheading.
+
+The Springer/Nature walker is left as it was: its copies only reach the end of
+one section, and a single-pass version measured no faster on this benchmark.
+
+Usage:
+    python section_benchmark.py [--sections 10] [--subheadings 40] [--paragraphs 20] [--repeat 3]
+'''
+
+import gc
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+import extractor_tools as tools
+import section_extractor
+
+
+# The walker as it was before the single-pass rewrite, which passed a copy of the
+# rest of the element list to every heading
+
+def legacy_list_to_content_frontiers(list):
+    '''
+    Function to extract paragraphs in between h3 and h2 headings (specific to Frontiers)
+    '''
+    data = []
+    for element in list:
+        if element.name == 'p':
+            data.append(element.text)
+        elif element.name == 'h3' or element.name == 'h2':
+            return data
+    return data
+
+def legacy_subheadings_content_frontiers(list):
+    '''
+    Function to extract h3 subheadings and paragraphs in between h2 hesadings (specific to Frontiers)
+    '''
+    data = []
+    for i in range(len(list)):
+        if list[i].name == 'h3':
+            data_sub = {}
+            data_sub['name'] = list[i].text
+            data_sub['type'] = 'h3'
+            data_sub['content'] = legacy_list_to_content_frontiers(list[i+1:])
+            data.append(data_sub)
+        elif list[i].name == 'h2':
+            return data
+    return data
+
+def legacy_sections_frontiers(soup, list_remove):
+    '''
+    Function to extract sections from Frontiers html journals
+    '''
+    # TODO: Update Frontiers HTML parsing as new webpage format has been implemented
+    # New webpage contains all sections in div class=ArticleContent whit div id="h1" containing abstract
+    main_content = soup.find('div', class_='JournalFullText')
+    main_content = main_content.find('div', class_='JournalFullText')  # old format had two nested divs with class JournalFullText
+    main_content = tools.remove_tags_soup(main_content, list_remove)
+    elements = main_content.find_all(['p','h2','h3'])
+    data_dict = []
+    for i in range(len(elements)):
+        if elements[i].name == 'h2':
+            data = {}
+            data['name'] = elements[i].text
+            data['type'] = 'h2'
+            data['content'] = []
+            if elements[i].next_sibling is not None:
+                if elements[i].next_sibling.name == 'p':
+                    data['content'] = legacy_list_to_content_frontiers(elements[i+1:])
+            if elements[i].next_sibling is not None:
+                if elements[i].next_sibling.name == 'h3':
+                    data['content']= legacy_subheadings_content_frontiers(elements[i+1:])
+            data_dict.append(data)
+    return data_dict
+
+
+def frontiers_article(n_sections, n_subheadings, n_paragraphs):
+    '''Return the HTML of a Frontiers article of n_sections h2 sections, most with h3 subheadings'''
+    parts = []
+    for s in range(n_sections):
+        section = [f'<h2>Section {s}</h2>']
+        # every other section starts with paragraphs, every fourth has no subheadings
+        if s % 2 or s % 4 == 0:
+            section.extend(f'<p>Intro {s}.{p} <figure>fig</figure>text</p>' for p in range(n_paragraphs))
+        for h in range(n_subheadings if s % 4 else 0):
+            section.append(f'<h3>Subheading {s}.{h}</h3>')
+            section.extend(f'<p>Paragraph {s}.{h}.{p} <figure>fig</figure>text</p>'
+                           for p in range(n_paragraphs))
+        parts.append(''.join(section))
+    return ('<html><body><div class="JournalFullText"><div class="JournalFullText">'
+            f'{"".join(parts)}</div></div></body></html>')
+
+
+def time_walker(walker, html, rules, repeat):
+    '''Return (best seconds, sections) of walker over freshly parsed copies of html'''
+    best = None
+    sections = None
+    for _ in range(repeat):
+        soup = BeautifulSoup(html, 'html.parser')
+        list_remove = tools.compile_rules(rules)
+        # free the previous trees first and pause the collector, as timeit does, so
+        # collections of the large parsed trees do not land in one walker's time
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            sections = walker(soup, list_remove)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sections
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the Frontiers section walker on a large synthetic article'
+    )
+    parser.add_argument('--sections', type=int, default=10, help='h2 sections per article (default: 10)')
+    parser.add_argument('--subheadings', type=int, default=40, help='h3 subheadings per section (default: 40)')
+    parser.add_argument('--paragraphs', type=int, default=20, help='paragraphs per subheading (default: 20)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per walker, best is reported (default: 3)')
+    args = parser.parse_args()
+
+    html = frontiers_article(args.sections, args.subheadings, args.paragraphs)
+    rules = [{'name': 'figure'}]
+    old_time, old_sections = time_walker(legacy_sections_frontiers, html, rules, args.repeat)
+    new_time, new_sections = time_walker(section_extractor.sections_frontiers, html, rules, args.repeat)
+
+    print(f"{args.sections} sections x {args.subheadings} subheadings x {args.paragraphs} paragraphs")
+    print(f"Previous walker: {old_time:.3f} s")
+    print(f"Current walker:  {new_time:.3f} s ({old_time / new_time:.1f}x)")
+    print(f"Same sections:   {'yes' if old_sections == new_sections else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -17,34 +17,6 @@ def list_to_content_springer(list, list_remove):
             return data
     return data
     
-def list_to_content_frontiers(list):
-    '''
-    Function to extract paragraphs in between h3 and h2 headings (specific to Frontiers)
-    '''
-    data = []
-    for element in list:
-        if element.name == 'p':
-            data.append(element.text)
-        elif element.name == 'h3' or element.name == 'h2':
-            return data
-    return data
-    
-def subheadings_content_frontiers(list):
-    '''
-    Function to extract h3 subheadings and paragraphs in between h2 hesadings (specific to Frontiers)
-    '''
-    data = []
-    for i in range(len(list)):
-        if list[i].name == 'h3':
-            data_sub = {}
-            data_sub['name'] = list[i].text
-            data_sub['type'] = 'h3'
-            data_sub['content'] = list_to_content_frontiers(list[i+1:])
-            data.append(data_sub)
-        elif list[i].name == 'h2':
-            return data
-    return data
-    
 def sections_acs_letters(soup, list_remove):
     '''Extract sections from ACS Letters articles'''
     main_content = soup.find('div', class_= 'article_content')
@@ -257,21 +229,31 @@ def sections_frontiers(soup, list_remove):
     main_content = soup.find('div', class_='JournalFullText')
     main_content = main_content.find('div', class_='JournalFullText')  # old format had two nested divs with class JournalFullText
     main_content = tools.remove_tags_soup(main_content, list_remove)
-    elements = main_content.find_all(['p','h2','h3'])
+    # one pass over the headings and paragraphs of the whole article, appending each
+    # to the section or subsection that is open, so it is walked in linear time
     data_dict = []
-    for i in range(len(elements)):
-        if elements[i].name == 'h2':
-            data = {}
-            data['name'] = elements[i].text
-            data['type'] = 'h2'
-            data['content'] = []
-            if elements[i].next_sibling is not None:
-                if elements[i].next_sibling.name == 'p':
-                    data['content'] = list_to_content_frontiers(elements[i+1:])
-            if elements[i].next_sibling is not None:
-                if elements[i].next_sibling.name == 'h3':
-                    data['content']= subheadings_content_frontiers(elements[i+1:])
+    data = None
+    # what an h2 heading holds is decided by the element right after it: paragraphs up
+    # to the next heading, or h3 subsections up to the next h2, or nothing
+    layout = None
+    data_sub = None
+    for element in tools.iter_tags(main_content, ['p','h2','h3']):
+        if element.name == 'h2':
+            data = {'name': element.text, 'type': 'h2', 'content': []}
             data_dict.append(data)
+            following = element.next_sibling
+            layout = following.name if following is not None else None
+            data_sub = None
+        elif element.name == 'h3':
+            if layout == 'h3':
+                data_sub = {'name': element.text, 'type': 'h3', 'content': []}
+                data['content'].append(data_sub)
+            elif layout == 'p':
+                layout = None                                           #paragraphs end at the first subheading
+        elif layout == 'p':
+            data['content'].append(element.text)
+        elif layout == 'h3' and data_sub is not None:
+            data_sub['content'].append(element.text)
     return data_dict
 
 def sections_tandf(soup, list_remove):
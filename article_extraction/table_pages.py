@@ -0,0 +1,237 @@
+'''
+Concurrent fetcher and persistent cache for the table sub-pages of Nature and
+Springer articles.
+
+Nature and Springer articles link each table to a page of its own, which
+tables_extractor.nature_table and springer_table need to read. Pages are cached
+by URL in table_pages.sqlite in the JSON directory, so an article's tables are
+never fetched twice across runs and re-extraction only reads the cache.
+
+article_to_json fetches the table pages of every Nature and Springer article
+concurrently, under a requests-per-second budget, before extraction starts: the
+links are found in the raw article text without parsing it. The table extractors
+then read the pages from the cache; any page still missing is fetched there,
+concurrently with the other tables of the same article.
+
+Usage:
+    python table_pages.py --data_dir /path/to/articles --save_dir /path/to/json_output [--rate 10]
+'''
+
+import os
+import re
+import html
+import zlib
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+
+from article_context import get_publisher, list_articles, read_article
+
+TABLE_CACHE_NAME = 'table_pages.sqlite'   # table page cache, kept in the JSON directory
+DEFAULT_RATE = 10.0                       # table page requests per second
+DEFAULT_WORKERS = 8
+
+# Base URL the relative table links of each publisher are resolved against
+TABLE_LINK_BASE = {
+    "Nature":   'https://www.nature.com',
+    "Springer": 'https://link.springer.com/',
+}
+
+_TABLE_LINK_TAG = re.compile(r'<a\s[^>]*\bdata-test=["\']table-link["\'][^>]*>', re.IGNORECASE)
+_HREF = re.compile(r'\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+
+# Cache of this process, opened by use_cache (and again in a forked child)
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+class TablePageCache:
+    """
+    Persistent SQLite map from table page URL to the page HTML, stored compressed.
+    Safe to share between threads; worker processes each open their own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # other extraction processes may be writing to the same file
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, html BLOB NOT NULL)'
+        )
+        self.conn.commit()
+
+    def get(self, url):
+        """Return the cached page of url, or None if it has not been fetched."""
+        with self.lock:
+            row = self.conn.execute('SELECT html FROM pages WHERE url = ?', (url,)).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8') if row is not None else None
+
+    def cached(self, urls):
+        """Return the subset of urls that are in the cache."""
+        urls = list(urls)
+        found = set()
+        with self.lock:
+            for i in range(0, len(urls), 500):
+                batch = urls[i:i + 500]
+                rows = self.conn.execute(
+                    f'SELECT url FROM pages WHERE url IN ({",".join("?" * len(batch))})', batch
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def set(self, url, page):
+        data = zlib.compress(page.encode('utf-8'))
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO pages (url, html) VALUES (?, ?)', (url, data))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def use_cache(path):
+    """
+    Make the cache at path the one the table extractors of this process read from
+    and write to. Cheap to call again with the same path.
+    """
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache is not None and _cache.path == path and _cache_pid == os.getpid():
+            return _cache
+        _cache = TablePageCache(path)
+        _cache_pid = os.getpid()
+        return _cache
+
+
+def table_links_in_text(content, publisher):
+    """
+    Return the absolute URLs of the table pages linked from an article's raw HTML,
+    found without parsing it.
+    """
+    base = TABLE_LINK_BASE[publisher]
+    urls = []
+    for tag in _TABLE_LINK_TAG.finditer(content):
+        match = _HREF.search(tag.group(0))
+        if match:
+            urls.append(urljoin(base, html.unescape(match.group(1) or match.group(2) or '')))
+    return urls
+
+
+def _fetch(url):
+    r = http_client.get(url)
+    if r.status_code != 200:
+        raise ValueError(f"Failed to retrieve table page {url}: {r.status_code}")
+    return r.text
+
+
+def fetch_table_pages(urls, cache=None, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS):
+    """
+    Fetch the pages of urls that are not cached, concurrently and at most `rate`
+    requests per second, and add them to the cache. Returns a dict of URL -> page
+    HTML for the fetched pages, and a dict of URL -> error for the pages that could
+    not be fetched (they are not cached, so they are retried on the next run).
+    """
+    urls = list(dict.fromkeys(urls))
+    if cache is not None:
+        have = cache.cached(urls)
+        urls = [url for url in urls if url not in have]
+    pages = {}
+    errors = {}
+    if not urls:
+        return pages, errors
+
+    bucket = http_client.TokenBucket(rate)
+
+    def fetch(url):
+        bucket.acquire()
+        try:
+            page = _fetch(url)
+        except Exception as e:
+            return url, None, e
+        if cache is not None:
+            cache.set(url, page)
+        return url, page, None
+
+    if len(urls) == 1:
+        results = [fetch(urls[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as pool:
+            results = list(pool.map(fetch, urls))
+    for url, page, error in results:
+        if error is None:
+            pages[url] = page
+        else:
+            errors[url] = error
+    return pages, errors
+
+
+def get_table_pages(urls):
+    """
+    Return the pages of urls (URL -> HTML) for the table extractors, from the
+    process cache where possible; missing pages are fetched concurrently. A page
+    that could not be fetched is None, so the article keeps its other tables.
+    """
+    cache = _cache if _cache_pid == os.getpid() else None
+    pages = {}
+    if cache is not None:
+        for url in dict.fromkeys(urls):
+            page = cache.get(url)
+            if page is not None:
+                pages[url] = page
+    fetched, errors = fetch_table_pages([url for url in urls if url not in pages], cache)
+    pages.update(fetched)
+    for url, error in errors.items():
+        print(f"  Warning: table page could not be fetched: {error}")
+        pages[url] = None
+    return pages
+
+
+def prefetch_table_pages(filenames, data_dir, cache, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS):
+    """
+    Fetch the table pages of the Nature and Springer articles among filenames into
+    the cache before extraction. Returns (number of linked pages, number fetched,
+    errors by URL).
+    """
+    urls = []
+    for filename in filenames:
+        publisher = get_publisher(filename)
+        if publisher in TABLE_LINK_BASE:
+            urls.extend(table_links_in_text(read_article(filename, data_dir), publisher))
+    urls = list(dict.fromkeys(urls))
+    pages, errors = fetch_table_pages(urls, cache, rate=rate, workers=workers)
+    return len(urls), len(pages), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fetch the table pages of Nature and Springer articles into the table page cache'
+    )
+    parser.add_argument('--data_dir', required=True, help='Directory containing the article files')
+    parser.add_argument('--save_dir', required=True,
+                        help=f'JSON output directory, where {TABLE_CACHE_NAME} is kept')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help=f'Maximum table page requests per second (default: {DEFAULT_RATE:g})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Concurrent requests (default: {DEFAULT_WORKERS})')
+    args = parser.parse_args()
+
+    os.makedirs(args.save_dir, exist_ok=True)
+    cache = TablePageCache(os.path.join(args.save_dir, TABLE_CACHE_NAME))
+    linked, fetched, errors = prefetch_table_pages(
+        list_articles(args.data_dir), args.data_dir, cache, rate=args.rate, workers=args.workers,
+    )
+    cache.close()
+    print(f"Table pages: {linked} linked, {fetched} fetched, {linked - fetched - len(errors)} already cached")
+    for url, error in errors.items():
+        print(f"  FAILED: {url} - {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,35 @@
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
 import json
 import re
 import captions_extractor
+import table_pages
 
-def nature_table(soup)->list[dict]:
-    tables = soup.find_all('a', attrs={'data-test': 'table-link'})
+def _html_parser_of(soup):
+    # parse table sub-pages with the same backend as the article itself
+    builder = getattr(soup, 'builder', None)
+    return 'lxml' if builder is not None and builder.NAME == 'lxml' else 'html.parser'
+
+def _linked_tables(soup, base)->list[dict]:
+    # Nature and Springer tables are on pages of their own, read through the table page cache
+    parser = _html_parser_of(soup)
+    links = [(table['aria-label'], urljoin(base, table['href']))
+             for table in soup.find_all('a', attrs={'data-test': 'table-link'})]
+    pages = table_pages.get_table_pages([url for _, url in links])
     table_dicts = []
-    for table in tables:
-        table_dict = {}
-        label = table['aria-label']
-        table_dict['label'] = label
-        table_link = table['href']
-        table_link = urljoin('https://www.nature.com', table_link)
-        html = requests.get(table_link).text
-        soup = BeautifulSoup(html, "html.parser")
-        table = soup.find('table')
-        text = str(table)
-        table_dict['content'] = text
-        table_dicts.append(table_dict)
+    for label, url in links:
+        if pages[url] is None:
+            continue   # page could not be fetched; the other tables are kept
+        # only the table of the page is needed, so nothing else is built into the tree
+        page = BeautifulSoup(pages[url], parser, parse_only=SoupStrainer('table'))
+        table_dicts.append({'label': label, 'content': str(page.find('table'))})
     return table_dicts
 
+def nature_table(soup)->list[dict]:
+    return _linked_tables(soup, table_pages.TABLE_LINK_BASE['Nature'])
+
 def springer_table(soup)->list[dict]:
-    tables = soup.find_all('a', attrs={'data-test': 'table-link'})
-    table_dicts = []
-    for table in tables:
-        table_dict = {}
-        label = table['aria-label']
-        table_dict['label'] = label
-        table_link = table['href']
-        table_link = urljoin('https://link.springer.com/', table_link)
-        html = requests.get(table_link).text
-        soup = BeautifulSoup(html, "html.parser")
-        table = soup.find('table')
-        text = str(table)
-        table_dict['content'] = text
-        table_dicts.append(table_dict)
-    return table_dicts
+    return _linked_tables(soup, table_pages.TABLE_LINK_BASE['Springer'])
 
 def rsc_table(soup):
     tables = soup.find_all('table', class_='tgroup')
@@ -103,10 +95,11 @@ def tandf_table(soup):
     script = soup.find("script", string=lambda s: s and "tandf.tfviewerdata" in s)
     data = json.loads(re.search(r"tandf\.tfviewerdata\s*=\s*({.*});", script.string, re.S).group(1))
     tables = data["tables"]
+    parser = _html_parser_of(soup)
     table_dicts = []
     for table in tables:
         table_dict = {}
-        tbl_soup = BeautifulSoup(table["content"], "html.parser")
+        tbl_soup = BeautifulSoup(table["content"], parser)
         table_element = tbl_soup.find("table")
         table_dict['content'] = str(table_element)
         caption = tbl_soup.find("caption")
@@ -1,208 +1,216 @@
 '''
-Functions to extract paragraphs from html and xml files and save as json files
+Functions to extract paragraphs from html and xml files into json records
 for diffrerent publishers (RSC, Elsevier, ACS, Wiley, Springer, Nature, Frontiers, Taylor and Francis, MDPI)
 '''
 
 import extractor_tools as tools
 import section_extractor
+from article_context import PUB_PREFIX
 from LimeSoup import (ElsevierSoup, RSCSoup)
-import json
-from bs4 import BeautifulSoup
 import logging
-import os
 
-def ACS_to_json(soup, doi, save_dir):
+# Extraction output version per publisher, recorded in the extraction manifest.
+# Bump a publisher's version whenever a change to its section, caption, table or
+# figure URL extraction alters the JSON, so article_to_json --incremental
+# re-extracts only that publisher's articles.
+EXTRACTOR_VERSION = {
+    "RSC":      1,
+    "ACS":      1,
+    "Nature":   1,
+    "Science":  1,
+    "Frontiers":1,
+    "MDPI":     1,
+    "Wiley":    1,
+    "Springer": 1,
+    "TandF":    1,
+    "Elsevier": 1,
+}
+
+def ACS_to_json(soup, doi):
     '''
-    Function specific to ACS html journals to extract paragraphs and save as json file
+    Function specific to ACS html journals to extract paragraphs and return the json record
     '''
-    list_remove = [      
+    list_remove = tools.compile_rules([
         {'name':'a'}, #remove links
         {'name':'span'}, #remove inline equations
-    ]
+    ])
     title = soup.find('span', class_='hlFld-Title').text
     sections = section_extractor.sections_acs(soup, list_remove)
-    tools.create_json_data(doi,sections,title,save_dir)
+    return tools.create_json_data(doi, sections, title)
 
-def Wiley_to_json(soup, doi, save_dir):
+def Wiley_to_json(soup, doi):
     '''
-    Function to extract paragraphs from Wiley xml journals and save as json file
+    Function to extract paragraphs from Wiley xml journals and return the json record
     doi is the txt file name
     '''
-    list_remove = [{'name': ['link', 'tabular', 'figure']}] #removes links and tables
+    list_remove = tools.compile_rules([{'name': ['link', 'tabular', 'figure']}]) #removes links and tables
     titles = soup.header.find_all('titleGroup')
     title = titles[-1].find('title').text
     keywords = soup.header.find_all('keywordGroup')
     keywords = [keyword.text for keyword in keywords[0].find_all('keyword')]
     sections = section_extractor.sections_wiley(soup, list_remove)
-    tools.create_json_data(doi, sections, title, save_dir, keywords=keywords)
+    return tools.create_json_data(doi, sections, title, keywords=keywords)
 
-def Wiley_html_to_json(soup, doi, save_dir):
+def Wiley_html_to_json(soup, doi):
     '''
-    Function to extract paragraphs from Wiley html journals and save as json file
+    Function to extract paragraphs from Wiley html journals and return the json record
     doi is the txt file name
     '''
-    list_remove = [{'name': 'section', 'class': 'article-section__inline-figure'},
+    list_remove = tools.compile_rules([{'name': 'section', 'class': 'article-section__inline-figure'},
                {'name': 'div', 'class': 'article-table-content'},
                {'name': 'div', 'class': 'inline-equation'},
-               {'name': 'span'}, {'name': 'a'}]        #removes links, tables, figures, inline equations
+               {'name': 'span'}, {'name': 'a'}])        #removes links, tables, figures, inline equations
     title = soup.find('h1').text
     sections = section_extractor.sections_wiley_html(soup, list_remove)
-    tools.create_json_data(doi, sections, title, save_dir)
+    return tools.create_json_data(doi, sections, title)
 
-def Springer_Nature_to_json(soup, doi, save_dir):
+def Springer_Nature_to_json(soup, doi):
     '''
-    Function to extract paragraphs from Springer or Nature html journals and save as json file
+    Function to extract paragraphs from Springer or Nature html journals and return the json record
     '''
-    list_remove = [{'name':'figure'}] #removes figures
+    list_remove = tools.compile_rules([{'name':'figure'}]) #removes figures
     sections = section_extractor.sections_springer_nature(soup, list_remove)
     title = soup.find('h1', class_ = 'c-article-title').text
-    tools.create_json_data(doi, sections, title, save_dir)
+    return tools.create_json_data(doi, sections, title)
 
-def Frontiers_to_json(soup, doi, save_dir):
+def Frontiers_to_json(soup, doi):
     '''
-    Function to extract paragraphs from Frontiers html journals and save as json file
+    Function to extract paragraphs from Frontiers html journals and return the json record
     '''
-    list_remove = [{'name':'div'}] #removes figures
+    list_remove = tools.compile_rules([{'name':'div'}]) #removes figures
     title = soup.find('h1').text
     sections = section_extractor.sections_frontiers(soup, list_remove)
-    tools.create_json_data(doi, sections, title, save_dir)
+    return tools.create_json_data(doi, sections, title)
 
-def TandF_to_json(soup, doi, save_dir):
+def TandF_to_json(soup, doi):
     '''
-    Function to extract paragraphs from Taylor and Francis html journals and save as json file
+    Function to extract paragraphs from Taylor and Francis html journals and return the json record
     '''
-    list_remove = [{'name': 'div', 'class':'figure figureViewer'},
+    list_remove = tools.compile_rules([{'name': 'div', 'class':'figure figureViewer'},
                 {'name': 'div', 'class':'tableView'},
                 {'name': 'div', 'class':'hidden rs_skip'},
             {'name':'span'}
-            ]
+            ])
     sections = section_extractor.sections_tandf(soup, list_remove)
     title = soup.find('span', class_ = 'NLM_article-title hlFld-title').text
-    tools.create_json_data(doi, sections, title, save_dir)
+    return tools.create_json_data(doi, sections, title)
     
-def MDPI_to_json(soup, doi, save_dir):
+def MDPI_to_json(soup, doi):
     '''
-    Function to extract paragraphs from MDPI html journals and save as json file
+    Function to extract paragraphs from MDPI html journals and return the json record
     '''
-    list_remove = [{'name': 'div'}]
+    list_remove = tools.compile_rules([{'name': 'div'}])
     if soup.find('div', id='article-contents') is not None:
         sections = section_extractor.sections_mdpi(soup, list_remove)
     elif soup.find('div', class_='html-body') is not None:
         sections = section_extractor.sections_mdpi_legacy(soup, list_remove)
     title = soup.find('h1').text
-    tools.create_json_data(doi, sections, title, save_dir)
+    return tools.create_json_data(doi, sections, title)
     
-def RSC_to_json(path, doi, save_dir):
+def RSC_to_json(ctx):
     '''
-    Function to extract paragraphs from RSC html journals using LimeSoup parser and save as json file
+    Function to extract paragraphs from RSC html journals using LimeSoup parser and return the json record
     '''
-    with open(os.path.join(path,doi), 'r', encoding='utf-8') as f:
-        html_str = f.read()
-    data = RSCSoup.parse(html_str)
-    with open(os.path.join(save_dir,doi.replace('.txt', '.json')), 'w', encoding='utf-8') as f:
-        json.dump(data, f, sort_keys=True, indent=4, ensure_ascii=False)
+    return RSCSoup.parse(ctx.content)
 
-def Elsevier_to_json(path, doi, save_dir):
+def Elsevier_to_json(ctx):
     '''
-    Function to extract paragraphs from Elsevier xml journals using LimeSoup parser and save as json file
+    Function to extract paragraphs from Elsevier xml journals using LimeSoup parser and return the json record
+    Returns None for raw text only articles
     '''
-    with open(os.path.join(path,doi), 'r', encoding='utf-8') as f:
-        xml_str = f.read()
-    doc = BeautifulSoup(xml_str, 'xml')
-    if len(doc.find_all('rawtext')) == 0:
-        data = ElsevierSoup.parse(xml_str)
-        with open(os.path.join(save_dir,doi.replace('.txt', '.json')), 'w', encoding='utf-8') as f:
-            json.dump(data, f, sort_keys=True, indent=4, ensure_ascii=False)
+    if len(ctx.soup.find_all('rawtext')) == 0:
+        return ElsevierSoup.parse(ctx.content)
+    return None
 
 
-def article_extractor(doi, path, save_dir):
+def article_extractor(ctx):
     '''
-    Function to extract paragraphs from given html/xml file and save as json file based on publisher
+    Function to extract paragraphs from a parsed article (ArticleContext) based on publisher
+    Returns the json record, or None if extraction failed
     '''
-    pub_prefix = {"RSC": "10.1039", "ACS": "10.1021", "Nature":"10.1038", "Science":"10.1126", "Frontiers":"10.3389", "MDPI":"10.3390", "Wiley": "10.1002", "Springer":"10.1007", "TandF":"10.1080", "Elsevier":"10.1016"}
+    doi = ctx.filename
     prefix = doi[:7]
+    html_xml_str = ctx.content
 
-    with open(os.path.join(path,doi), 'r', encoding='utf-8') as f:
-        html_xml_str = f.read()
-    soup = BeautifulSoup(html_xml_str, 'html.parser')
-    
-    if prefix == pub_prefix['ACS']:
+    if prefix == PUB_PREFIX['ACS']:
         try:
-            ACS_to_json(soup, doi, save_dir)
+            data = ACS_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['Wiley']:
+    elif prefix == PUB_PREFIX['Wiley']:
         if html_xml_str.startswith('<html'):
             try:
-                Wiley_html_to_json(soup, doi, save_dir)
+                data = Wiley_html_to_json(ctx.soup, doi)
             except(AttributeError, IndexError):
                 print('Error with file: ', doi)
-                return False
+                return None
                  
         elif html_xml_str.startswith('<component xmlns'):
             try:
-                soup = BeautifulSoup(html_xml_str, 'xml')
-                Wiley_to_json(soup, doi, save_dir)
+                data = Wiley_to_json(ctx.soup, doi)
             except(AttributeError, IndexError):
                 print('Error with file: ', doi)
-                return False
+                return None
         else:
             print('Wiley file format not recognised for file: ', doi)
-            return False
+            return None
                 
-    elif prefix == pub_prefix['Springer']:
+    elif prefix == PUB_PREFIX['Springer']:
         try:
-            Springer_Nature_to_json(soup, doi, save_dir)
+            data = Springer_Nature_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['Nature']:
+    elif prefix == PUB_PREFIX['Nature']:
         try:
-            Springer_Nature_to_json(soup, doi, save_dir)
+            data = Springer_Nature_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['Frontiers']:
+    elif prefix == PUB_PREFIX['Frontiers']:
         try:
-            Frontiers_to_json(soup, doi, save_dir)
+            data = Frontiers_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['TandF']:
+    elif prefix == PUB_PREFIX['TandF']:
         try:    
-            TandF_to_json(soup, doi, save_dir)
+            data = TandF_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['MDPI']:
+    elif prefix == PUB_PREFIX['MDPI']:
         try:
-            MDPI_to_json(soup, doi, save_dir)
+            data = MDPI_to_json(ctx.soup, doi)
         except(AttributeError, IndexError):
             print('Error with file: ', doi)
-            return False
+            return None
                 
-    elif prefix == pub_prefix['RSC']:
+    elif prefix == PUB_PREFIX['RSC']:
         try:
-            RSC_to_json(path, doi, save_dir)
+            data = RSC_to_json(ctx)
         except(AttributeError, StopIteration):
             print('Error with file: ', doi)
-            return False
+            return None
             
-    elif prefix == pub_prefix['Elsevier']:
+    elif prefix == PUB_PREFIX['Elsevier']:
         try:
-            Elsevier_to_json(path, doi, save_dir)
+            data = Elsevier_to_json(ctx)
         except(AttributeError):
             print('Error with file: ', doi)
-            return False
+            return None
+        if data is None:
+            print('Elsevier article only contains raw text: ', doi)
+            return None
             
     else:
         print('Journal not recognised')
-        return False
+        return None
 
-    return True
\ No newline at end of file
+    return data
\ No newline at end of file
@@ -7,7 +7,8 @@ Usage:
         --doi_file /path/to/acs_rsc_dois.txt \
         --save_dir /path/to/output \
         --chrome_path /path/to/chrome \
-        --chrome_data_dir /path/to/chrome/profile
+        --chrome_data_dir /path/to/chrome/profile \
+        [--archive [gzip|zstd]]
 '''
 
 import argparse
@@ -36,10 +37,15 @@ if __name__ == '__main__':
         '--chrome_data_dir', required=True,
         help='Path to Chrome user data directory'
     )
+    parser.add_argument(
+        '--archive', nargs='?', const='gzip', default=None, choices=('gzip', 'zstd'),
+        help='Store pages in a compressed article archive in save_dir instead of one .txt file '
+             'per DOI (gzip by default; zstd requires the zstandard package)'
+    )
     args = parser.parse_args()
 
     scraper_tools.utils.open_chrome(args.chrome_path, args.chrome_data_dir)
     while True:
         input("Login to RSC or ACS in the Chrome window and press Enter to continue.")
         break
-    scraper_tools.scraper.download_acs_rsc_from_doi(args.doi_file, args.save_dir)
+    scraper_tools.scraper.download_acs_rsc_from_doi(args.doi_file, args.save_dir, archive=args.archive)
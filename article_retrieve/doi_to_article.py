@@ -2,7 +2,8 @@
 Script to download full text articles from a list of DOIs.
 
 Usage:
-    python doi_to_article.py --doi_file /path/to/dois.txt --save_dir /path/to/output
+    python doi_to_article.py --doi_file /path/to/dois.txt --save_dir /path/to/output [--concurrent]
+                             [--browsers N] [--pages_per_browser N] [--archive [gzip|zstd]]
 
 Requires the ELSEVIER_API_KEY environment variable to be set before running:
     export ELSEVIER_API_KEY=your_key_here
@@ -27,6 +28,23 @@ if __name__ == '__main__':
         '--save_dir', required=True,
         help='Directory to save downloaded articles'
     )
+    parser.add_argument(
+        '--concurrent', action='store_true',
+        help='Download publishers in parallel, each under its own rate limit'
+    )
+    parser.add_argument(
+        '--browsers', type=int, default=1,
+        help='Number of headless Firefox instances kept open for Selenium downloads (default: 1)'
+    )
+    parser.add_argument(
+        '--pages_per_browser', type=int, default=100,
+        help='Restart each browser after this many pages (default: 100)'
+    )
+    parser.add_argument(
+        '--archive', nargs='?', const='gzip', default=None, choices=('gzip', 'zstd'),
+        help='Store pages in a compressed article archive in save_dir instead of one .txt file '
+             'per DOI (gzip by default; zstd requires the zstandard package)'
+    )
     args = parser.parse_args()
 
     elsevier_api_key = os.environ.get('ELSEVIER_API_KEY')
@@ -36,5 +54,6 @@ if __name__ == '__main__':
         sys.exit(1)
 
     scraper_tools.scraper.download_article_from_doi(
-        args.doi_file, args.save_dir, elsevier_api_key
+        args.doi_file, args.save_dir, elsevier_api_key, concurrent=args.concurrent,
+        browsers=args.browsers, pages_per_browser=args.pages_per_browser, archive=args.archive
     )
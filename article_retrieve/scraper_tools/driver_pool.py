@@ -0,0 +1,91 @@
+'''Pool of long-lived Selenium webdrivers leased out one download at a time'''
+
+import contextlib
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DriverPool:
+    '''
+    Keeps up to `size` webdrivers alive across downloads instead of starting a new
+    browser for every article. Drivers are created lazily by `factory`, recycled after
+    `max_pages` page loads or as soon as a download using them raises, and all closed
+    by shutdown(). Drivers are closed with `close` (default: driver.quit()), which
+    for a driver attached to a browser the pool does not own should leave the
+    browser running.
+
+    Usage:
+        with DriverPool(make_firefox_driver, size=2) as pool:
+            with pool.lease() as driver:
+                driver.get(link)
+    '''
+    def __init__(self, factory, size=1, max_pages=100, close=None):
+        self.factory = factory
+        self.close = close if close is not None else (lambda driver: driver.quit())
+        self.size = size
+        self.max_pages = max_pages
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._pages = {}
+
+    @contextlib.contextmanager
+    def lease(self):
+        '''
+        Context manager yielding a driver for exclusive use, blocking while all are leased
+        '''
+        self._slots.acquire()
+        driver = None
+        try:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self.factory()
+                with self._lock:
+                    self._pages[driver] = 0
+            yield driver
+        except Exception:
+            if driver is not None:
+                self._retire(driver)
+            raise
+        else:
+            with self._lock:
+                self._pages[driver] += 1
+                worn_out = self._pages[driver] >= self.max_pages
+            if worn_out:
+                self._retire(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    def _retire(self, driver):
+        with self._lock:
+            self._pages.pop(driver, None)
+        try:
+            self.close(driver)
+        except Exception as e:
+            logger.warning(f"Error closing webdriver: {e}")
+
+    def shutdown(self):
+        '''
+        Close every driver in the pool
+        '''
+        with self._lock:
+            drivers = list(self._pages)
+        for driver in drivers:
+            self._retire(driver)
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -1,8 +1,10 @@
 '''Functions for selecting the correct link for each publisher'''
 
-import requests
 import re
 import logging
+import requests
+
+import http_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,34 +19,54 @@ def validate_doi(doi):
     doi_pattern = r'^10.\d{4,9}/[-._;()/:\w]+$'
     return bool(re.match(doi_pattern, doi))
 
-def get_link_from_doi(doi):
+def get_link_from_doi(doi, cache=None):
     '''
     Takes in a doi and returns the link to the article:
     1. Validates DOI format
-    2. Makes API request to crossref.org
-    3. Extracts and returns unique article URLs
-    4. Handles errors and logs failures
+    2. Looks the DOI up in the LinkCache, if one is given
+    3. Makes API request to crossref.org
+    4. Extracts and returns unique article URLs
+    5. Handles errors and logs failures
+    Found links, 404s and responses without links are stored in the cache
     '''
     if not validate_doi(doi):
         logger.error(f"Invalid DOI format: {doi}")
         _log_failed_doi(doi, "Invalid DOI format")
         return None
-        
+
+    if cache is not None:
+        found, links = cache.get(doi)
+        if found:
+            if links is None:
+                logger.info(f"No Crossref links for DOI {doi} (cached)")
+            return links
+
     url = 'https://api.crossref.org/works/' + doi
     headers = {'accept': 'application/json'}
     
     try:
-        r = requests.get(url, headers=headers)
+        r = http_client.get(url, headers=headers)
         r.raise_for_status()
         
-        all_links = [link['URL'] for link in r.json()['message']['link']]
+        message = r.json()['message']
+        if 'link' not in message:
+            logger.error(f"No links in Crossref record for DOI {doi}")
+            _log_failed_doi(doi, "No links in Crossref record")
+            if cache is not None:
+                cache.set(doi, None)
+            return None
+        all_links = [link['URL'] for link in message['link']]
         unique_links = list(set(all_links))
+        if cache is not None:
+            cache.set(doi, unique_links)
         return unique_links
         
     except requests.exceptions.HTTPError as e:
         # Handle HTTP errors (e.g. 404, 500)
         logger.error(f"HTTP Error for DOI {doi}: {str(e)}")
         _log_failed_doi(doi, f"HTTP Error: {r.status_code}")
+        if cache is not None and r.status_code == 404:
+            cache.set(doi, None)
         return None
     except Exception as e:
         # Handle any other errors
@@ -0,0 +1,66 @@
+'''Persistent SQLite cache of Crossref DOI to full text link lookups'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL = 30 * 24 * 3600            # keep found links for 30 days
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600    # retry DOIs Crossref had no links for after 7 days
+
+
+class LinkCache:
+    '''
+    Maps DOIs to the list of links returned by Crossref, so reruns and the separate
+    ACS/RSC pass do not repeat lookups. DOIs that Crossref answered with 404 (or
+    without any links) are cached as None for the shorter negative_ttl.
+    DOIs are case-insensitive and are stored lower-cased.
+    Safe to share between threads.
+    '''
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS links (doi TEXT PRIMARY KEY, links TEXT, fetched REAL NOT NULL)'
+        )
+        self.conn.commit()
+
+    def get(self, doi):
+        '''
+        Returns (found, links); found is False if the DOI is not cached or has expired
+        links is None for a cached negative result
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT links, fetched FROM links WHERE doi = ?', (doi.lower(),)
+            ).fetchone()
+        if row is None:
+            return False, None
+        links, fetched = row
+        ttl = self.ttl if links is not None else self.negative_ttl
+        if time.time() - fetched > ttl:
+            return False, None
+        return True, (json.loads(links) if links is not None else None)
+
+    def set(self, doi, links):
+        '''
+        Store the links for a DOI, or None for a negative result
+        '''
+        value = json.dumps(links) if links is not None else None
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO links (doi, links, fetched) VALUES (?, ?, ?)',
+                (doi.lower(), value, time.time()),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,5 +1,4 @@
 import os
-import requests
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.chrome.service import Service as ChromeService
@@ -7,10 +6,34 @@ from webdriver_manager.chrome import ChromeDriverManager
 import logging
 import scraper_tools.link as link
 from scraper_tools.utils import read_doi_file, make_batches
+from scraper_tools.driver_pool import DriverPool
+from scraper_tools.link_cache import LinkCache
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import http_client
+from http_client import TokenBucket
+from article_archive import ArchiveWriter
 
 PUB_PREFIX = {"RSC": "10.1039", "ACS": "10.1021", "Nature":"10.1038", "Science":"10.1126", "Frontiers":"10.3389", "MDPI":"10.3390", "Wiley": "10.1002", "Springer":"10.1007", "TandF":"10.1080", "Elsevier":"10.1016", 'IOP': '10.1088'}
 
+# Limits used by the concurrent downloader for each publisher:
+# (requests per second, maximum simultaneous downloads)
+PUB_LIMITS = {
+    "Elsevier": (2.0, 4),
+    "Springer": (1.0, 2),
+    "Wiley": (0.5, 2),
+    "Nature": (0.5, 2),
+    "Science": (0.5, 1),
+    "Frontiers": (0.5, 2),
+    "MDPI": (0.5, 2),
+    "TandF": (0.5, 2),
+    "IOP": (0.5, 1),
+}
+DEFAULT_LIMIT = (0.5, 1)
+CROSSREF_RATE = 10.0    # Crossref link lookups per second, shared by all publishers
+LINK_CACHE_NAME = 'crossref_links.sqlite'   # Crossref link cache, kept in save_dir
+
 
 def setup_logger(name, log_file, level=logging.INFO):
     '''
@@ -26,10 +49,57 @@ def setup_logger(name, log_file, level=logging.INFO):
     return logger
 
 
+def make_firefox_driver():
+    '''
+    Function to start a headless Firefox webdriver
+    '''
+    opts = Options()
+    opts.add_argument("--headless")
+    # options.binary_location = r"C:\Program Files (x86)\Mozilla Firefox\firefox.exe"      #stuff for webdriver to work on windows laptop
+    # driver = webdriver.Firefox(executable_path=r"C:\Users\Piotr\geckodriver.exe", options=options)
+    if os.path.exists("/snap/firefox/current/usr/lib/firefox/firefox"):
+        opts.binary_location = "/snap/firefox/current/usr/lib/firefox/firefox"
+    return webdriver.Firefox(options=opts)
+
+
+def make_chrome_driver(service):
+    '''
+    Function to attach a Chrome webdriver to the Chrome instance opened with remote debugging
+    '''
+    options = webdriver.ChromeOptions()
+    options.add_experimental_option("debuggerAddress", "localhost:9222")
+    options.add_argument("--headless")
+    return webdriver.Chrome(service=service, options=options)
+
+
+def detach_chrome_driver(driver):
+    '''
+    Function to release a webdriver from make_chrome_driver: quit() would close the
+    user's Chrome instance it is attached to, so only the chromedriver service is stopped
+    '''
+    driver.service.stop()
+
+
 class FullTextDownloader:
-    def __init__(self, pub_prefix, api_key):
+    def __init__(self, pub_prefix, api_key, crossref_limiter=None, driver_pool=None, link_cache=None,
+                 archive=None):
         self.pub_prefix = pub_prefix
         self.api_key = api_key
+        self.crossref_limiter = crossref_limiter
+        self.driver_pool = driver_pool
+        self.link_cache = link_cache
+        self.archive = archive
+
+    def save_article(self, doi, save_dir, data):
+        '''
+        Function to save a downloaded page (bytes) to the archive if one is set,
+        otherwise to <doi>.txt in save_dir
+        '''
+        if self.archive is not None:
+            self.archive.add(doi, data)
+            return
+        with open(os.path.join(save_dir, f"{doi.replace('/','-')}.txt"), "wb") as f:
+            f.write(data)
 
     def downloadElsevier(self, doi, save_dir):
         if not os.path.exists(save_dir):
@@ -39,7 +109,7 @@ class FullTextDownloader:
             os.makedirs(save_dir)
 
         article_url = "https://api.elsevier.com/content/article/doi/" + doi
-        article = requests.get(
+        article = http_client.get(
             article_url,
             headers={
                 "x-els-apikey": self.api_key,
@@ -47,8 +117,7 @@ class FullTextDownloader:
                 },
         )
         if article.status_code == 200:
-            with open(os.path.join(save_dir, f"{doi.replace('/','-')}.txt"), "w+", encoding='utf-8') as f:
-                f.write(article.text)
+            self.save_article(doi, save_dir, article.text.encode('utf-8'))
             return True
         elif article.status_code != 200:
             print('Error: ', article.status_code, f'for {doi}')
@@ -56,7 +125,14 @@ class FullTextDownloader:
 
     def link_selector(self, doi, pdf=False):
         prefix = doi[:7]
-        links = link.get_link_from_doi(doi)
+        if self.link_cache is not None:
+            found, links = self.link_cache.get(doi)
+        else:
+            found = False
+        if not found:
+            if self.crossref_limiter is not None:
+                self.crossref_limiter.acquire()
+            links = link.get_link_from_doi(doi, self.link_cache)
 
         if prefix == PUB_PREFIX["RSC"]:
             return link.rsc_link_selector(doi, links, pdf)
@@ -78,35 +154,34 @@ class FullTextDownloader:
     def web_scrape_html(self, doi, link, save_dir):
         '''
         Function to scrape full text html from link using selenium webdriver
+        Uses a driver leased from self.driver_pool if set, otherwise starts a new Firefox
         '''
-        opts = Options()
-        opts.add_argument("--headless")
-        # options.binary_location = r"C:\Program Files (x86)\Mozilla Firefox\firefox.exe"      #stuff for webdriver to work on windows laptop
-        # driver = webdriver.Firefox(executable_path=r"C:\Users\Piotr\geckodriver.exe", options=options)
-        if os.path.exists("/snap/firefox/current/usr/lib/firefox/firefox"):
-            opts.binary_location = "/snap/firefox/current/usr/lib/firefox/firefox"
-        driver = webdriver.Firefox(options=opts)
-        driver.get(link)
-        driver.implicitly_wait(5)
-        page = driver.page_source.encode('utf-8')
-        with open(os.path.join(save_dir, f"{doi.replace('/','-')}.txt"), "wb") as save_file:
-            save_file.write(page)
+        if self.driver_pool is not None:
+            with self.driver_pool.lease() as driver:
+                self._save_page_source(driver, doi, link, save_dir, wait=5)
+            return
+        driver = make_firefox_driver()
+        self._save_page_source(driver, doi, link, save_dir, wait=5)
         driver.close()
 
     def web_scrape_acs_rsc(self, doi, link, save_dir, service):
         '''
         Function download acs and rsc articles using selenium webdriver
         Has to be done using Chrome webdriver
+        Uses a driver leased from self.driver_pool if set, otherwise attaches a new one
         '''
-        options = webdriver.ChromeOptions()
-        options.add_experimental_option("debuggerAddress", "localhost:9222")
-        options.add_argument("--headless")
-        driver = webdriver.Chrome(service=service, options=options)
+        if self.driver_pool is not None:
+            with self.driver_pool.lease() as driver:
+                self._save_page_source(driver, doi, link, save_dir, wait=15)
+            return
+        driver = make_chrome_driver(service)
+        self._save_page_source(driver, doi, link, save_dir, wait=15)
+
+    def _save_page_source(self, driver, doi, link, save_dir, wait):
         driver.get(link)
-        driver.implicitly_wait(15)
+        driver.implicitly_wait(wait)
         page = driver.page_source.encode('utf-8')
-        with open(os.path.join(save_dir, f"{doi.replace('/','-')}.txt"), "wb") as save_file:
-            save_file.write(page)
+        self.save_article(doi, save_dir, page)
 
     def springer_scrape_html(self, doi, save_dir):
         '''
@@ -118,59 +193,116 @@ class FullTextDownloader:
             'Accept': 'text/html',
             'User-Agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=30)
+        r = http_client.get(api_url, stream=True, headers=headers, timeout=30)
         if r.status_code == 200:
-            with open(os.path.join(save_dir, f"{doi.replace('/','-')}.txt"), "wb") as f:
-                f.write(r.content)
+            self.save_article(doi, save_dir, r.content)
             return True
         elif r.status_code != 200:
             print('Error: ', r.status_code, f'for {doi}')
             return False
 
 
-def article_downloader(dois, save_dir, elsevier_api_key, pdf=False):
+def download_doi(downloader, doi, save_dir, pdf=False):
+    '''
+    Function to download a single full text article that is not ACS or RSC
+    Returns True if the article was downloaded
+    '''
+    if doi[:7] == PUB_PREFIX['Elsevier']:
+        return downloader.downloadElsevier(doi, save_dir)
+    elif doi[:7] == PUB_PREFIX['Springer']:
+        return downloader.springer_scrape_html(doi, save_dir)
+    link = downloader.link_selector(doi, pdf)
+    if link is None:
+        print(f'No link found for {doi}')
+        return False
+    downloader.web_scrape_html(doi, link, save_dir)
+    return True
+
+
+def article_downloader(dois, save_dir, elsevier_api_key, pdf=False, driver_pool=None, link_cache=None,
+                       archive=None):
     '''
     Function to download full text articles from list of dois
     '''
     rsc_dois = []
     acs_dois = []
     log = setup_logger('log', os.path.join(save_dir, 'article_downloader.log'))
-    downloader = FullTextDownloader(PUB_PREFIX, elsevier_api_key)
+    downloader = FullTextDownloader(PUB_PREFIX, elsevier_api_key, driver_pool=driver_pool, link_cache=link_cache,
+                                    archive=archive)
     for doi in dois:
         # print(f'Downloading: {doi}')   # for debugging, uncomment to see which doi is being downloaded
-        if doi[:7] == PUB_PREFIX['Elsevier']:
-            result = downloader.downloadElsevier(doi, save_dir)
-            if result is False:
-                log.info(f'Error with downloading: {doi}')
-            else:
-                log.info(f'Downloaded: {doi}')
-        elif doi[:7] == PUB_PREFIX['Springer']:
-            result = downloader.springer_scrape_html(doi, save_dir)
-            if result is False:
-                log.info(f'Error with downloading: {doi}')
-            else:
-                log.info(f'Downloaded: {doi}')
-        elif doi[:7] == PUB_PREFIX['RSC']:
+        if doi[:7] == PUB_PREFIX['RSC']:
             rsc_dois.append(doi)
         elif doi[:7] == PUB_PREFIX['ACS']:
             acs_dois.append(doi)
+        elif download_doi(downloader, doi, save_dir, pdf):
+            log.info(f'Downloaded: {doi}')
         else:
-            link = downloader.link_selector(doi, pdf)
-            if link is not None:
-                downloader.web_scrape_html(doi, link, save_dir)
+            log.info(f'Error with downloading: {doi}')
+    return rsc_dois, acs_dois
+
+
+def _rate_limited_download(bucket, downloader, doi, save_dir, pdf=False):
+    bucket.acquire()
+    return download_doi(downloader, doi, save_dir, pdf)
+
+
+def concurrent_article_downloader(dois, save_dir, elsevier_api_key, pdf=False, limits=PUB_LIMITS, driver_pool=None,
+                                  link_cache=None, archive=None):
+    '''
+    Function to download full text articles from list of dois concurrently
+    Each publisher gets its own thread pool, sized to its concurrency cap, and its own
+    token bucket rate limit, so publishers are throttled independently of each other
+    '''
+    rsc_dois = []
+    acs_dois = []
+    log = setup_logger('log', os.path.join(save_dir, 'article_downloader.log'))
+    downloader = FullTextDownloader(PUB_PREFIX, elsevier_api_key, TokenBucket(CROSSREF_RATE), driver_pool, link_cache,
+                                    archive)
+    prefix_to_pub = {v: k for k, v in PUB_PREFIX.items()}
+    executors = {}
+    buckets = {}
+    futures = {}
+    try:
+        for doi in dois:
+            pub = prefix_to_pub.get(doi[:7], 'Other')
+            if pub == 'RSC':
+                rsc_dois.append(doi)
+                continue
+            elif pub == 'ACS':
+                acs_dois.append(doi)
+                continue
+            if pub not in executors:
+                rate, max_workers = limits.get(pub, DEFAULT_LIMIT)
+                executors[pub] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=pub)
+                buckets[pub] = TokenBucket(rate)
+            future = executors[pub].submit(_rate_limited_download, buckets[pub], downloader, doi, save_dir, pdf)
+            futures[future] = doi
+        for i, future in enumerate(as_completed(futures)):
+            doi = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f'Error downloading {doi}: {e}')
+                result = False
+            if result:
                 log.info(f'Downloaded: {doi}')
-            if link is None:
-                print(f'No link found for {doi}')
+            else:
                 log.info(f'Error with downloading: {doi}')
+            if (i + 1) % 50 == 0:
+                print(f'Downloaded {i+1} of {len(futures)} articles')
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
     return rsc_dois, acs_dois
 
 
-def acs_rsc_article_downloader(dois, save_dir, service, pdf=False):
+def acs_rsc_article_downloader(dois, save_dir, service, pdf=False, driver_pool=None, link_cache=None, archive=None):
     '''
     Function to download acs and rsc articles using selenium webdriver
     '''
     log_acs_rsc = setup_logger('log_acs_rsc', os.path.join(save_dir,'acs_rsc_downloader.log'))
-    downloader = FullTextDownloader(PUB_PREFIX, '')
+    downloader = FullTextDownloader(PUB_PREFIX, '', driver_pool=driver_pool, link_cache=link_cache, archive=archive)
     for doi in dois:
         if doi[:7] == PUB_PREFIX['RSC'] or doi[:7] == PUB_PREFIX['ACS']:
             link = downloader.link_selector(doi, pdf)
@@ -181,20 +313,44 @@ def acs_rsc_article_downloader(dois, save_dir, service, pdf=False):
                 log_acs_rsc.info(f'Error with downloading: {doi}')
 
 
-def download_article_from_doi(file_path, save_dir, elsevier_api_key, pdf=False, batch_size=50):
+def _open_archive(save_dir, compression):
+    return ArchiveWriter(save_dir, compression) if compression is not None else None
+
+
+def download_article_from_doi(file_path, save_dir, elsevier_api_key, pdf=False, batch_size=50, concurrent=False,
+                              browsers=1, pages_per_browser=100, archive=None):
     '''
     Function to download full text articles from a file containing dois
+    With concurrent=True all publishers are downloaded in parallel, each under its own
+    rate limit from PUB_LIMITS, instead of in batches with a fixed pause between them
+    Selenium downloads share a pool of `browsers` Firefox instances, each restarted
+    after `pages_per_browser` pages
+    Crossref link lookups are cached in save_dir across runs
+    With archive set to 'gzip' or 'zstd', pages are appended to a compressed article
+    archive in save_dir instead of being written as one .txt file per DOI
     '''
     dois = read_doi_file(file_path)
-    doi_batches = make_batches(dois, batch_size)
-    all_rsc_dois = []
-    all_acs_dois = []
-    for i, batch in enumerate(doi_batches):
-        print(f'Downloading batch {i+1} of {len(doi_batches)}')
-        rsc_dois, acs_dois = article_downloader(batch, save_dir, elsevier_api_key, pdf)
-        all_rsc_dois.extend(rsc_dois)
-        all_acs_dois.extend(acs_dois)
-        time.sleep(10)
+    link_cache = LinkCache(os.path.join(save_dir, LINK_CACHE_NAME))
+    archive_writer = _open_archive(save_dir, archive)
+    with DriverPool(make_firefox_driver, browsers, pages_per_browser) as driver_pool:
+        if concurrent:
+            all_rsc_dois, all_acs_dois = concurrent_article_downloader(
+                dois, save_dir, elsevier_api_key, pdf, driver_pool=driver_pool, link_cache=link_cache,
+                archive=archive_writer)
+        else:
+            doi_batches = make_batches(dois, batch_size)
+            all_rsc_dois = []
+            all_acs_dois = []
+            for i, batch in enumerate(doi_batches):
+                print(f'Downloading batch {i+1} of {len(doi_batches)}')
+                rsc_dois, acs_dois = article_downloader(batch, save_dir, elsevier_api_key, pdf, driver_pool, link_cache,
+                                                        archive_writer)
+                all_rsc_dois.extend(rsc_dois)
+                all_acs_dois.extend(acs_dois)
+                time.sleep(10)
+    link_cache.close()
+    if archive_writer is not None:
+        archive_writer.close()
     if len(all_rsc_dois) > 0:
         with open(os.path.join(save_dir, 'rsc_dois.txt'), 'w') as f:
             for doi in all_rsc_dois:
@@ -206,15 +362,27 @@ def download_article_from_doi(file_path, save_dir, elsevier_api_key, pdf=False,
     print('Finished downloading articles')
 
 
-def download_acs_rsc_from_doi(file_path, save_dir, pdf=False, batch_size=50):
+def download_acs_rsc_from_doi(file_path, save_dir, pdf=False, batch_size=50, pages_per_browser=100, archive=None):
     '''
     Function to download acs and rsc articles from a file containing rsc or asc dois
+    A single Chrome webdriver is kept attached across articles and re-attached
+    after `pages_per_browser` pages; the Chrome instance itself is left open
+    Crossref link lookups are cached in save_dir across runs
+    With archive set to 'gzip' or 'zstd', pages are appended to a compressed article
+    archive in save_dir instead of being written as one .txt file per DOI
     '''
     dois = read_doi_file(file_path)
     doi_batches = make_batches(dois, batch_size)
     service = ChromeService(ChromeDriverManager().install())
-    for i, batch in enumerate(doi_batches):
-        print(f'Downloading batch {i+1} of {len(doi_batches)}')
-        acs_rsc_article_downloader(batch, save_dir, service, pdf)
-        time.sleep(10)
+    link_cache = LinkCache(os.path.join(save_dir, LINK_CACHE_NAME))
+    archive_writer = _open_archive(save_dir, archive)
+    with DriverPool(lambda: make_chrome_driver(service), 1, pages_per_browser,
+                    close=detach_chrome_driver) as driver_pool:
+        for i, batch in enumerate(doi_batches):
+            print(f'Downloading batch {i+1} of {len(doi_batches)}')
+            acs_rsc_article_downloader(batch, save_dir, service, pdf, driver_pool, link_cache, archive_writer)
+            time.sleep(10)
+    link_cache.close()
+    if archive_writer is not None:
+        archive_writer.close()
     print('Finished downloading articles')
@@ -0,0 +1,149 @@
+'''
+Shared HTTP client for every outbound API and web request in the pipeline
+(Semantic Scholar, Crossref, Elsevier/Scopus, Springer, Nature).
+
+All requests go through one pooled requests.Session per process, so connections
+to each host are kept alive instead of paying a new TCP+TLS handshake per call.
+Failed requests (connection errors, timeouts, HTTP 429 and 5xx) are retried with
+exponential backoff and full jitter, and a Retry-After header from the server is
+honoured when present.
+
+TokenBucket provides a thread-safe requests-per-second budget for callers that
+run requests concurrently against a rate-limited API.
+
+Usage:
+    import http_client
+    response = http_client.get(url, headers=headers, params=params)
+'''
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 30            # seconds, per request attempt
+DEFAULT_RETRIES = 5             # attempts after the first one
+DEFAULT_BACKOFF = 1.0           # base delay in seconds, doubled on each retry
+MAX_BACKOFF = 120.0             # upper bound on any single delay, including Retry-After
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+POOL_MAXSIZE = 32               # kept-alive connections per host
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    '''
+    Return the process-wide pooled session, creating it on first use
+    (and again in a forked child so connections are never shared across processes)
+    '''
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def _retry_after(response):
+    '''
+    Return the delay in seconds requested by a Retry-After header, or None
+    '''
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _backoff(attempt, backoff):
+    '''
+    Full-jitter exponential backoff delay for the given retry attempt (0-based)
+    '''
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+
+def request(method, url, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+            timeout=DEFAULT_TIMEOUT, retry_statuses=RETRY_STATUSES, **kwargs):
+    '''
+    Send a request through the shared session, retrying connection errors, timeouts
+    and retry_statuses up to `retries` times.
+
+    Returns the last response received, which may still have an error status once
+    retries are exhausted; raises the last requests exception if no response was
+    ever received.
+    '''
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            delay = _backoff(attempt, backoff)
+            print(f"Request to {url} failed ({e}), retrying in {delay:.1f} s")
+            time.sleep(delay)
+            continue
+
+        if response.status_code not in retry_statuses or attempt == retries:
+            return response
+
+        delay = _retry_after(response)
+        if delay is None:
+            delay = _backoff(attempt, backoff)
+        delay = min(delay, MAX_BACKOFF)
+        print(f"Error: {response.status_code} from {url}, retrying in {delay:.1f} s "
+              f"(attempt {attempt + 1} of {retries})")
+        response.close()
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    '''
+    GET request through the shared session, see request()
+    '''
+    return request('GET', url, **kwargs)
+
+
+class TokenBucket:
+    '''
+    Token bucket allowing on average `rate` acquisitions per second with bursts
+    of up to `capacity`. acquire() blocks the calling thread until a token is free.
+    '''
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,53 @@
+'''
+Tests for article_archive: a reader opened before forking must still return the
+right pages when the forked processes read from it concurrently.
+'''
+
+import random
+import multiprocessing
+
+import pytest
+
+from article_archive import ArchiveReader, ArchiveWriter
+
+N_PAGES = 200
+
+# reader inherited by the forked workers
+_reader = None
+
+
+def _page(i):
+    # incompressible, so reads are long enough for other processes to seek in between
+    body = random.Random(i).getrandbits(8 * (8000 + i * 37 % 8000)).to_bytes(8000 + i * 37 % 8000, 'big')
+    return f'<html>article {i} '.encode('utf-8') + body.hex().encode('ascii') + b'</html>'
+
+
+def _read_all(seed):
+    # each worker reads every page, in its own order, many times over
+    order = sorted(range(N_PAGES), key=lambda i: (i * seed) % N_PAGES)
+    for _ in range(5):
+        for i in order:
+            if _reader.read(f'10.1000/test.{i}') != _page(i):
+                return False
+    return True
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_forked_workers_share_open_reader(tmp_path):
+    global _reader
+    with ArchiveWriter(str(tmp_path), max_shard_bytes=256 * 1024) as archive:
+        for i in range(N_PAGES):
+            archive.add(f'10.1000/test.{i}', _page(i))
+
+    _reader = ArchiveReader(str(tmp_path))
+    try:
+        # open every shard in the parent, as the table page prefetch does before the pool starts
+        for i in range(N_PAGES):
+            assert _reader.read(f'10.1000/test.{i}') == _page(i)
+        assert len(_reader.shards) > 1
+
+        with multiprocessing.get_context('fork').Pool(8) as pool:
+            assert all(pool.map(_read_all, [1, 3, 7, 11, 13, 17, 19, 23]))
+    finally:
+        _reader.close()
+        _reader = None
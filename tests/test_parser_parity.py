@@ -0,0 +1,23 @@
+'''
+Tests that the lxml backend gives the same extraction output as html.parser on
+the benchmark fixtures: sections, captions, tables and figure URLs of every
+publisher. Table pages are served from the fixtures, so no network is used.
+'''
+
+import pytest
+
+pytest.importorskip('LimeSoup')  # to_json extracts RSC and Elsevier articles with it
+
+import extraction_benchmark
+from article_context import list_articles
+from parser_parity import extract_record, differing_fields
+
+FIXTURE_DIR = extraction_benchmark.FIXTURE_DIR
+
+
+@pytest.mark.parametrize('filename', list_articles(FIXTURE_DIR))
+def test_lxml_matches_html_parser(filename):
+    with extraction_benchmark.offline():
+        baseline = extract_record(filename, FIXTURE_DIR, 'html.parser')
+        candidate = extract_record(filename, FIXTURE_DIR, 'lxml')
+    assert differing_fields(baseline, candidate) == []